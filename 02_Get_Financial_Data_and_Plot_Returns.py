@@ -1,8 +1,13 @@
-import yfinance as yf
 import pandas as pd
 import numpy as np
 import datetime
 import sys
+from portfolio_optimizer import instrument
+from portfolio_optimizer.analytics import asset_metrics
+from portfolio_optimizer.data import YahooPriceSource
+from portfolio_optimizer.intraday import BarStore, intraday_daily_returns
+from portfolio_optimizer.store import PriceStore
+from portfolio_optimizer.validation import MetadataCache, YahooMetadataSource, validate_tickers
 
 ## 1. Set parameters
 
@@ -10,12 +15,43 @@ import sys
 end_Date = pd.Timestamp(datetime.date.today())
 start_Date = end_Date - pd.DateOffset(years=5)
 
-def get_valid_tickers(): #Function to get up to 20 valid stock tickers from the user
+# Maximum number of tickers. For large universes (hundreds of assets) also set cov_method in 03
+# to 'ledoit_wolf' or 'factor'.
+max_tickers = 20
+
+# Where prices come from. Swap in portfolio_optimizer.data.StubPriceSource() to run offline.
+price_source = YahooPriceSource()
+
+# Local price store (one memory-mapped partition per ticker), shared by all the following scripts
+store_dir = 'price_store'
+price_store = PriceStore(store_dir)
+
+# Directory of a bar store holding minute or hourly bars (fill it with `python -m portfolio_optimizer.intraday
+# ingest`). When set, daily returns are built from the bars chunk by chunk, without loading the bar history.
+bar_store_dir = None
+
+# Stage timings, CPU time, peak memory, item counts and chunk throughput are written to metrics_file
+# ('.json', or '.prom' for the Prometheus text format) when set. The PORTFOLIO_METRICS environment variable
+# does the same without editing the scripts.
+metrics_file = None
+if metrics_file:
+    instrument.enable(metrics_file)
+
+# Ticker metadata (validity, name, first trade date) is cached in this file for a week, so tickers that were
+# already validated need no request. Swap in portfolio_optimizer.validation.StubMetadataSource() to run offline.
+ticker_cache = MetadataCache('ticker_cache.json', ttl=7 * 24 * 3600)
+metadata_source = YahooMetadataSource()
+
+# Optional ticker list, e.g. ['AAPL', 'MSFT', 'GOOG'], validated in bulk instead of prompting for each ticker
+ticker_list = None
+
+def get_valid_tickers(price_cache=None, max_tickers=20): #Function to get up to max_tickers valid stock tickers from the user
+    # Price frames downloaded during validation are kept in price_cache so they don't have to be fetched again
     tickers = []
-    print("Please enter up to 20 valid stock tickers from Yahoo Finance.")
-    while len(tickers) < 20:
+    print(f"Please enter up to {max_tickers} valid stock tickers from Yahoo Finance.")
+    while len(tickers) < max_tickers:
         user_input = input(f"Enter ticker {len(tickers)+1} (or press Enter to finish): ").upper().strip() 
-        #The user is being prompted for a new ticker up to 20 tickers but can press enter to finish his selection after having selected 2 assets
+        #The user is being prompted for a new ticker up to max_tickers tickers but can press enter to finish his selection after having selected 2 assets
         if user_input == "":
             if len(tickers) > 1:
                 break
@@ -28,33 +64,16 @@ def get_valid_tickers(): #Function to get up to 20 valid stock tickers from the
             continue
 
         try:
-            stock = yf.Ticker(user_input)
-            stock_info = stock.info
-            
-            # Check if ticker is valid (has a shortName)
-            if 'shortName' in stock_info and stock_info['shortName']:
-                
-                # Fetch up to 5 years of data for the ticker
-                data = yf.download(user_input, start=start_Date, end=end_Date)['Adj Close']
-                
-                if data.empty:
-                    print(f"{user_input} returned no data. Please try another ticker.")
-                    continue
-
-                # Calculate the available history for this ticker
-                first_available_date = data.index[0]
-                last_available_date = data.index[-1]
-                years_of_history = (last_available_date - first_available_date).days / 365.25
-                # Check if we have at least 3 years of data
-                if years_of_history < 3:
-                    print(f"{user_input} does not have at least 3 years of history (only {years_of_history:.2f} years). Please try another ticker.")
-                    continue
-
+            # Valid ticker (has a shortName) with at least 3 years of history, answered from the metadata cache
+            # when possible. Prices downloaded for the check are kept in price_cache.
+            valid, rejected = validate_tickers([user_input], start_Date, end_Date, min_years=3,
+                                               metadata_source=metadata_source, price_source=price_source,
+                                               cache=ticker_cache, price_cache=price_cache)
+            if valid:
                 # If it passes all checks, append the ticker
                 tickers.append(user_input)
-
             else:
-                print(f"{user_input} is not a valid ticker. Please try again.")
+                print(f"{user_input} {rejected[user_input]}. Please try another ticker.")
 
         except Exception as e:
             print(f"Error fetching data for {user_input}: {e}. Please try again.")
@@ -62,7 +81,21 @@ def get_valid_tickers(): #Function to get up to 20 valid stock tickers from the
     print(f"You have selected: {', '.join(tickers)}")
     return tickers
 
-stocks = get_valid_tickers()
+validated_prices = {}
+if ticker_list:
+    # Metadata lookups run concurrently and the history of the remaining tickers is downloaded in one request
+    stocks, rejected = validate_tickers(ticker_list, start_Date, end_Date, min_years=3,
+                                        metadata_source=metadata_source, price_source=price_source,
+                                        cache=ticker_cache, price_cache=validated_prices)
+    for ticker, reason in rejected.items():
+        print(f"{ticker} {reason}. Skipping...")
+    stocks = stocks[:max_tickers]
+    if len(stocks) < 2:
+        print("At least two valid tickers are needed. Exiting...")
+        sys.exit()
+    print(f"You have selected: {', '.join(stocks)}")
+else:
+    stocks = get_valid_tickers(validated_prices, max_tickers)
 
 # Calculate equal weights dynamically (as starting portfolio weights)
 num_stocks = len(stocks)
@@ -72,19 +105,16 @@ print("Portfolio Weights:")
 for stock, weight in portfolio_weights.items():
     print(f"{stock}: {weight:.2%}")
 
-# Initialize an empty DataFrame to hold all stock data
-all_data = pd.DataFrame()
-
 try:
-    print("\nFetching data for stocks...")
+    print("\nUpdating the local price store...")
+    # Only bars newer than the last stored date are fetched. Frames fetched during validation are reused,
+    # any other ticker is downloaded in one batched request (with retries)
+    price_store.refresh(stocks, start_Date, end_Date, source=price_source, cached=validated_prices)
+    all_data = price_store.load_prices(stocks, start=start_Date, end=end_Date)
     for stock in stocks:
-        # Download Adjusted Close Prices for the stock
-        data = yf.download(stock, start=start_Date, end=end_Date)['Adj Close']
-        if data.empty:
+        if stock not in all_data.columns:
             print(f"Warning: No data found for {stock}. Skipping...")
-        else:
-            all_data[stock] = data
-            print("Successfully loaded stock data")
+    print("Successfully loaded stock data")
 except Exception as e:
     print(f"Error fetching data: {e}")
     sys.exit()
@@ -106,18 +136,13 @@ if not all_data.empty:
     print("\nProcessed Data (Tail):")
     print(all_data.tail())
 
-    # Save the processed data to a CSV file
-    output_file = 'portfolio_data_last_5_years.csv'
-    all_data.to_csv(output_file, encoding='UTF-8')
-    print(f"Data successfully saved to {output_file}")
+    print(f"Data successfully saved to the price store in '{store_dir}'")
 else:
     print("No valid stock data available. Exiting...")
 
 # Fetch current risk-free rate from Yahoo Finance
 try:
-    risk_free_ticker = yf.Ticker("^IRX") #Using the 13 week US treasury bill
-    risk_free_data = risk_free_ticker.history(period="1d")
-    risk_free_rate = risk_free_data['Close'].iloc[-1] / 100  # Convert from percentage to decimal
+    risk_free_rate = price_source.risk_free_rate("^IRX") #Using the 13 week US treasury bill, converted from percentage to decimal
     print(f"\nCurrent Risk-Free Rate: {risk_free_rate:.2%}")
 except Exception as e:
     print(f"Error fetching risk-free rate: {e}")
@@ -131,43 +156,25 @@ import numpy as np
 
 ## 1. Load financial data
 
-# Load the financial data from the previous step
-# Load the financial data from the previous step
-data_file = 'portfolio_data_last_5_years.csv'
-financial_data = pd.read_csv(data_file, index_col=0, parse_dates=True)
+# Load the financial data from the previous step (read from the memory-mapped store, no parsing)
+financial_data = price_store.load_prices(stocks, start=start_Date, end=end_Date)
 
 ## 2. Compute daily returns for each stock
 
 # Calculate daily percentage changes (returns)
-daily_returns = financial_data.pct_change().dropna()
+if bar_store_dir:
+    daily_returns = intraday_daily_returns(BarStore(bar_store_dir), stocks, start=start_Date, end=end_Date)
+else:
+    with instrument.stage('returns', rows=len(financial_data)):
+        daily_returns = financial_data.pct_change().dropna()
 
 print("\nDaily Returns (Head):")
 print(daily_returns.head())
 
 ## 3. Compute key metrics for each stock
 
-# Mean daily return
-mean_daily_return = daily_returns.mean()
-
-# Annualized return
-annualized_return = mean_daily_return * 252
-
-# Volatility (standard deviation of daily returns, annualized)
-daily_volatility = daily_returns.std()
-annualized_volatility = daily_volatility * np.sqrt(252)
-
-# Sharpe ratio for each stock
-excess_return = annualized_return - risk_free_rate
-sharpe_ratios = excess_return / annualized_volatility
-
-# Combine metrics into a DataFrame
-metrics = pd.DataFrame({
-    'Mean Daily Return': mean_daily_return,
-    'Annualized Return': annualized_return,
-    'Daily Volatility': daily_volatility,
-    'Annualized Volatility': annualized_volatility,
-    'Sharpe Ratio': sharpe_ratios
-})
+# Mean daily return, annualized return, daily and annualized volatility and Sharpe ratio per stock
+metrics = asset_metrics(daily_returns, risk_free_rate)
 
 print("\nMetrics for Individual Stocks:")
 print(metrics)
@@ -1,59 +1,156 @@
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
+from portfolio_optimizer import instrument
+from portfolio_optimizer.analytics import annualized_moments
+from portfolio_optimizer.cache import ResultCache, cache_key
+from portfolio_optimizer.intraday import BarStore, intraday_daily_returns
+from portfolio_optimizer.optimize import max_sharpe_weights, min_variance_weights, portfolio_row
+from portfolio_optimizer.parallel import parallel_simulate
+from portfolio_optimizer.plotting import FrontierRaster, frontier_line, render_frontier
+from portfolio_optimizer.results import PortfolioResults
+from portfolio_optimizer.samplers import get_sampler, refine_portfolios
+from portfolio_optimizer.store import PriceStore
 
-# Load daily returns
-data_file = 'portfolio_data_last_5_years.csv'
-financial_data = pd.read_csv(data_file, index_col=0, parse_dates=True)
-daily_returns = financial_data.pct_change(fill_method=None).dropna()
+# Load daily returns from the local price store filled in 02 (store_dir, or the intraday bars if bar_store_dir
+# is set in 02)
+if bar_store_dir:
+    daily_returns = intraday_daily_returns(BarStore(bar_store_dir), stocks, start=start_Date, end=end_Date)
+else:
+    price_store = PriceStore(store_dir)
+    financial_data = price_store.load_prices(stocks, start=start_Date, end=end_Date)
+    with instrument.stage('returns', rows=len(financial_data)):
+        daily_returns = financial_data.pct_change(fill_method=None).dropna()
 
 # Define stocks
 stocks = list(daily_returns.columns)
 
+# 'sampling' picks the best of the simulated portfolios, 'exact' solves for the optimal portfolios directly
+# (quadratic and linear programs, needs scipy). The simulated cloud is plotted in both modes.
+optimizer_mode = 'sampling'
+
 # Number of portfolio simulations (increased for better diversity)
 num_portfolios = 100000
 
-# Initialize arrays to store results
-portfolio_returns = []
-portfolio_volatilities = []
-portfolio_sharpe_ratios = []
-portfolio_weights = []
-
-# Simulate portfolios
-for _ in range(num_portfolios):
-    # Generate random weights
-    weights = np.random.random(len(stocks))
-    weights /= np.sum(weights)  # Normalize weights
-    portfolio_weights.append(weights)
-
-    # Portfolio return
-    portfolio_return = np.sum(daily_returns.mean() * weights) * 252
-    portfolio_returns.append(portfolio_return)
-
-    # Portfolio volatility
-    portfolio_volatility = np.sqrt(np.dot(weights.T, np.dot(daily_returns.cov() * 252, weights)))
-    portfolio_volatilities.append(portfolio_volatility)
-
-    # Portfolio Sharpe Ratio
-    sharpe_ratio = (portfolio_return - risk_free_rate) / portfolio_volatility
-    portfolio_sharpe_ratios.append(sharpe_ratio)
-# Convert results to DataFrame
-portfolio_metrics = pd.DataFrame({
-    'Return': portfolio_returns,
-    'Volatility': portfolio_volatilities,
-    'Sharpe Ratio': portfolio_sharpe_ratios
-})
-
-# Add weights to the DataFrame
-for i, stock in enumerate(stocks):
-    portfolio_metrics[stock + ' Weight'] = [w[i] for w in portfolio_weights]
+# How the portfolio weights are drawn: 'uniform' (the original scheme, concentrated around equal weights),
+# 'dirichlet' (uniform on the simplex), 'sobol' or 'halton' (low-discrepancy points, need scipy)
+sampler_name = 'uniform'
+
+# Adaptive refinement: refine_rounds passes that each add refine_samples portfolios drawn around the
+# current frontier (0 disables it). Script 04 also refines around the ES feasibility boundary.
+refine_samples = 0
+refine_rounds = 3
+
+# Portfolios are simulated in chunks: the mean vector and covariance matrix are computed once
+# and each chunk of weights is evaluated with matrix operations. Lower the chunk size to bound memory.
+chunk_size = 100000
+
+# With streaming = True only the frontier portfolios, the max Sharpe and the min volatility portfolio are kept
+# while simulating, so memory no longer grows with num_portfolios. The plots then show the frontier only.
+streaming = False
+
+# Number of processes used for the simulation (1 runs everything in this process)
+workers = 1
+
+# Seed of the simulation. Set an integer to reproduce a run; a given seed gives the same portfolios
+# whatever the number of workers. With None a fresh seed is drawn and printed so the run can be audited.
+seed = None
+seed_fixed = seed is not None
+seed = np.random.SeedSequence(seed).entropy
+print(f"Simulation seed: {seed}")
+
+# Covariance estimator: 'sample' (default), 'ledoit_wolf' (shrinkage) or 'factor' (n_factors principal
+# components plus a diagonal residual, evaluated in O(N*K) per portfolio). Use the latter two for large universes.
+cov_method = 'sample'
+n_factors = 5
+
+# Plot rendering: 'scatter' draws every portfolio (slow for large clouds, needs a display in 04),
+# 'raster' bins the cloud into a max-Sharpe image with the frontier and optimal points drawn on top, and
+# writes the plots to plot_dir as plot_format ('png' or 'svg') files without a display
+render_mode = 'scatter'
+plot_dir = 'plots'
+plot_format = 'png'
+
+# Annualized mean returns and covariance matrix, computed once
+mean_returns, cov_matrix = annualized_moments(daily_returns, cov_method=cov_method, n_factors=n_factors)
+
+# Results are kept as one contiguous weights array plus one array per metric and saved as memory-mappable
+# .npy files in results_dir (load them with PortfolioResults.load). np.float32 weights halve their size.
+weights_dtype = np.float64
+results_dir = 'portfolio_results'
+
+# Simulations are cached on disk in cache_dir (at most cache_max_bytes, least recently used entries are dropped).
+# A re-run with the same prices and settings loads the portfolios instead of simulating them again, and 04
+# caches the ES vector per confidence level. The cache is only used with a seed set above: a fresh seed
+# never hits it, so caching its results would only fill the cache.
+use_cache = True
+cache_dir = 'result_cache'
+cache_max_bytes = 2 * 1024 ** 3
+
+# In raster mode every simulated portfolio is binned while simulating, so the whole cloud can be drawn
+# even when streaming keeps only the frontier
+cloud_raster = FrontierRaster.for_universe(mean_returns, cov_matrix) if render_mode == 'raster' else None
+
+# Look the simulation up in the result cache (keyed by the returns, the risk-free rate and the settings above)
+result_cache = ResultCache(cache_dir, cache_max_bytes) if use_cache and seed_fixed else None
+cache_settings = {'num_portfolios': num_portfolios, 'sampler_name': sampler_name, 'refine_samples': refine_samples,
+                  'refine_rounds': refine_rounds, 'chunk_size': chunk_size, 'streaming': streaming, 'seed': seed,
+                  'cov_method': cov_method, 'n_factors': n_factors, 'weights_dtype': np.dtype(weights_dtype).name}
+results_key = cache_key(daily_returns, risk_free_rate, cache_settings)
+portfolio_results = None
+# A streamed entry only holds the frontier, so it cannot give the raster of the whole cloud
+if result_cache is not None and not (streaming and cloud_raster is not None):
+    portfolio_results = result_cache.get(results_key)
+
+if portfolio_results is not None:
+    print(f"Simulated portfolios loaded from the result cache ({results_key[:12]}).")
+    if cloud_raster is not None:
+        cloud_raster.add(portfolio_results.metrics['Volatility'], portfolio_results.metrics['Return'],
+                         portfolio_results.metrics['Sharpe Ratio'])
+else:
+    # Simulate portfolios (Return, Volatility, Sharpe Ratio and one weight per stock)
+    if streaming:
+        portfolio_results = parallel_simulate(mean_returns, cov_matrix, num_portfolios, risk_free_rate, seed=seed,
+                                              workers=workers, chunk_size=chunk_size, streaming=True,
+                                              sampler=get_sampler(sampler_name),
+                                              raster=cloud_raster).to_results(stocks)
+    else:
+        weights, returns, volatilities, sharpe_ratios, _ = parallel_simulate(
+            mean_returns, cov_matrix, num_portfolios, risk_free_rate, seed=seed, workers=workers,
+            chunk_size=chunk_size, sampler=get_sampler(sampler_name), raster=cloud_raster,
+            weights_dtype=weights_dtype)
+        portfolio_results = PortfolioResults(stocks, weights,
+                                             {'Return': returns, 'Volatility': volatilities,
+                                              'Sharpe Ratio': sharpe_ratios})
+
+    # Resample around the current frontier and add the new portfolios
+    refine_rng = np.random.default_rng([seed, 1])
+    for _ in range(refine_rounds if refine_samples else 0):
+        weights, returns, volatilities, sharpe_ratios, _ = refine_portfolios(
+            portfolio_results.weights, portfolio_results.metrics['Return'], portfolio_results.metrics['Volatility'],
+            mean_returns, cov_matrix, risk_free_rate, refine_samples, refine_rng)
+        if cloud_raster is not None:
+            cloud_raster.add(volatilities, returns, sharpe_ratios)
+        portfolio_results = portfolio_results.append(weights, {'Return': returns, 'Volatility': volatilities,
+                                                               'Sharpe Ratio': sharpe_ratios})
+
+    if result_cache is not None:
+        result_cache.put(results_key, portfolio_results)
+
+portfolio_results.save(results_dir)
+print(f"Simulated portfolios saved to '{results_dir}'.")
 
 # Identify optimal portfolios
-max_sharpe_idx = portfolio_metrics['Sharpe Ratio'].idxmax()  # Maximum Sharpe Ratio
-min_vol_idx = portfolio_metrics['Volatility'].idxmin()       # Minimum Volatility
+if optimizer_mode == 'exact':
+    optimal_sharpe = portfolio_row(max_sharpe_weights(mean_returns, cov_matrix, risk_free_rate),
+                                   mean_returns, cov_matrix, risk_free_rate, stocks)
+    optimal_volatility = portfolio_row(min_variance_weights(cov_matrix),
+                                       mean_returns, cov_matrix, risk_free_rate, stocks)
+else:
+    max_sharpe_idx = int(np.argmax(portfolio_results.metrics['Sharpe Ratio']))  # Maximum Sharpe Ratio
+    min_vol_idx = int(np.argmin(portfolio_results.metrics['Volatility']))       # Minimum Volatility
 
-optimal_sharpe = portfolio_metrics.iloc[max_sharpe_idx]
-optimal_volatility = portfolio_metrics.iloc[min_vol_idx]
+    # Only the two selected rows are turned into tables (metrics and one '<stock> Weight' entry per stock)
+    optimal_sharpe = portfolio_results.row(max_sharpe_idx)
+    optimal_volatility = portfolio_results.row(min_vol_idx)
 
 # Print optimal portfolios
 print("\nPortfolio with Maximum Sharpe Ratio:")
@@ -63,13 +160,26 @@ print("\nPortfolio with Minimum Volatility:")
 print(optimal_volatility)
 
 # Plot the Efficient Frontier
-plt.figure(figsize=(10, 6))
-plt.scatter(portfolio_metrics['Volatility'], portfolio_metrics['Return'], c=portfolio_metrics['Sharpe Ratio'], cmap='viridis', alpha=0.7)
-plt.colorbar(label='Sharpe Ratio')
-plt.scatter(optimal_sharpe['Volatility'], optimal_sharpe['Return'], color='red', label='Max Sharpe Ratio', edgecolors='black')
-plt.scatter(optimal_volatility['Volatility'], optimal_volatility['Return'], color='blue', label='Min Volatility', edgecolors='black')
-plt.title('Efficient Frontier')
-plt.xlabel('Volatility (Risk)')
-plt.ylabel('Return')
-plt.legend()
+if render_mode == 'raster':
+    plot_path = render_frontier(
+        cloud_raster, f"{plot_dir}/efficient_frontier.{plot_format}",
+        frontier=frontier_line(portfolio_results.metrics['Volatility'], portfolio_results.metrics['Return']),
+        points={'Max Sharpe Ratio': (optimal_sharpe['Volatility'], optimal_sharpe['Return'], 'red'),
+                'Min Volatility': (optimal_volatility['Volatility'], optimal_volatility['Return'], 'blue')})
+    print(f"Efficient frontier saved to '{plot_path}'.")
+else:
+    # pyplot (and its GUI backend) is only loaded for interactive plots
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(10, 6))
+    plt.scatter(portfolio_results.metrics['Volatility'], portfolio_results.metrics['Return'], c=portfolio_results.metrics['Sharpe Ratio'], cmap='viridis', alpha=0.7)
+    plt.colorbar(label='Sharpe Ratio')
+    plt.scatter(optimal_sharpe['Volatility'], optimal_sharpe['Return'], color='red', label='Max Sharpe Ratio', edgecolors='black')
+    plt.scatter(optimal_volatility['Volatility'], optimal_volatility['Return'], color='blue', label='Min Volatility', edgecolors='black')
+    plt.title('Efficient Frontier')
+    plt.xlabel('Volatility (Risk)')
+    plt.ylabel('Return')
+    plt.legend()
 
+if instrument.enabled():
+    print(f"Metrics written to '{instrument.write()}'.")
@@ -1,22 +1,12 @@
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-
-def portfolio_monthly_return_series(daily_returns, weights):
-    portfolio_daily_returns = (daily_returns * weights).sum(axis=1)
-    monthly_returns = portfolio_daily_returns.resample('M').sum()
-    return monthly_returns
-
-def compute_es(portfolio_returns, confidence_level=0.95):
-    """
-    Compute the Expected Shortfall (ES) at a given confidence level.
-    ES is the average return of the worst (1 - confidence_level)*100% of months.
-    """
-    sorted_returns = np.sort(portfolio_returns)
-    cutoff_index = int((1 - confidence_level) * len(sorted_returns))
-    tail_losses = sorted_returns[:cutoff_index+1]
-    es = tail_losses.mean()
-    return es
+from portfolio_optimizer import instrument
+from portfolio_optimizer.optimize import max_return_es_weights, portfolio_row
+from portfolio_optimizer.parallel import (parallel_bootstrap_intervals, parallel_es, parallel_risk_measures,
+                                         parallel_simulate)
+from portfolio_optimizer.plotting import FrontierRaster, frontier_line, render_frontier, render_weights
+from portfolio_optimizer.results import PortfolioResults
+from portfolio_optimizer.risk import monthly_asset_returns, portfolio_es, risk_measures
+from portfolio_optimizer.samplers import get_sampler, refine_portfolios
 
 # Prompt for portfolio size
 while True:
@@ -60,29 +50,124 @@ print(f"Portfolio Size: {portfolio_size}")
 print(f"Confidence Level: {confidence_level}")
 print(f"Max Monthly Drawdown (Dollars): {max_drawdown_dollars}")
 
+# Also write the feasible portfolios to a CSV file (text, slow for large simulations)
+export_csv = False
+
+# Also report the VaR and ES of compounded weekly, monthly and quarterly returns at risk_confidence_levels and the
+# true peak-to-trough max drawdown of the optimal portfolio, and add them as columns to the feasible portfolios
+risk_report = False
+risk_confidence_levels = (0.95, 0.99)
+
+# Also add stationary block-bootstrap quantiles ('Return q0.05', 'ES q0.95', ...) of the return, volatility, Sharpe
+# ratio and ES of the feasible portfolios, from bootstrap_resamples resamples of the daily returns (blocks of
+# bootstrap_block_length days on average). With robust_quantile set (e.g. 0.05, one of bootstrap_quantiles), a
+# portfolio is only feasible if its ES at that bootstrap quantile still meets the drawdown limit; in exact mode an
+# optimum that fails it is replaced by the best robust-feasible simulated portfolio.
+bootstrap_report = False
+bootstrap_resamples = 1000
+bootstrap_block_length = 20
+bootstrap_quantiles = (0.05, 0.5, 0.95)
+robust_quantile = None
+
+if robust_quantile is not None:
+    if not bootstrap_report:
+        raise ValueError("robust_quantile needs bootstrap_report = True.")
+    if robust_quantile not in bootstrap_quantiles:
+        raise ValueError(f"robust_quantile {robust_quantile:g} must be one of bootstrap_quantiles "
+                         f"{tuple(bootstrap_quantiles)}.")
+
 # Compute ES for each portfolio and convert to dollar terms
-es_list = []
-for i in range(len(portfolio_metrics)):
-    w = []
-    for stock in stocks:
-        w.append(portfolio_metrics.iloc[i][stock + ' Weight'])
-    w = np.array(w)
-    
-    monthly_returns = portfolio_monthly_return_series(daily_returns, w)
-    es = compute_es(monthly_returns, confidence_level=confidence_level)
-    es_list.append(es)
+# Monthly portfolio returns are linear in the weights: build the per-asset monthly return matrix once
+# and evaluate all portfolios with one (chunked) matrix multiply
+monthly_returns = monthly_asset_returns(daily_returns)
 
-portfolio_metrics['ES'] = es_list
-portfolio_metrics['ES_dollars'] = portfolio_metrics['ES'] * portfolio_size
+# 04 works on its own copy of the portfolio set (ES added, refined portfolios appended) and of the raster:
+# 03's portfolio_results and cloud_raster stay as they are, so 04 can be re-run with other settings
+if streaming:
+    # The ES frontier has to be found while simulating: re-run the streaming simulation (same seed, so the
+    # same portfolios as in 03) with ES per chunk and keep the portfolios that are nondominated in
+    # return vs. volatility and return vs. ES
+    es_results = parallel_simulate(mean_returns, cov_matrix, num_portfolios, risk_free_rate, seed=seed,
+                                   workers=workers, chunk_size=chunk_size, monthly_returns=monthly_returns,
+                                   confidence_level=confidence_level, streaming=True,
+                                   sampler=get_sampler(sampler_name)).to_results(stocks)
+    es_results.weights = es_results.weights.astype(weights_dtype, copy=False)
+else:
+    if result_cache is not None and results_key in result_cache:
+        # ES vectors are cached per confidence level next to the simulation from 03, computed over the
+        # cached entry's own portfolios
+        es = result_cache.es(
+            results_key, confidence_level,
+            lambda: parallel_es(monthly_returns, result_cache.get(results_key).weights,
+                                confidence_level=confidence_level, workers=workers))
+    else:
+        es = parallel_es(monthly_returns, portfolio_results.weights, confidence_level=confidence_level,
+                         workers=workers)
+    es_results = PortfolioResults(stocks, portfolio_results.weights, dict(portfolio_results.metrics, ES=es))
+
+es_raster = None
+if cloud_raster is not None:
+    es_raster = FrontierRaster(cloud_raster.volatility_range, cloud_raster.return_range,
+                               cloud_raster.bins).merge(cloud_raster)
+
+# Adaptive refinement around the frontiers and the ES feasibility boundary (settings from 03)
+refine_rng = np.random.default_rng([seed, 2])
+for _ in range(refine_rounds if refine_samples else 0):
+    refined = refine_portfolios(
+        es_results.weights, es_results.metrics['Return'], es_results.metrics['Volatility'],
+        mean_returns, cov_matrix, risk_free_rate, refine_samples, refine_rng, es=es_results.metrics['ES'],
+        monthly_returns=monthly_returns, confidence_level=confidence_level,
+        min_es=-max_drawdown_dollars / portfolio_size)
+    es_results = es_results.append(refined[0], dict(zip(['Return', 'Volatility', 'Sharpe Ratio', 'ES'], refined[1:])))
+    if es_raster is not None:
+        es_raster.add(refined[2], refined[1], refined[3])
+
+es_results.metrics['ES_dollars'] = es_results.metrics['ES'] * portfolio_size
 
 
 # Filter portfolios to those that meet the user's ES dollar threshold
-feasible_portfolios = portfolio_metrics[portfolio_metrics['ES_dollars'] >= (-max_drawdown_dollars)]
+feasible_portfolios = es_results.subset(es_results.metrics['ES_dollars'] >= (-max_drawdown_dollars))
+
+if bootstrap_report and len(feasible_portfolios):
+    feasible_portfolios.metrics.update(parallel_bootstrap_intervals(
+        daily_returns, feasible_portfolios.weights,
+        num_resamples=bootstrap_resamples, mean_block_length=bootstrap_block_length, quantiles=bootstrap_quantiles,
+        risk_free_rate=risk_free_rate, confidence_level=confidence_level, seed=[seed, 3], workers=workers))
+    if robust_quantile is not None:
+        # Robust feasibility: the ES constraint must also hold at the chosen bootstrap quantile
+        robust_es = feasible_portfolios.metrics[f"ES q{robust_quantile:g}"] * portfolio_size
+        print(f"{int((robust_es >= -max_drawdown_dollars).sum())} of {len(feasible_portfolios)} feasible portfolios "
+              f"meet the ES constraint at the {robust_quantile:g} bootstrap quantile.")
+        feasible_portfolios = feasible_portfolios.subset(robust_es >= -max_drawdown_dollars)
 
-# Among feasible portfolios, choose the one with the highest return
-if not feasible_portfolios.empty:
-    optimal_portfolio = feasible_portfolios.loc[feasible_portfolios['Return'].idxmax()]
-    print("\nOptimal portfolio that meets the ES constraints (from feasible set):")
+# Choose the portfolio with the highest return that meets the ES constraint
+optimal_portfolio = None
+use_simulated = optimizer_mode != 'exact'
+if optimizer_mode == 'exact':
+    # Linear program over all long-only portfolios (Rockafellar-Uryasev form of the ES constraint)
+    optimal_weights = max_return_es_weights(mean_returns, monthly_returns, confidence_level,
+                                            max_drawdown_dollars / portfolio_size)
+    if optimal_weights is not None:
+        optimal_portfolio = portfolio_row(optimal_weights, mean_returns, cov_matrix, risk_free_rate, stocks)
+        optimal_portfolio['ES'] = portfolio_es(monthly_returns, optimal_weights, confidence_level=confidence_level)[0]
+        optimal_portfolio['ES_dollars'] = optimal_portfolio['ES'] * portfolio_size
+    if optimal_portfolio is not None and robust_quantile is not None:
+        # The LP only constrains the historical sample: check its optimum at the robust bootstrap quantile too
+        robust_es = parallel_bootstrap_intervals(
+            daily_returns, optimal_weights, num_resamples=bootstrap_resamples, mean_block_length=bootstrap_block_length,
+            quantiles=[robust_quantile], risk_free_rate=risk_free_rate, confidence_level=confidence_level,
+            seed=[seed, 3], workers=1)[f"ES q{robust_quantile:g}"][0]
+        if robust_es * portfolio_size < -max_drawdown_dollars:
+            print(f"The exact optimum does not meet the ES constraint at the {robust_quantile:g} bootstrap quantile; "
+                  f"choosing the best robust-feasible simulated portfolio instead.")
+            optimal_portfolio = None
+            use_simulated = True
+if use_simulated and len(feasible_portfolios):
+    # Among feasible portfolios, choose the one with the highest return
+    optimal_portfolio = feasible_portfolios.row(int(np.argmax(feasible_portfolios.metrics['Return'])))
+
+if optimal_portfolio is not None:
+    print("\nOptimal portfolio that meets the ES constraints:")
     print(optimal_portfolio)
 
     print("\nOptimal Portfolio Weights:")
@@ -93,45 +178,100 @@ if not feasible_portfolios.empty:
     print(f"Volatility: {optimal_portfolio['Volatility']:.2%}")
     print(f"ES (as fraction): {optimal_portfolio['ES']:.2%}")
     print(f"ES (in dollars): ${optimal_portfolio['ES_dollars']:.2f}")
-    
-    # Save feasible portfolios
-    feasible_portfolios.to_csv("feasible_portfolios.csv", index=False)
-    print("Feasible portfolios saved to 'feasible_portfolios.csv'.")
 else:
     print("No portfolio meets the given ES dollar loss constraints.")
-    optimal_portfolio = None
+
+if risk_report:
+    # One chunked pass over the daily returns per set of portfolios, all horizons and levels at once
+    if len(feasible_portfolios):
+        feasible_portfolios.metrics.update(parallel_risk_measures(
+            daily_returns, feasible_portfolios.weights, workers=workers,
+            confidence_levels=risk_confidence_levels))
+    if optimal_portfolio is not None:
+        optimal_risk = risk_measures(daily_returns, [optimal_portfolio[stock + ' Weight'] for stock in stocks],
+                                     confidence_levels=risk_confidence_levels)
+        print("\nRisk of the optimal portfolio (compounded returns):")
+        for name, values in optimal_risk.items():
+            print(f"{name}: {values[0]:.2%} (${values[0] * portfolio_size:.2f})")
+
+if bootstrap_report and optimal_portfolio is not None:
+    optimal_intervals = parallel_bootstrap_intervals(
+        daily_returns, [optimal_portfolio[stock + ' Weight'] for stock in stocks], num_resamples=bootstrap_resamples,
+        mean_block_length=bootstrap_block_length, quantiles=bootstrap_quantiles, risk_free_rate=risk_free_rate,
+        confidence_level=confidence_level, seed=[seed, 3], workers=1)
+    print("\nBootstrap quantiles of the optimal portfolio:")
+    for name, values in optimal_intervals.items():
+        print(f"{name}: {values[0]:.4f}")
+
+if len(feasible_portfolios):
+    # Save feasible portfolios as memory-mappable arrays (and as CSV if export_csv is set)
+    feasible_portfolios.save("feasible_portfolios")
+    print("Feasible portfolios saved to 'feasible_portfolios'.")
+    if export_csv:
+        feasible_portfolios.to_csv("feasible_portfolios.csv")
+        print("Feasible portfolios saved to 'feasible_portfolios.csv'.")
+
+# Write the metrics before the plot windows block (the file is rewritten again when Python exits)
+if instrument.enabled():
+    print(f"Metrics written to '{instrument.write()}'.")
 
 #############################################
 # Plot the Efficient Frontier, Feasible Portfolios, and Highlight the Optimal Portfolio
 #############################################
 
-plt.figure(figsize=(10, 6))
+if render_mode == 'raster':
+    # Density of all simulated portfolios (binned in 03), with the frontier of the feasible portfolios on top
+    feasible_boundary = None
+    if len(feasible_portfolios):
+        feasible_boundary = frontier_line(feasible_portfolios.metrics['Volatility'],
+                                          feasible_portfolios.metrics['Return'])
+    optimal_point = {}
+    if optimal_portfolio is not None:
+        optimal_point['Feasible Optimal Portfolio'] = (optimal_portfolio['Volatility'], optimal_portfolio['Return'],
+                                                       'green')
+    plot_path = render_frontier(
+        es_raster, f"{plot_dir}/efficient_frontier_es.{plot_format}", color_by='density',
+        frontier=frontier_line(es_results.metrics['Volatility'], es_results.metrics['Return']),
+        feasible_boundary=feasible_boundary, points=optimal_point,
+        title='Efficient Frontier with ES Constraints (Monthly)', xlabel='Volatility (Std. Deviation)',
+        ylabel='Annualized Return')
+    print(f"Efficient frontier saved to '{plot_path}'.")
+    if optimal_portfolio is not None:
+        plot_path = render_weights([optimal_portfolio[stock + ' Weight'] for stock in stocks], stocks,
+                                   f"{plot_dir}/es_optimal_weights.{plot_format}",
+                                   title="Portfolio Weights for the ES-Optimal Portfolio")
+        print(f"Portfolio weights saved to '{plot_path}'.")
+else:
+    # pyplot (and its GUI backend) is only loaded for interactive plots
+    import matplotlib.pyplot as plt
 
-# Plot all portfolios
-plt.scatter(portfolio_metrics['Volatility'], portfolio_metrics['Return'], 
-            color='blue', alpha=0.5, label='All Portfolios')
+    plt.figure(figsize=(10, 6))
 
-# Plot only the feasible portfolios (that meet the ES constraint)
-if not feasible_portfolios.empty:
-    plt.scatter(feasible_portfolios['Volatility'], feasible_portfolios['Return'], 
-                color='orange', alpha=0.7, label='ES-Feasible Portfolios')
+    # Plot all portfolios
+    plt.scatter(es_results.metrics['Volatility'], es_results.metrics['Return'], 
+                color='blue', alpha=0.5, label='All Portfolios')
 
-# Highlight the chosen feasible optimal portfolio on the plot
-if optimal_portfolio is not None:
-    plt.scatter(optimal_portfolio['Volatility'], optimal_portfolio['Return'], 
-                color='green', s=120, edgecolors='black', 
-                label='Feasible Optimal Portfolio')
+    # Plot only the feasible portfolios (that meet the ES constraint)
+    if len(feasible_portfolios):
+        plt.scatter(feasible_portfolios.metrics['Volatility'], feasible_portfolios.metrics['Return'], 
+                    color='orange', alpha=0.7, label='ES-Feasible Portfolios')
 
-plt.title('Efficient Frontier with ES Constraints (Monthly)')
-plt.xlabel('Volatility (Std. Deviation)')
-plt.ylabel('Annualized Return')
-plt.legend()
-plt.show()
+    # Highlight the chosen feasible optimal portfolio on the plot
+    if optimal_portfolio is not None:
+        plt.scatter(optimal_portfolio['Volatility'], optimal_portfolio['Return'], 
+                    color='green', s=120, edgecolors='black', 
+                    label='Feasible Optimal Portfolio')
 
-# Plot the Portfolio Weights for the ES-optimal portfolio (if it exists)
-if optimal_portfolio is not None:
-    plt.figure(figsize=(8, 8))
-    optimal_portfolio_weights = [optimal_portfolio[stock + ' Weight'] for stock in stocks]
-    plt.pie(optimal_portfolio_weights, labels=stocks, autopct='%1.1f%%', startangle=140)
-    plt.title("Portfolio Weights for the ES-Optimal Portfolio")
+    plt.title('Efficient Frontier with ES Constraints (Monthly)')
+    plt.xlabel('Volatility (Std. Deviation)')
+    plt.ylabel('Annualized Return')
+    plt.legend()
     plt.show()
+
+    # Plot the Portfolio Weights for the ES-optimal portfolio (if it exists)
+    if optimal_portfolio is not None:
+        plt.figure(figsize=(8, 8))
+        optimal_portfolio_weights = [optimal_portfolio[stock + ' Weight'] for stock in stocks]
+        plt.pie(optimal_portfolio_weights, labels=stocks, autopct='%1.1f%%', startangle=140)
+        plt.title("Portfolio Weights for the ES-Optimal Portfolio")
+        plt.show()
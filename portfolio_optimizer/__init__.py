@@ -0,0 +1,51 @@
+"""
+Helper package for the portfolio optimization scripts (02-05).
+The numbered scripts stay the entry points; the heavy lifting lives here.
+
+The main names are available from the package itself. They are imported on
+first use, so `import portfolio_optimizer` costs nothing and a run only pays for
+the modules it touches. yfinance, scipy, matplotlib and numba are imported inside
+the functions that need them; the imports of a computation from the local price
+store or result cache never load them.
+
+    from portfolio_optimizer import PriceStore, portfolio_es
+"""
+import importlib
+
+_EXPORTS = {
+    # data
+    'YahooPriceSource': 'data', 'StubPriceSource': 'data', 'fetch_prices': 'data',
+    'PriceStore': 'store', 'BarStore': 'intraday', 'intraday_daily_returns': 'intraday',
+    'validate_tickers': 'validation', 'MetadataCache': 'validation',
+    # analytics
+    'asset_metrics': 'analytics', 'annualized_moments': 'analytics', 'portfolio_frame': 'analytics',
+    'estimate_covariance': 'covariance', 'get_sampler': 'samplers', 'refine_portfolios': 'samplers',
+    'FrontierReducer': 'frontier', 'PortfolioResults': 'results',
+    'ResultCache': 'cache', 'cache_key': 'cache',
+    'parallel_simulate': 'parallel', 'parallel_es': 'parallel', 'parallel_risk_measures': 'parallel',
+    'max_sharpe_weights': 'optimize', 'min_variance_weights': 'optimize', 'max_return_es_weights': 'optimize',
+    # risk
+    'monthly_asset_returns': 'risk', 'portfolio_es': 'risk', 'risk_measures': 'risk',
+    'RollingMoments': 'rolling', 'rolling_snapshots': 'rolling',
+    'BacktestSettings': 'backtest', 'walk_forward': 'backtest',
+    # plotting
+    'FrontierRaster': 'plotting', 'frontier_line': 'plotting', 'render_frontier': 'plotting',
+    'render_weights': 'plotting',
+    # pipeline
+    'Pipeline': 'pipeline', 'Stage': 'pipeline', 'default_stages': 'pipeline',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f"{__name__}.{module}"), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+from portfolio_optimizer import kernels
+from portfolio_optimizer.covariance import estimate_covariance
+
+TRADING_DAYS = 252
+
+
+def annualized_moments(daily_returns, cov_method='sample', n_factors=5):
+    """
+    Compute the annualized mean return vector and covariance matrix once.
+    Returns the mean (n_assets,) and the covariance: a (n_assets, n_assets) array,
+    or a FactorCovariance for cov_method='factor' (see portfolio_optimizer.covariance).
+    """
+    mean_returns = daily_returns.mean().to_numpy() * TRADING_DAYS
+    if cov_method == 'sample':
+        cov_matrix = daily_returns.cov().to_numpy() * TRADING_DAYS
+    else:
+        cov_matrix = estimate_covariance(daily_returns, cov_method, n_factors) * TRADING_DAYS
+    return mean_returns, cov_matrix
+
+
+def asset_metrics(daily_returns, risk_free_rate=0.0):
+    """
+    Key metrics for each stock: mean daily return, annualized return,
+    daily and annualized volatility and Sharpe ratio.
+    """
+    # Mean daily return
+    mean_daily_return = daily_returns.mean()
+
+    # Annualized return
+    annualized_return = mean_daily_return * TRADING_DAYS
+
+    # Volatility (standard deviation of daily returns, annualized)
+    daily_volatility = daily_returns.std()
+    annualized_volatility = daily_volatility * np.sqrt(TRADING_DAYS)
+
+    # Sharpe ratio for each stock
+    excess_return = annualized_return - risk_free_rate
+    sharpe_ratios = excess_return / annualized_volatility
+
+    return pd.DataFrame({
+        'Mean Daily Return': mean_daily_return,
+        'Annualized Return': annualized_return,
+        'Daily Volatility': daily_volatility,
+        'Annualized Volatility': annualized_volatility,
+        'Sharpe Ratio': sharpe_ratios
+    })
+
+
+def random_weights(rng, size, n_assets):
+    """
+    Draw `size` long-only portfolios as a (size x n_assets) matrix.
+    Same scheme as the original loop: uniform draws normalized to sum to 1.
+    """
+    weights = rng.random((size, n_assets))
+    weights /= weights.sum(axis=1, keepdims=True)
+    return weights
+
+
+def evaluate_portfolios(weights, mean_returns, cov_matrix, risk_free_rate=0.0):
+    """
+    Return, volatility and Sharpe ratio for every row of a weight matrix.
+    """
+    if kernels.active() and not hasattr(cov_matrix, 'portfolio_variance'):
+        # Fused numba kernel (see portfolio_optimizer.kernels)
+        return kernels.fused_evaluate(weights, mean_returns, cov_matrix, risk_free_rate)
+    returns = weights @ mean_returns
+    if hasattr(cov_matrix, 'portfolio_variance'):
+        # Factor model: O(N * K) per portfolio through the factor exposures
+        volatilities = np.sqrt(cov_matrix.portfolio_variance(weights))
+    else:
+        # Row-wise quadratic form w' C w without building a (size x size) matrix
+        volatilities = np.sqrt(np.einsum('ij,ij->i', weights @ cov_matrix, weights))
+    sharpe_ratios = (returns - risk_free_rate) / volatilities
+    return returns, volatilities, sharpe_ratios
+
+
+def block_rng(seed, block):
+    """
+    Independent random stream for chunk number `block` of a seeded simulation.
+    Every chunk has its own stream spawned from `seed`, so the portfolios drawn
+    do not depend on how the chunks are spread over workers.
+    """
+    entropy = seed.entropy if isinstance(seed, np.random.SeedSequence) else seed
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(block,)))
+
+
+def portfolio_frame(stocks, weights, returns, volatilities, sharpe_ratios, es=None):
+    """
+    Build the portfolio_metrics DataFrame: 'Return', 'Volatility', 'Sharpe Ratio'
+    (and 'ES' if given), then one '<stock> Weight' column per asset.
+    """
+    portfolio_metrics = pd.DataFrame({
+        'Return': returns,
+        'Volatility': volatilities,
+        'Sharpe Ratio': sharpe_ratios
+    })
+    if es is not None:
+        portfolio_metrics['ES'] = es
+    for i, stock in enumerate(stocks):
+        portfolio_metrics[stock + ' Weight'] = weights[:, i]
+    return portfolio_metrics
+
@@ -0,0 +1,190 @@
+"""
+Walk-forward backtest of the ES-constrained portfolio choice of script 04.
+
+At every rebalance date the portfolio is selected again on a trailing window:
+the highest-return portfolio whose monthly ES loss stays within
+max_drawdown_dollars. Its weights are then held out of sample until the next
+rebalance, and every realized monthly loss is checked against the limit.
+The monthly return matrix is built once and sliced per window; the mean vector
+and covariance matrix of each window come from rolling.rolling_snapshots, which
+moves from one window to the next with incremental updates. Windows are
+independent, so they run in parallel on a process pool.
+
+    python -m portfolio_optimizer.backtest --tickers AAPL MSFT VB --portfolio-size 100000 --max-drawdown 8000
+"""
+import argparse
+import datetime
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from portfolio_optimizer import kernels
+from portfolio_optimizer.analytics import block_rng, evaluate_portfolios, random_weights
+from portfolio_optimizer.parallel import SharedArrays, attach_arrays
+from portfolio_optimizer.risk import monthly_asset_returns, portfolio_es
+from portfolio_optimizer.rolling import rolling_snapshots
+
+
+@dataclass
+class BacktestSettings:
+    portfolio_size: float
+    confidence_level: float
+    max_drawdown_dollars: float
+    window_months: int = 36           # length of the trailing in-sample window
+    hold_months: int = 1              # months between rebalances
+    method: str = 'exact'             # 'exact' (linear program) or 'sampling' (best of num_portfolios draws)
+    num_portfolios: int = 100000
+    seed: int = 0
+    risk_free_rate: float = 0.0
+
+
+def select_portfolio(mean_returns, monthly_returns, settings, window_id=0):
+    """
+    Highest-return long-only portfolio with ES_dollars >= -max_drawdown_dollars given the
+    in-sample annualized mean returns and monthly (months x assets) return matrix.
+    Returns None when no portfolio meets the constraint.
+    """
+    max_loss_fraction = settings.max_drawdown_dollars / settings.portfolio_size
+    if settings.method == 'exact':
+        from portfolio_optimizer.optimize import max_return_es_weights
+        return max_return_es_weights(mean_returns, monthly_returns, settings.confidence_level, max_loss_fraction)
+
+    # Every window draws from its own stream, so results do not depend on the number of workers
+    weights = random_weights(block_rng(settings.seed, window_id), settings.num_portfolios, len(mean_returns))
+    es = portfolio_es(monthly_returns, weights, confidence_level=settings.confidence_level)
+    feasible = np.flatnonzero(es >= -max_loss_fraction)
+    if len(feasible) == 0:
+        return None
+    return weights[feasible[np.argmax(weights[feasible] @ mean_returns)]]
+
+
+def _run_window(spec, window_id, in_sample_months, out_of_sample_months, settings):
+    arrays, handles = attach_arrays(spec)
+    try:
+        mean_returns, cov_matrix = arrays['mean'][window_id], arrays['cov'][window_id]
+        in_sample = arrays['monthly'][slice(*in_sample_months)]
+        weights = select_portfolio(mean_returns, in_sample, settings, window_id)
+        if weights is None:
+            return window_id, None, None, None
+        in_sample_es = portfolio_es(in_sample, weights, confidence_level=settings.confidence_level)[0]
+        expected_return, volatility, _ = evaluate_portfolios(weights[None, :], mean_returns, np.atleast_2d(cov_matrix),
+                                                             settings.risk_free_rate)
+        realized = arrays['monthly'][slice(*out_of_sample_months)] @ weights
+        return window_id, weights, (expected_return[0], volatility[0], in_sample_es), realized
+    finally:
+        del arrays
+        for handle in handles:
+            handle.close()
+
+
+def walk_forward(daily_returns, settings, workers=None):
+    """
+    Run the walk-forward backtest. Returns (monthly, summary):
+    monthly has one row per out-of-sample month (rebalance date, chosen weights, in-sample
+    estimates, realized return, realized loss in dollars and whether the limit was breached);
+    summary holds the hit rate (share of months within max_drawdown_dollars) and related counts.
+    """
+    stocks = list(daily_returns.columns)
+    monthly_frame = monthly_asset_returns(daily_returns)
+    months = monthly_frame.index
+    # Month position of every trading day, to find the days of every window
+    day_month = months.searchsorted(daily_returns.index.to_period('M').to_timestamp(how='end').normalize())
+
+    tasks = []
+    for window_id, first_out in enumerate(range(settings.window_months, len(months), settings.hold_months)):
+        first_in = first_out - settings.window_months
+        last_out = min(first_out + settings.hold_months, len(months))
+        day_range = (int(np.searchsorted(day_month, first_in)), int(np.searchsorted(day_month, first_out)))
+        tasks.append((window_id, day_range, (first_in, first_out), (first_out, last_out)))
+    if not tasks:
+        raise ValueError(f"Need more than {settings.window_months} months of data for the backtest.")
+
+    # Annualized in-sample moments of every window, updated incrementally from one window to the next
+    snapshots = [snapshot.annualized_moments()
+                 for snapshot in rolling_snapshots(daily_returns, None, ranges=[task[1] for task in tasks])]
+    workers = workers or os.cpu_count() or 1
+    inputs = {'monthly': monthly_frame.to_numpy(dtype=float),
+              'mean': np.array([mean for mean, _ in snapshots]), 'cov': np.array([cov for _, cov in snapshots])}
+    with SharedArrays(inputs) as shared:
+        arguments = [(shared.spec, window_id, in_sample_months, out_of_sample_months, settings)
+                     for window_id, _, in_sample_months, out_of_sample_months in tasks]
+        if workers == 1:
+            results = [_run_window(*args) for args in arguments]
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=kernels.limit_threads) as pool:
+                results = list(pool.map(_run_window, *zip(*arguments)))
+
+    rows = []
+    for (window_id, _, _, (first_out, last_out)), (_, weights, estimates, realized) in zip(tasks, results):
+        for k, month in enumerate(range(first_out, last_out)):
+            row = {'Rebalance Date': months[first_out - 1], 'Month': months[month], 'Feasible': weights is not None}
+            if weights is None:
+                # No portfolio met the constraint: the money stays in cash for the period
+                row['Realized Return'] = 0.0
+            else:
+                row['Expected Return'], row['Volatility'], row['ES'] = estimates
+                row['ES_dollars'] = estimates[2] * settings.portfolio_size
+                row['Realized Return'] = realized[k]
+                row.update({stock + ' Weight': weight for stock, weight in zip(stocks, weights)})
+            row['Realized Loss Dollars'] = -row['Realized Return'] * settings.portfolio_size
+            row['Breach'] = row['Realized Loss Dollars'] > settings.max_drawdown_dollars
+            rows.append(row)
+    monthly = pd.DataFrame(rows)
+
+    summary = {
+        'Months': len(monthly),
+        'Rebalances': len(tasks),
+        'Infeasible Rebalances': int(sum(weights is None for _, weights, _, _ in results)),
+        'Breaches': int(monthly['Breach'].sum()),
+        'Hit Rate': 1 - monthly['Breach'].mean(),
+        'Worst Monthly Loss Dollars': monthly['Realized Loss Dollars'].max(),
+        'Cumulative Return': (1 + monthly['Realized Return']).prod() - 1,
+    }
+    return monthly, summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', nargs='+', required=True)
+    parser.add_argument('--portfolio-size', type=float, required=True)
+    parser.add_argument('--confidence-level', type=float, default=0.95)
+    parser.add_argument('--max-drawdown', type=float, required=True, help='maximum accepted monthly loss in dollars')
+    parser.add_argument('--store', default='price_store', help='price store filled by script 02')
+    parser.add_argument('--years', type=int, default=10, help='years of history to use')
+    parser.add_argument('--window-months', type=int, default=36)
+    parser.add_argument('--hold-months', type=int, default=1)
+    parser.add_argument('--method', choices=['exact', 'sampling'], default='sampling', help="'exact' needs scipy")
+    parser.add_argument('--num-portfolios', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--risk-free-rate', type=float, default=0.0)
+    parser.add_argument('--output', default='backtest_results.csv')
+    args = parser.parse_args(argv)
+
+    from portfolio_optimizer.store import PriceStore
+
+    end_date = pd.Timestamp(datetime.date.today())
+    start_date = end_date - pd.DateOffset(years=args.years)
+    financial_data = PriceStore(args.store).load_prices(args.tickers, start=start_date, end=end_date)
+    daily_returns = financial_data.pct_change(fill_method=None).dropna()
+    missing = sorted(set(args.tickers) - set(daily_returns.columns))
+    if missing:
+        print(f"Warning: no stored prices for {', '.join(missing)}. Run script 02 first.")
+
+    settings = BacktestSettings(args.portfolio_size, args.confidence_level, args.max_drawdown,
+                                window_months=args.window_months, hold_months=args.hold_months, method=args.method,
+                                num_portfolios=args.num_portfolios, seed=args.seed, risk_free_rate=args.risk_free_rate)
+    monthly, summary = walk_forward(daily_returns, settings, workers=args.workers)
+    monthly.to_csv(args.output, index=False)
+    for name, value in summary.items():
+        print(f"{name}: {value}")
+    print(f"Monthly results saved to '{args.output}'.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
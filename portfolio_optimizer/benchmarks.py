@@ -0,0 +1,233 @@
+"""
+Offline benchmarks for every stage of the pipeline on synthetic price panels.
+
+    python -m portfolio_optimizer.benchmarks --portfolios 10000 100000 1000000 --assets 2 20 100 \
+        --output bench.json
+    python -m portfolio_optimizer.benchmarks --compare bench_old.json bench.json
+    python -m portfolio_optimizer.benchmarks --import-budget 1.0
+
+Results are written as JSON (one record per stage and parameter set) so runs on
+different commits can be compared.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from portfolio_optimizer.analytics import annualized_moments, asset_metrics, portfolio_frame
+from portfolio_optimizer.parallel import parallel_simulate
+from portfolio_optimizer.risk import monthly_asset_returns, portfolio_es
+
+# What a headless ES run from the price store and result cache imports (see --import-budget)
+CACHED_ES_IMPORTS = ('import numpy, pandas\n'
+                     'from portfolio_optimizer import instrument\n'
+                     'from portfolio_optimizer.analytics import annualized_moments, portfolio_frame\n'
+                     'from portfolio_optimizer.cache import ResultCache, cache_key\n'
+                     'from portfolio_optimizer.parallel import parallel_es\n'
+                     'from portfolio_optimizer.risk import monthly_asset_returns, portfolio_es\n'
+                     'from portfolio_optimizer.store import PriceStore\n')
+HEADLESS_FORBIDDEN = ('yfinance', 'matplotlib', 'scipy', 'numba')
+
+STAGES = ['returns', 'asset_metrics', 'simulation', 'es', 'feasibility', 'csv_output', 'plot_output']
+
+
+def synthetic_panel(n_assets, n_days, seed=0):
+    """
+    Synthetic adjusted-close panel (business days x assets), geometric Brownian
+    motion with random drift and volatility per asset.
+    """
+    rng = np.random.default_rng(seed)
+    drifts = rng.uniform(-0.05, 0.25, n_assets) / 252
+    volatilities = rng.uniform(0.10, 0.60, n_assets) / np.sqrt(252)
+    log_returns = rng.normal(drifts - volatilities ** 2 / 2, volatilities, (n_days, n_assets))
+    dates = pd.bdate_range(end=pd.Timestamp(datetime.date.today()), periods=n_days)
+    columns = [f"SYN{i:03d}" for i in range(n_assets)]
+    return pd.DataFrame(100 * np.exp(np.cumsum(log_returns, axis=0)), index=dates, columns=columns)
+
+
+def _timed(function, repeat):
+    # Best of `repeat` runs; returns (seconds, result of the last run)
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def benchmark_pipeline(n_assets, n_days, num_portfolios, repeat=3, workers=1, seed=0,
+                       chunk_size=100000, confidence_level=0.95, risk_free_rate=0.02):
+    """
+    Time each stage once for one parameter set. Returns {stage: seconds}.
+    """
+    prices = synthetic_panel(n_assets, n_days, seed)
+    timings = {}
+
+    timings['returns'], daily_returns = _timed(lambda: prices.pct_change(fill_method=None).dropna(), repeat)
+    timings['asset_metrics'], _ = _timed(lambda: asset_metrics(daily_returns, risk_free_rate), repeat)
+
+    mean_returns, cov_matrix = annualized_moments(daily_returns)
+    timings['simulation'], simulated = _timed(
+        lambda: parallel_simulate(mean_returns, cov_matrix, num_portfolios, risk_free_rate, seed=seed,
+                                  workers=workers, chunk_size=chunk_size), repeat)
+    weights, returns, volatilities, sharpe_ratios, _ = simulated
+
+    monthly_returns = monthly_asset_returns(daily_returns)
+    timings['es'], es = _timed(lambda: portfolio_es(monthly_returns, weights, confidence_level), repeat)
+
+    portfolio_metrics = portfolio_frame(list(prices.columns), weights, returns, volatilities, sharpe_ratios, es)
+    threshold = np.median(es)
+    timings['feasibility'], feasible_portfolios = _timed(
+        lambda: portfolio_metrics[portfolio_metrics['ES'] >= threshold], repeat)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        timings['csv_output'], _ = _timed(
+            lambda: feasible_portfolios.to_csv(os.path.join(tmp, 'feasible_portfolios.csv'), index=False), repeat)
+        timings['plot_output'], _ = _timed(
+            lambda: _plot(portfolio_metrics, os.path.join(tmp, 'frontier.png')), repeat)
+    return timings
+
+
+def _plot(portfolio_metrics, path):
+    # Same scatter as script 03, rendered off-screen
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(10, 6))
+    ax = fig.add_subplot()
+    points = ax.scatter(portfolio_metrics['Volatility'], portfolio_metrics['Return'],
+                        c=portfolio_metrics['Sharpe Ratio'], cmap='viridis', alpha=0.7)
+    fig.colorbar(points, ax=ax, label='Sharpe Ratio')
+    fig.savefig(path)
+
+
+def _metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit,
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run_suite(portfolios, assets, n_days=1260, repeat=3, workers=1, seed=0, max_elements=5 * 10 ** 8,
+              stages=None):
+    """
+    Run benchmark_pipeline over the grid of portfolio counts x asset counts.
+    Parameter sets whose weight matrix exceeds `max_elements` values are recorded as skipped.
+    """
+    results = []
+    for n_assets in assets:
+        for num_portfolios in portfolios:
+            params = {'assets': n_assets, 'days': n_days, 'num_portfolios': num_portfolios}
+            if n_assets * num_portfolios > max_elements:
+                results.append(dict(params, stage=None, skipped='weight matrix too large'))
+                print(f"skip  assets={n_assets:<4} portfolios={num_portfolios:<9} (weight matrix too large)")
+                continue
+            timings = benchmark_pipeline(n_assets, n_days, num_portfolios, repeat, workers, seed)
+            for stage, seconds in timings.items():
+                if stages is None or stage in stages:
+                    results.append(dict(params, stage=stage, seconds=seconds))
+                    print(f"{stage:<14} assets={n_assets:<4} portfolios={num_portfolios:<9} {seconds:10.4f} s")
+    return {'metadata': _metadata(), 'results': results}
+
+
+def compare(old_path, new_path):
+    """
+    Print the new/old time ratio per stage and parameter set (above 1 means slower).
+    """
+    def load(path):
+        with open(path, encoding='UTF-8') as f:
+            records = json.load(f)['results']
+        return {(r['stage'], r['assets'], r['days'], r['num_portfolios']): r['seconds']
+                for r in records if 'seconds' in r}
+    old, new = load(old_path), load(new_path)
+    for key in sorted(set(old) & set(new), key=str):
+        stage, n_assets, _, num_portfolios = key
+        ratio = new[key] / old[key] if old[key] else np.inf
+        print(f"{stage:<14} assets={n_assets:<4} portfolios={num_portfolios:<9} "
+              f"{old[key]:10.4f} s -> {new[key]:10.4f} s  x{ratio:.2f}")
+
+
+def import_time(code=CACHED_ES_IMPORTS, repeat=3):
+    """
+    Best wall time (seconds) of `code` in a fresh interpreter, and the modules of
+    HEADLESS_FORBIDDEN it loaded.
+    """
+    probe = ('import sys, time\n'
+             'start = time.perf_counter()\n'
+             f'exec({code!r})\n'
+             'elapsed = time.perf_counter() - start\n'
+             f'print(elapsed, *[m for m in {HEADLESS_FORBIDDEN!r} if m in sys.modules])\n')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+    best, loaded = float('inf'), []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, check=True,
+                                env=env).stdout.split()
+        best, loaded = min(best, float(output[0])), output[1:]
+    return best, loaded
+
+
+def check_import_budget(budget):
+    """
+    Fail (return 1) when the cached-data ES imports take more than `budget` seconds
+    or load yfinance, matplotlib, scipy or numba.
+    """
+    seconds, loaded = import_time()
+    print(f"cached ES imports: {seconds:.3f} s (budget {budget:.3f} s)")
+    if loaded:
+        print(f"FAIL: headless imports loaded {', '.join(loaded)}")
+        return 1
+    if seconds > budget:
+        print("FAIL: import time over budget")
+        return 1
+    print("OK")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--portfolios', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--assets', type=int, nargs='+', default=[2, 20])
+    parser.add_argument('--days', type=int, default=1260, help='trading days per panel (default: 5 years)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the best time is kept')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', choices=STAGES)
+    parser.add_argument('--output', default='bench.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files and exit')
+    parser.add_argument('--import-budget', type=float, metavar='SECONDS',
+                        help='check the import time of a cached-data ES run against a budget and exit')
+    args = parser.parse_args(argv)
+
+    if args.import_budget is not None:
+        return check_import_budget(args.import_budget)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+    suite = run_suite(args.portfolios, args.assets, args.days, args.repeat, args.workers, args.seed,
+                      stages=args.stages)
+    with open(args.output, 'w', encoding='UTF-8') as f:
+        json.dump(suite, f, indent=1)
+    print(f"Results saved to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+Stationary block bootstrap of the daily return history.
+
+The ES of 04 rests on about 60 monthly returns, so its tail average uses 3-4
+months at 95%. Resampling the daily history (Politis-Romano stationary
+bootstrap: blocks of consecutive days with geometric lengths, wrapping around
+the end) shows how much the return, Sharpe ratio and ES of each portfolio move
+with the sample.
+
+Resample indices are drawn as one (resamples x days) array per batch: block
+starts and new-block flags are drawn for every position at once, and the
+position of the last block start is carried forward with
+np.maximum.accumulate, so there is no Python loop over days or resamples. Each
+resample is reduced to its annualized mean vector, the number of times it
+draws each day and its per-asset monthly returns (the calendar months of the
+original history). No per-resample covariance matrix is kept: a resample's
+portfolio variance follows from the day counts and the portfolio's daily
+returns with two matrix products, so memory does not grow with the square of
+the number of assets. Portfolios are then evaluated against all resamples at
+once, chunk by chunk, and only the requested quantiles per portfolio are kept.
+parallel.parallel_bootstrap_intervals spreads both steps over processes.
+"""
+import time
+
+import numpy as np
+
+from portfolio_optimizer import instrument
+from portfolio_optimizer.analytics import TRADING_DAYS
+from portfolio_optimizer.risk import period_ends, tail_size
+
+METRICS = ('Return', 'Volatility', 'Sharpe Ratio', 'ES')
+
+
+def interval_name(metric, quantile):
+    """
+    Column name of a bootstrap quantile, e.g. 'ES q0.05'.
+    """
+    return f"{metric} q{quantile:g}"
+
+
+def month_starts(index):
+    """
+    Position of the first day of each calendar month in a sorted daily index.
+    """
+    return np.append(0, period_ends(index, 'M')[:-1] + 1)
+
+
+def stationary_bootstrap_indices(rng, num_days, num_resamples, mean_block_length=20):
+    """
+    (num_resamples x num_days) day indices of stationary bootstrap resamples: each day
+    starts a new block with probability 1 / mean_block_length, at a uniform random day,
+    and a block continues with the following days (wrapping around the end).
+    """
+    positions = np.arange(num_days)
+    new_block = rng.random((num_resamples, num_days)) < 1.0 / mean_block_length
+    new_block[:, 0] = True
+    block_starts = rng.integers(0, num_days, (num_resamples, num_days))
+    # Position where the current block started, carried forward along each resample
+    started_at = np.maximum.accumulate(np.where(new_block, positions, 0), axis=1)
+    offset = positions - started_at
+    return (np.take_along_axis(block_starts, started_at, axis=1) + offset) % num_days
+
+
+def resample_statistics(daily_matrix, starts, indices):
+    """
+    Annualized mean vectors (resamples x n_assets), day counts (resamples x days: how
+    often each day of `daily_matrix` is drawn) and monthly asset returns (resamples x
+    months x n_assets, summed over the original calendar months) of the resamples in
+    `indices`.
+    """
+    num_resamples, num_days = indices.shape
+    resampled = daily_matrix[indices]
+    means = resampled.mean(axis=1)
+    counts = np.bincount((indices + num_days * np.arange(num_resamples)[:, None]).ravel(),
+                         minlength=num_resamples * num_days).reshape(num_resamples, num_days)
+    monthly = np.add.reduceat(resampled, starts, axis=1)
+    return means * TRADING_DAYS, counts, monthly
+
+
+def resample_volatilities(daily_matrix, counts, weights):
+    """
+    Annualized volatility (portfolios x resamples) of every row of a weight matrix in
+    every resample, from the resamples' day counts: with y the portfolio's daily
+    returns, sum(c y^2) and sum(c y) give the resample variance without building the
+    resample's covariance matrix.
+    """
+    num_days = counts.shape[1]
+    daily = daily_matrix @ weights.T
+    # Variance is shift-invariant; centering keeps sum(c y^2) - n mean^2 accurate
+    daily -= daily.mean(axis=0)
+    sums = counts @ daily
+    variances = (counts @ (daily * daily) - sums * sums / num_days) / (num_days - 1)
+    return np.sqrt(np.maximum(variances, 0.0) * TRADING_DAYS).T
+
+
+def bootstrap_chunk_size(num_resamples, num_days, num_months, memory_budget=256 * 2 ** 20):
+    """
+    Portfolios per chunk so that the (days x portfolios) and (portfolios x resamples x
+    months) intermediates fit in `memory_budget` bytes.
+    """
+    return max(1, int(memory_budget // (16 * (num_resamples * (num_months + 2) + num_days))))
+
+
+def bootstrap_quantiles(means, counts, monthly, daily_matrix, weights, quantiles=(0.05, 0.5, 0.95),
+                        risk_free_rate=0.0, confidence_level=0.95, memory_budget=256 * 2 ** 20):
+    """
+    Quantiles over the resamples of the return, volatility, Sharpe ratio and monthly ES
+    (as in compute_es) of every row of a weight matrix. Returns {interval_name: array}.
+    """
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+    num_resamples, num_months, n_assets = monthly.shape
+    k = min(tail_size(num_months, confidence_level), num_months)
+    results = {interval_name(metric, q): np.empty(len(weights)) for metric in METRICS for q in quantiles}
+
+    chunk_size = bootstrap_chunk_size(num_resamples, counts.shape[1], num_months, memory_budget)
+    for start in range(0, len(weights), chunk_size):
+        stop = start + chunk_size
+        started = time.perf_counter()
+        chunk = weights[start:stop]
+        returns = chunk @ means.T
+        volatilities = resample_volatilities(daily_matrix, counts, chunk)
+        sharpe_ratios = (returns - risk_free_rate) / volatilities
+        # Monthly portfolio returns (resamples x months x portfolios), k worst months per column
+        portfolio_months = monthly @ chunk.T
+        if k < num_months:
+            portfolio_months = np.partition(portfolio_months, k - 1, axis=1)
+        es = portfolio_months[:, :k].mean(axis=1).T
+
+        for metric, values in zip(METRICS, (returns, volatilities, sharpe_ratios, es)):
+            for q, row in zip(quantiles, np.quantile(values, quantiles, axis=1)):
+                results[interval_name(metric, q)][start:stop] = row
+        instrument.chunk('bootstrap', len(chunk), time.perf_counter() - started)
+    return results
@@ -0,0 +1,157 @@
+"""
+On-disk, content-addressed cache of simulation results.
+
+An entry is keyed by a hash of everything that determines the simulated
+portfolios: the daily returns (dates, tickers and values), the risk-free rate
+and the simulation settings (sampler, number of portfolios, seed, ...). It holds
+the PortfolioResults of that simulation plus one ES vector per confidence
+level, so re-running 04 with another confidence level only computes the missing
+ES vector. The total size is bounded; the least recently used entries are
+evicted first.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from portfolio_optimizer.files import _atomic_write_json
+from portfolio_optimizer.results import HEADER_FILE, PortfolioResults
+
+INDEX_FILE = 'index.json'
+
+
+def cache_key(daily_returns, risk_free_rate, settings):
+    """
+    sha256 hex digest of the returns panel, the risk-free rate and a dict of settings.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(column) for column in daily_returns.columns]).encode())
+    digest.update(np.ascontiguousarray(daily_returns.index.values.view('int64')).tobytes())
+    digest.update(np.ascontiguousarray(daily_returns.to_numpy(dtype=np.float64)).tobytes())
+    digest.update(json.dumps({'risk_free_rate': float(risk_free_rate), **settings}, sort_keys=True,
+                             default=str).encode())
+    return digest.hexdigest()
+
+
+def _directory_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+class ResultCache:
+    """
+    Cache directory with one sub-directory per key. index.json records the size
+    and last use of every entry for the LRU eviction.
+    """
+    def __init__(self, root='result_cache', max_bytes=2 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self.index = self._read_index()
+
+    def _read_index(self):
+        path = os.path.join(self.root, INDEX_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding='UTF-8') as f:
+            index = json.load(f)
+        # Drop entries whose directory has been removed by hand
+        return {key: entry for key, entry in index.items() if os.path.exists(self._entry(key))}
+
+    def _write_index(self):
+        _atomic_write_json(os.path.join(self.root, INDEX_FILE), self.index)
+
+    def _entry(self, key):
+        return os.path.join(self.root, key)
+
+    @staticmethod
+    def _es_file(confidence_level):
+        return f"es_{float(confidence_level)!r}.npy"
+
+    def _touch(self, key):
+        self.index[key]['last_used'] = time.time()
+        self.index[key]['bytes'] = _directory_size(self._entry(key))
+        self._evict(keep=key)
+        self._write_index()
+
+    def _evict(self, keep=None):
+        total = sum(entry['bytes'] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda key: self.index[key]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self.index.pop(key)['bytes']
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def get(self, key, mmap=True):
+        """
+        The cached PortfolioResults for `key` (memory-mapped by default), or None.
+        """
+        if key not in self.index or not os.path.exists(os.path.join(self._entry(key), HEADER_FILE)):
+            return None
+        results = PortfolioResults.load(self._entry(key), mmap=mmap)
+        self._touch(key)
+        return results
+
+    def put(self, key, results):
+        """
+        Store `results` under `key`, replacing any previous entry, then evict down to max_bytes.
+        """
+        # Save into a temporary directory and rename it, so readers never see a partial entry
+        tmp_dir = self._entry(key) + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        results.save(tmp_dir)
+        shutil.rmtree(self._entry(key), ignore_errors=True)
+        os.replace(tmp_dir, self._entry(key))
+        self.index[key] = {'bytes': 0, 'last_used': 0.0, 'count': len(results)}
+        self._touch(key)
+
+    def get_es(self, key, confidence_level, mmap=True):
+        """
+        Cached ES vector of the entry at `confidence_level`, or None (also when its
+        length does not match the entry's portfolios).
+        """
+        path = os.path.join(self._entry(key), self._es_file(confidence_level))
+        if key not in self.index or not os.path.exists(path):
+            return None
+        es = np.load(path, mmap_mode='r' if mmap else None)
+        if len(es) != self.index[key]['count']:
+            return None
+        self._touch(key)
+        return es
+
+    def put_es(self, key, confidence_level, es):
+        """
+        Store the ES vector of the entry's portfolios at `confidence_level`.
+        """
+        if key not in self.index:
+            raise KeyError(f"No cached results for key {key}")
+        if len(es) != self.index[key]['count']:
+            raise ValueError(f"ES vector has {len(es)} values but the cached entry holds "
+                             f"{self.index[key]['count']} portfolios.")
+        path = os.path.join(self._entry(key), self._es_file(confidence_level))
+        np.save(path + '.tmp.npy', np.asarray(es, dtype=np.float64))
+        os.replace(path + '.tmp.npy', path)
+        self._touch(key)
+
+    def es(self, key, confidence_level, compute):
+        """
+        ES vector at `confidence_level` from the cache, or compute() it and store it.
+        """
+        es = self.get_es(key, confidence_level)
+        if es is None:
+            es = compute()
+            self.put_es(key, confidence_level, es)
+        return es
+
+    def clear(self):
+        for key in list(self.index):
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+        self.index = {}
+        self._write_index()
@@ -0,0 +1,115 @@
+"""
+Covariance estimators for large ticker universes.
+
+- 'sample': the sample covariance (as pandas' DataFrame.cov()).
+- 'ledoit_wolf': Ledoit-Wolf shrinkage of the sample covariance towards a scaled
+  identity; well conditioned even when assets outnumber observations.
+- 'factor': statistical factor model, K principal components plus a diagonal
+  residual. Portfolio variance is evaluated through the factor exposures in
+  O(N * K) per portfolio instead of the O(N^2) quadratic form.
+"""
+import numpy as np
+
+COV_METHODS = ('sample', 'ledoit_wolf', 'factor')
+
+
+def _centered(daily_returns):
+    values = np.asarray(daily_returns, dtype=float)
+    return values - values.mean(axis=0)
+
+
+def sample_covariance(daily_returns):
+    centered = _centered(daily_returns)
+    return centered.T @ centered / (len(centered) - 1)
+
+
+def ledoit_wolf(daily_returns):
+    """
+    Ledoit-Wolf (2004) shrinkage towards mu * I, mu the average variance.
+    Returns (covariance, shrinkage intensity in [0, 1]). Scaled with 1 / (T - 1) like the sample covariance.
+    """
+    centered = _centered(daily_returns)
+    n_days, n_assets = centered.shape
+    emp_cov = centered.T @ centered / n_days
+    mu = np.trace(emp_cov) / n_assets
+    delta = ((emp_cov - mu * np.eye(n_assets)) ** 2).sum() / n_assets
+    squared = centered ** 2
+    beta = ((squared.T @ squared) / n_days - emp_cov ** 2).sum() / (n_assets * n_days)
+    shrinkage = 0.0 if delta == 0 else min(beta, delta) / delta
+    shrunk = (1 - shrinkage) * emp_cov
+    shrunk[np.diag_indices(n_assets)] += shrinkage * mu
+    return shrunk * n_days / (n_days - 1), shrinkage
+
+
+class FactorCovariance:
+    """
+    Covariance B diag(f) B' + diag(d): loadings B (N x K), factor variances f (K)
+    and residual variances d (N). Behaves like the dense matrix where numpy needs
+    one (np.asarray(cov) builds it), but evaluate_portfolios uses portfolio_variance.
+    """
+    def __init__(self, factor_loadings, factor_variances, residual_variances):
+        self.factor_loadings = np.asarray(factor_loadings, dtype=float)
+        self.factor_variances = np.asarray(factor_variances, dtype=float)
+        self.residual_variances = np.asarray(residual_variances, dtype=float)
+
+    @classmethod
+    def from_returns(cls, daily_returns, n_factors=5):
+        """
+        Principal components of the sample covariance (via an SVD of the centered returns).
+        """
+        centered = _centered(daily_returns)
+        n_days, n_assets = centered.shape
+        n_factors = min(n_factors, n_assets, n_days - 1)
+        _, singular_values, components = np.linalg.svd(centered, full_matrices=False)
+        factor_loadings = components[:n_factors].T
+        factor_variances = singular_values[:n_factors] ** 2 / (n_days - 1)
+        total_variances = (centered ** 2).sum(axis=0) / (n_days - 1)
+        explained = (factor_loadings ** 2) @ factor_variances
+        # Keep a small positive residual so the matrix stays positive definite
+        residual_variances = np.maximum(total_variances - explained, 1e-6 * total_variances.mean())
+        return cls(factor_loadings, factor_variances, residual_variances)
+
+    def __len__(self):
+        return len(self.residual_variances)
+
+    @property
+    def shape(self):
+        return (len(self), len(self))
+
+    def __mul__(self, scalar):
+        return FactorCovariance(self.factor_loadings, self.factor_variances * scalar, self.residual_variances * scalar)
+
+    __rmul__ = __mul__
+
+    def portfolio_variance(self, weights):
+        """
+        w' C w for every row of a weight matrix, in O(N * K) per row.
+        """
+        exposures = weights @ self.factor_loadings
+        return (exposures ** 2) @ self.factor_variances + (weights ** 2) @ self.residual_variances
+
+    def dense(self):
+        cov = (self.factor_loadings * self.factor_variances) @ self.factor_loadings.T
+        cov[np.diag_indices(len(self))] += self.residual_variances
+        return cov
+
+    def __array__(self, dtype=None, copy=None):
+        return self.dense() if dtype is None else self.dense().astype(dtype)
+
+    def arrays(self):
+        return {'factor_loadings': self.factor_loadings, 'factor_variances': self.factor_variances,
+                'residual_variances': self.residual_variances}
+
+
+def estimate_covariance(daily_returns, method='sample', n_factors=5):
+    """
+    Daily covariance of `daily_returns` with the given method (see COV_METHODS).
+    Returns a dense array, or a FactorCovariance for method='factor'.
+    """
+    if method == 'sample':
+        return sample_covariance(daily_returns)
+    if method == 'ledoit_wolf':
+        return ledoit_wolf(daily_returns)[0]
+    if method == 'factor':
+        return FactorCovariance.from_returns(daily_returns, n_factors)
+    raise ValueError(f"Unknown covariance method '{method}'. Choose one of: {', '.join(COV_METHODS)}.")
@@ -0,0 +1,148 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from portfolio_optimizer import instrument
+
+SYNTHETIC_ORIGIN = '1990-01-01'
+
+
+class YahooPriceSource:
+    """
+    Adjusted close prices from Yahoo Finance, several tickers per request.
+    """
+    def download(self, tickers, start, end):
+        import yfinance as yf
+        data = yf.download(list(tickers), start=start, end=end, progress=False)['Adj Close']
+        if isinstance(data, pd.Series):
+            data = data.to_frame(tickers[0])
+        return data
+
+    def risk_free_rate(self, ticker='^IRX'):
+        """
+        Latest annual yield of `ticker` as a decimal (default: 13 week US treasury bill).
+        """
+        import yfinance as yf
+        return yf.Ticker(ticker).history(period="1d")['Close'].iloc[-1] / 100
+
+
+class StubPriceSource:
+    """
+    Offline stand-in for Yahoo Finance, used for tests and benchmarks.
+    Serves the given `frames` (ticker -> price Series) or, for unknown tickers,
+    deterministic synthetic prices (geometric Brownian motion seeded by ticker).
+    `latency` seconds are slept per request to mimic a network round trip.
+    """
+    def __init__(self, frames=None, seed=0, latency=0.0, annual_drift=0.08, annual_volatility=0.25,
+                 annual_risk_free_rate=0.0):
+        self.frames = dict(frames or {})
+        self.seed = seed
+        self.latency = latency
+        self.annual_drift = annual_drift
+        self.annual_volatility = annual_volatility
+        self.annual_risk_free_rate = annual_risk_free_rate
+        self.requests = 0
+
+    def synthetic_prices(self, ticker, start, end):
+        # The path always starts at SYNTHETIC_ORIGIN so that any window of it is consistent
+        dates = pd.bdate_range(SYNTHETIC_ORIGIN, end, inclusive='left')
+        ticker_seed = [self.seed] + [ord(c) for c in ticker]
+        rng = np.random.default_rng(ticker_seed)
+        daily_drift = self.annual_drift / 252
+        daily_volatility = self.annual_volatility / np.sqrt(252)
+        log_returns = rng.normal(daily_drift - daily_volatility ** 2 / 2, daily_volatility, len(dates))
+        prices = pd.Series(100 * np.exp(np.cumsum(log_returns)), index=dates, name=ticker)
+        return prices[prices.index >= pd.Timestamp(start)]
+
+    def download(self, tickers, start, end):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        columns = {}
+        for ticker in tickers:
+            if ticker in self.frames:
+                prices = self.frames[ticker]
+                columns[ticker] = prices[(prices.index >= start) & (prices.index < end)]
+            else:
+                columns[ticker] = self.synthetic_prices(ticker, start, end)
+        return pd.DataFrame(columns)
+
+    def risk_free_rate(self, ticker='^IRX'):
+        return self.annual_risk_free_rate
+
+
+def _as_series(data, ticker):
+    # yfinance returns a one-column DataFrame or a Series depending on its version
+    if isinstance(data, pd.DataFrame):
+        data = data[ticker] if ticker in data.columns else data.iloc[:, 0]
+    return data.rename(ticker)
+
+
+def _without_data(data, tickers):
+    # yf.download reports a failed ticker with a missing or all-NaN column instead of raising
+    return [ticker for ticker in tickers if ticker not in data.columns or data[ticker].isna().all()]
+
+
+def download_with_retry(source, tickers, start, end, retries=3, backoff=1.0):
+    """
+    Call source.download, retrying with exponential backoff (backoff, 2*backoff, ...).
+    A failed request is retried as a whole; after a successful one only the tickers
+    that came back without data are requested again. Once all retries are used up,
+    the last error is raised if no request succeeded, otherwise the tickers still
+    without data are left out of the result.
+    """
+    columns = {}
+    pending = list(tickers)
+    for attempt in range(retries + 1):
+        try:
+            data = source.download(pending, start, end)
+        except Exception:
+            if attempt == retries and not columns:
+                raise
+        else:
+            missing = _without_data(data, pending)
+            columns.update((ticker, data[ticker]) for ticker in pending if ticker not in missing)
+            pending = missing
+        if not pending or attempt == retries:
+            break
+        time.sleep(backoff * 2 ** attempt)
+    return pd.DataFrame({ticker: columns[ticker] for ticker in tickers if ticker in columns})
+
+
+def fetch_prices(tickers, start, end, source=None, cached=None, batch_size=None,
+                 max_workers=4, retries=3, backoff=1.0):
+    """
+    Fetch adjusted close prices for `tickers` into one DataFrame (one column per ticker).
+
+    Frames already in `cached` (e.g. downloaded while validating the tickers) are
+    reused as they are. The remaining tickers are requested in batches of
+    `batch_size` tickers (all in one request by default), with at most
+    `max_workers` batches in flight and retries with exponential backoff (tickers
+    that come back without data are requested again). Tickers still without data
+    are left out of the result.
+    """
+    if source is None:
+        source = YahooPriceSource()
+    cached = cached or {}
+
+    frames = {ticker: _as_series(cached[ticker], ticker) for ticker in tickers if ticker in cached}
+    remaining = [ticker for ticker in tickers if ticker not in frames]
+
+    if remaining:
+        batch_size = batch_size or len(remaining)
+        batches = [remaining[i:i + batch_size] for i in range(0, len(remaining), batch_size)]
+        with instrument.stage('download', tickers=len(remaining), batches=len(batches)), \
+                ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as pool:
+            results = pool.map(lambda batch: download_with_retry(source, batch, start, end, retries, backoff),
+                               batches)
+            for batch, data in zip(batches, results):
+                for ticker in batch:
+                    if ticker in data.columns:
+                        frames[ticker] = _as_series(data[ticker], ticker)
+
+    all_data = pd.DataFrame({ticker: frames[ticker] for ticker in tickers
+                             if ticker in frames and not frames[ticker].dropna().empty})
+    return all_data
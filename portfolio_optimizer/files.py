@@ -0,0 +1,20 @@
+"""
+Crash-safe writes of the small JSON files (store and cache indexes, pipeline
+state, metadata cache, metrics reports).
+
+The text is written to '<path>.tmp' and then renamed over `path`, so a crash
+never leaves a half-written file behind: readers see the old or the new file.
+"""
+import json
+import os
+
+
+def _atomic_write(path, text):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='UTF-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _atomic_write_json(path, data, indent=1, sort_keys=True, **options):
+    _atomic_write(path, json.dumps(data, indent=indent, sort_keys=sort_keys, **options))
@@ -0,0 +1,84 @@
+"""
+Constant-memory reduction of simulated portfolios.
+
+Instead of keeping every simulated portfolio, FrontierReducer keeps only the
+portfolios that can still be optimal: the Pareto-nondominated set for return vs.
+volatility (and return vs. ES when ES is tracked), the maximum Sharpe ratio and
+the minimum volatility portfolio. Memory therefore depends on the size of the
+frontier, not on the number of portfolios simulated.
+parallel.parallel_simulate(streaming=True) feeds it chunk by chunk.
+"""
+import numpy as np
+
+from portfolio_optimizer.analytics import portfolio_frame
+from portfolio_optimizer.results import PortfolioResults
+
+
+def nondominated(maximize_x, maximize_y):
+    """
+    Boolean mask of the points not dominated by any other point when both
+    coordinates are to be maximized (ties are kept once, first occurrence wins).
+    """
+    order = np.lexsort((np.arange(len(maximize_x)), -maximize_y, -maximize_x))
+    best_y = np.maximum.accumulate(maximize_y[order])
+    keep = np.empty(len(order), dtype=bool)
+    keep[0] = True
+    keep[1:] = maximize_y[order][1:] > best_y[:-1]
+    mask = np.zeros(len(order), dtype=bool)
+    mask[order[keep]] = True
+    return mask
+
+
+class FrontierReducer:
+    """
+    Streaming reducer over (weights, returns, volatilities, sharpe_ratios[, es]) chunks.
+    """
+    def __init__(self):
+        self.count = 0
+        self.weights = None
+        self.metrics = {}
+
+    def update(self, weights, returns, volatilities, sharpe_ratios, es=None):
+        chunk = {'Return': returns, 'Volatility': volatilities, 'Sharpe Ratio': sharpe_ratios}
+        if es is not None:
+            chunk['ES'] = es
+        self.count += len(returns)
+
+        # The retained portfolios come first, so ties resolve to the earliest simulated portfolio
+        if self.weights is not None:
+            weights = np.concatenate([self.weights, weights])
+            chunk = {name: np.concatenate([self.metrics[name], values]) for name, values in chunk.items()}
+
+        keep = nondominated(chunk['Return'], -chunk['Volatility'])
+        if 'ES' in chunk:
+            keep |= nondominated(chunk['Return'], chunk['ES'])
+        keep[np.argmax(chunk['Sharpe Ratio'])] = True
+        keep[np.argmin(chunk['Volatility'])] = True
+
+        self.weights = weights[keep]
+        self.metrics = {name: values[keep] for name, values in chunk.items()}
+        return self
+
+    def merge(self, other):
+        """
+        Fold another reducer's retained portfolios into this one.
+        """
+        if other.weights is not None:
+            count = self.count + other.count
+            self.update(other.weights, *(other.metrics[name] for name in other.metrics))
+            self.count = count
+        return self
+
+    def to_frame(self, stocks):
+        """
+        Retained portfolios in the layout of portfolio_metrics (metrics, then one weight column per stock).
+        """
+        return portfolio_frame(stocks, self.weights, self.metrics['Return'], self.metrics['Volatility'],
+                               self.metrics['Sharpe Ratio'], self.metrics.get('ES'))
+
+    def to_results(self, stocks):
+        """
+        Retained portfolios as a PortfolioResults.
+        """
+        return PortfolioResults(stocks, self.weights, self.metrics)
+
@@ -0,0 +1,249 @@
+"""
+Stage-level instrumentation of the pipeline.
+
+Each stage (download, store reads, returns, simulation, ES, CSV/array output,
+plotting) records its wall time, CPU time (including finished worker
+processes), peak RSS and item counts, and the simulation and ES engines record
+per-chunk throughput. Reports are JSON, or Prometheus text format when the file
+name ends in '.prom'.
+
+Instrumentation is off by default: stage() then returns a shared no-op context
+and chunk() returns immediately. Turn it on with enable(path) or by setting the
+PORTFOLIO_METRICS environment variable to the report path; the report is
+rewritten by write() and when the interpreter exits.
+
+    from portfolio_optimizer import instrument
+    instrument.enable('metrics.prom')
+    with instrument.stage('returns') as stage:
+        daily_returns = prices.pct_change().dropna()
+        stage.add(rows=len(daily_returns))
+"""
+import atexit
+import multiprocessing
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from portfolio_optimizer.files import _atomic_write, _atomic_write_json
+
+ENV_VAR = 'PORTFOLIO_METRICS'
+
+_recorder = None
+
+
+def _peak_rss(who):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _cpu_seconds():
+    # Children only count once they have been waited for (e.g. after a process pool shuts down)
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, **counts):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, recorder, name, counts):
+        self.recorder = recorder
+        self.name = name
+        self.counts = dict(counts)
+
+    def add(self, **counts):
+        """
+        Add to the item counts of this stage (portfolios, tickers, bytes, ...).
+        """
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = _cpu_seconds()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.record_stage(self.name, time.perf_counter() - self.wall, _cpu_seconds() - self.cpu,
+                                   self.counts)
+        return False
+
+
+class Recorder:
+    """
+    Accumulates stage and chunk measurements; write() renders them to `path`.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.stages = {}
+        self.chunks = {}
+
+    def record_stage(self, name, wall, cpu, counts):
+        entry = self.stages.setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                                              'peak_rss_bytes': None, 'children_peak_rss_bytes': None,
+                                              'counts': {}})
+        entry['calls'] += 1
+        entry['wall_seconds'] += wall
+        entry['cpu_seconds'] += cpu
+        if resource is not None:
+            entry['peak_rss_bytes'] = _peak_rss(resource.RUSAGE_SELF)
+            entry['children_peak_rss_bytes'] = _peak_rss(resource.RUSAGE_CHILDREN)
+        for key, value in counts.items():
+            entry['counts'][key] = entry['counts'].get(key, 0) + value
+
+    def record_chunks(self, engine, items, seconds, chunks=1, min_rate=None, max_rate=None):
+        items = int(items)
+        rate = items / seconds if seconds > 0 else float('inf')
+        entry = self.chunks.setdefault(engine, {'chunks': 0, 'items': 0, 'seconds': 0.0,
+                                                'min_items_per_second': float('inf'), 'max_items_per_second': 0.0})
+        entry['chunks'] += chunks
+        entry['items'] += items
+        entry['seconds'] += seconds
+        entry['min_items_per_second'] = min(entry['min_items_per_second'], rate if min_rate is None else min_rate)
+        entry['max_items_per_second'] = max(entry['max_items_per_second'], rate if max_rate is None else max_rate)
+
+    def merge_chunks(self, chunks):
+        for engine, entry in chunks.items():
+            self.record_chunks(engine, entry['items'], entry['seconds'], entry['chunks'],
+                               entry['min_items_per_second'], entry['max_items_per_second'])
+
+    def report(self):
+        chunks = {engine: dict(entry, items_per_second=entry['items'] / entry['seconds'] if entry['seconds'] else None)
+                  for engine, entry in self.chunks.items()}
+        return {'stages': self.stages, 'chunks': chunks}
+
+    def prometheus(self):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}")
+
+        stages = self.stages.items()
+        metric('portfolio_stage_calls_total', 'counter', 'Times the stage ran.',
+               [({'stage': name}, entry['calls']) for name, entry in stages])
+        metric('portfolio_stage_wall_seconds_total', 'counter', 'Wall time spent in the stage.',
+               [({'stage': name}, entry['wall_seconds']) for name, entry in stages])
+        metric('portfolio_stage_cpu_seconds_total', 'counter', 'CPU time spent in the stage, finished workers included.',
+               [({'stage': name}, entry['cpu_seconds']) for name, entry in stages])
+        metric('portfolio_stage_peak_rss_bytes', 'gauge', 'Peak resident set size of the process after the stage.',
+               [({'stage': name}, entry['peak_rss_bytes']) for name, entry in stages
+                if entry['peak_rss_bytes'] is not None])
+        metric('portfolio_stage_items_total', 'counter', 'Items processed by the stage.',
+               [({'stage': name, 'item': key}, value) for name, entry in stages
+                for key, value in entry['counts'].items()])
+        report = self.report()['chunks']
+        metric('portfolio_chunks_total', 'counter', 'Chunks processed by the engine.',
+               [({'engine': engine}, entry['chunks']) for engine, entry in report.items()])
+        metric('portfolio_chunk_items_per_second', 'gauge', 'Chunk throughput of the engine.',
+               [({'engine': engine, 'stat': stat}, entry[key]) for engine, entry in report.items()
+                for stat, key in (('mean', 'items_per_second'), ('min', 'min_items_per_second'),
+                                  ('max', 'max_items_per_second')) if entry[key] is not None])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path=None):
+        path = path or self.path
+        if not path:
+            return None
+        if path.endswith('.prom'):
+            _atomic_write(path, self.prometheus())
+        else:
+            _atomic_write_json(path, self.report(), indent=2, sort_keys=False,
+                               default=lambda value: value.item())  # numpy scalars
+        return path
+
+
+def enabled():
+    return _recorder is not None
+
+
+def enable(path=None):
+    """
+    Start recording (keeps the current recorder if already on). The report goes to
+    `path` when write() is called and at interpreter exit.
+    """
+    global _recorder
+    if _recorder is None:
+        _recorder = Recorder(path)
+        atexit.register(write)
+    elif path:
+        _recorder.path = path
+    return _recorder
+
+
+def disable():
+    global _recorder
+    _recorder = None
+
+
+def stage(name, **counts):
+    """
+    Context manager timing one stage; call .add(**counts) on it to record item counts.
+    """
+    if _recorder is None:
+        return _NULL_STAGE
+    return _Stage(_recorder, name, counts)
+
+
+def chunk(engine, items, seconds):
+    """
+    Record one chunk of `items` processed by `engine` in `seconds`.
+    """
+    if _recorder is not None:
+        _recorder.record_chunks(engine, items, seconds)
+
+
+def write(path=None):
+    """
+    Write the report (no-op when instrumentation is off). Returns the path written.
+    """
+    if _recorder is not None:
+        return _recorder.write(path)
+    return None
+
+
+def collected(function, *args):
+    """
+    Run function(*args) in a worker process with a fresh recorder and return
+    (result, chunk measurements), for the parent to merge with merge_collected.
+    """
+    global _recorder
+    _recorder = Recorder()
+    try:
+        return function(*args), _recorder.chunks
+    finally:
+        _recorder = None
+
+
+def merge_collected(collected_result):
+    result, chunks = collected_result
+    if _recorder is not None:
+        _recorder.merge_chunks(chunks)
+    return result
+
+
+# Spawned worker processes import this module too; only the main process reads the variable
+if os.environ.get(ENV_VAR) and multiprocessing.parent_process() is None:
+    enable(os.environ[ENV_VAR])
@@ -0,0 +1,134 @@
+"""
+Out-of-core pipeline for intraday (minute or hourly) bars.
+
+Bars are kept in a BarStore, the PriceStore layout (raw memory-mapped date and
+close columns per ticker) with the full timestamp of the last bar in the index.
+Daily statistics are computed chunk by chunk from the memory maps: each chunk
+of bars is reduced to one row per day (last close, sum of log returns, sum of
+squared log returns, bar count) and partial days at chunk edges are merged, so
+only `chunk_rows` bars are in memory at a time. The resulting daily return
+matrix is small and feeds the usual stages (asset_metrics, annualized_moments,
+monthly_asset_returns, ES).
+
+    python -m portfolio_optimizer.intraday ingest AAPL aapl_minutes.csv --store bar_store
+"""
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+from portfolio_optimizer import instrument
+from portfolio_optimizer.store import PriceStore
+
+NS_PER_DAY = 24 * 3600 * 10 ** 9
+
+
+class BarStore(PriceStore):
+    """
+    PriceStore for intraday bars: appends resume after the last stored timestamp,
+    not after the last stored day.
+    """
+    def __init__(self, root='bar_store'):
+        super().__init__(root)
+
+    def last_date(self, ticker):
+        entry = self.index.get(ticker)
+        if not entry:
+            return None
+        return pd.Timestamp(entry.get('last_timestamp', entry['last_date']))
+
+    def append(self, ticker, prices):
+        appended = super().append(ticker, prices)
+        if appended:
+            last = prices.dropna().index.max()
+            self.index[ticker]['last_timestamp'] = str(last.tz_localize(None) if last.tz is not None else last)
+            self._write_index()
+        return appended
+
+    def ingest_csv(self, ticker, path, date_column='Datetime', price_column='Close', chunksize=1000000):
+        """
+        Append the bars of a (time-sorted) CSV file, reading it `chunksize` rows at a time.
+        Returns the number of new rows.
+        """
+        appended = 0
+        with instrument.stage('bar_ingest') as stage:
+            for chunk in pd.read_csv(path, usecols=[date_column, price_column], chunksize=chunksize):
+                prices = pd.Series(chunk[price_column].to_numpy(dtype=np.float64),
+                                   index=pd.to_datetime(chunk[date_column]))
+                appended += self.append(ticker, prices)
+            stage.add(rows=appended)
+        return appended
+
+
+def daily_bar_stats(store, ticker, start=None, end=None, chunk_rows=5000000):
+    """
+    One row per day for the bars of `ticker` in [start, end): 'Close' (last bar),
+    'Log Return' (close to close, the first day has none), 'Realized Variance'
+    (sum of squared bar log returns) and 'Bars'. Reads the memory maps chunk by chunk.
+    """
+    dates, prices = store.read(ticker)
+    lo = 0 if start is None else np.searchsorted(dates, pd.Timestamp(start).value)
+    hi = len(dates) if end is None else np.searchsorted(dates, pd.Timestamp(end).value)
+
+    parts = []
+    previous_log_price = np.nan
+    with instrument.stage('bar_aggregation') as stage:
+        for chunk_start in range(lo, hi, chunk_rows):
+            chunk_stop = min(chunk_start + chunk_rows, hi)
+            days = dates[chunk_start:chunk_stop] // NS_PER_DAY
+            log_prices = np.log(prices[chunk_start:chunk_stop])
+            # The first bar's return is taken from the last bar of the previous chunk
+            log_returns = np.diff(log_prices, prepend=previous_log_price)
+            previous_log_price = log_prices[-1]
+
+            starts = np.flatnonzero(np.diff(days, prepend=days[0] - 1))
+            ends = np.append(starts[1:], len(days)) - 1
+            parts.append((days[starts], prices[chunk_start:chunk_stop][ends],
+                          np.add.reduceat(log_returns, starts), np.add.reduceat(log_returns ** 2, starts),
+                          np.diff(np.append(starts, len(days)))))
+        stage.add(bars=hi - lo, bytes=16 * (hi - lo))
+
+    if not parts:
+        return pd.DataFrame(columns=['Close', 'Log Return', 'Realized Variance', 'Bars'], dtype=float)
+    days, closes, log_returns, squares, bars = (np.concatenate(column) for column in zip(*parts))
+    # A day split over two chunks appears twice: merge its partial sums and keep its last close
+    starts = np.flatnonzero(np.diff(days, prepend=days[0] - 1))
+    last = np.append(starts[1:], len(days)) - 1
+    return pd.DataFrame({'Close': closes[last],
+                         'Log Return': np.add.reduceat(log_returns, starts),
+                         'Realized Variance': np.add.reduceat(squares, starts),
+                         'Bars': np.add.reduceat(bars, starts)},
+                        index=pd.DatetimeIndex((days[starts] * NS_PER_DAY).astype('datetime64[ns]')))
+
+
+def intraday_daily_returns(store, tickers, start=None, end=None, chunk_rows=5000000):
+    """
+    Daily simple returns (days x tickers) built from the stored bars, aligned on the days
+    all tickers traded, like financial_data.pct_change().dropna() on daily closes.
+    """
+    columns = {ticker: np.expm1(daily_bar_stats(store, ticker, start, end, chunk_rows)['Log Return'])
+               for ticker in tickers if ticker in store.index}
+    return pd.DataFrame(columns).dropna()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest = commands.add_parser('ingest', help='append the bars of a CSV file to the bar store')
+    ingest.add_argument('ticker')
+    ingest.add_argument('csv')
+    ingest.add_argument('--store', default='bar_store')
+    ingest.add_argument('--date-column', default='Datetime')
+    ingest.add_argument('--price-column', default='Close')
+    ingest.add_argument('--chunksize', type=int, default=1000000)
+    args = parser.parse_args(argv)
+
+    store = BarStore(args.store)
+    appended = store.ingest_csv(args.ticker.upper(), args.csv, args.date_column, args.price_column, args.chunksize)
+    print(f"{appended} bars appended to '{args.store}' for {args.ticker.upper()}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+Optional JIT-compiled kernels for the simulation and ES hot loops (needs numba).
+
+fused_evaluate computes the return, the quadratic-form volatility and the
+Sharpe ratio of each weight row in one pass, without the (size x n_assets)
+weights @ cov_matrix intermediate. fused_es evaluates each portfolio's monthly
+returns one month at a time and keeps only its k worst months in a small
+buffer, so the (size x months) portfolio return matrix is never built. Both run
+their portfolios in parallel over numba's threads.
+
+When numba is installed, analytics.evaluate_portfolios (dense covariance
+matrices) and risk.portfolio_es use these kernels; otherwise they keep their
+NumPy implementation. numba is only imported, and the kernels compiled (or
+loaded from numba's on-disk cache), on the first call of a fused_* function,
+so importing this module stays cheap. Process pools call limit_threads() in
+each worker, so that N workers do not each start a full set of numba threads.
+
+Set the PORTFOLIO_KERNELS environment variable to 'numpy' (or call
+use('numpy')) to force the NumPy path, e.g. to compare.
+Results agree with the NumPy path up to floating-point summation order;
+check_backend() verifies it:
+
+    python -m portfolio_optimizer.kernels
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+import numpy as np
+
+HAVE_NUMBA = importlib.util.find_spec('numba') is not None
+ENV_VAR = 'PORTFOLIO_KERNELS'
+BACKENDS = ('numba', 'numpy')
+
+# numba.prange once the kernels are compiled; numba resolves it when it compiles them
+_prange = range
+_kernels = None
+
+
+def _compiled():
+    # Without numba the kernels stay plain Python loops: correct, but only usable on small inputs
+    global _kernels, _prange
+    if _kernels is None:
+        if HAVE_NUMBA:
+            import numba
+            _prange = numba.prange
+            jit = numba.njit(parallel=True, cache=True)
+            _kernels = jit(_evaluate_kernel), jit(_es_kernel)
+        else:
+            _kernels = _evaluate_kernel, _es_kernel
+    return _kernels
+
+
+def _evaluate_kernel(weights, mean_returns, cov_matrix, risk_free_rate, returns, volatilities, sharpe_ratios):
+    num_portfolios, n_assets = weights.shape
+    for i in _prange(num_portfolios):
+        portfolio_return = 0.0
+        variance = 0.0
+        for j in range(n_assets):
+            w_j = weights[i, j]
+            portfolio_return += w_j * mean_returns[j]
+            # Upper triangle only: w' C w = sum_j w_j^2 C_jj + 2 sum_{j<l} w_j w_l C_jl
+            cross = 0.0
+            for l in range(j + 1, n_assets):
+                cross += weights[i, l] * cov_matrix[j, l]
+            variance += w_j * (w_j * cov_matrix[j, j] + 2.0 * cross)
+        returns[i] = portfolio_return
+        volatilities[i] = np.sqrt(variance)
+        sharpe_ratios[i] = (portfolio_return - risk_free_rate) / volatilities[i]
+
+
+def _es_kernel(weights, monthly_matrix, k, es):
+    num_portfolios, n_assets = weights.shape
+    num_months = monthly_matrix.shape[0]
+    for i in _prange(num_portfolios):
+        # The k worst months seen so far, sorted ascending
+        tail = np.empty(k)
+        filled = 0
+        for month in range(num_months):
+            value = 0.0
+            for j in range(n_assets):
+                value += weights[i, j] * monthly_matrix[month, j]
+            if filled < k:
+                position = filled
+                filled += 1
+            elif value < tail[k - 1]:
+                position = k - 1
+            else:
+                continue
+            # Insertion into the sorted buffer
+            while position > 0 and tail[position - 1] > value:
+                tail[position] = tail[position - 1]
+                position -= 1
+            tail[position] = value
+        total = 0.0
+        for position in range(k):
+            total += tail[position]
+        es[i] = total / k
+
+
+def fused_evaluate(weights, mean_returns, cov_matrix, risk_free_rate=0.0):
+    """
+    Return, volatility and Sharpe ratio for every row of a weight matrix (dense, symmetric covariance).
+    """
+    weights = np.ascontiguousarray(np.atleast_2d(weights), dtype=np.float64)
+    returns = np.empty(len(weights))
+    volatilities = np.empty(len(weights))
+    sharpe_ratios = np.empty(len(weights))
+    evaluate_kernel, _ = _compiled()
+    evaluate_kernel(weights, np.ascontiguousarray(mean_returns, dtype=np.float64),
+                     np.ascontiguousarray(cov_matrix, dtype=np.float64), float(risk_free_rate),
+                     returns, volatilities, sharpe_ratios)
+    return returns, volatilities, sharpe_ratios
+
+
+def fused_es(monthly_matrix, weights, k):
+    """
+    Mean of the k worst monthly returns of every row of a weight matrix.
+    """
+    weights = np.ascontiguousarray(np.atleast_2d(weights), dtype=np.float64)
+    es = np.empty(len(weights))
+    _, es_kernel = _compiled()
+    es_kernel(weights, np.ascontiguousarray(monthly_matrix, dtype=np.float64), int(k), es)
+    return es
+
+
+def _resolve(name):
+    name = (name or 'numba').lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown kernel backend '{name}', expected one of {', '.join(BACKENDS)}.")
+    return 'numba' if name == 'numba' and HAVE_NUMBA else 'numpy'
+
+
+_backend = _resolve(os.environ.get(ENV_VAR))
+
+
+def backend():
+    """
+    The backend in use: 'numba' or 'numpy'.
+    """
+    return _backend
+
+
+def active():
+    return _backend == 'numba'
+
+
+def use(name):
+    """
+    Select the backend ('numba' falls back to 'numpy' without numba). The choice is
+    also put in the environment, so worker processes started afterwards follow it.
+    """
+    global _backend
+    _backend = _resolve(name)
+    os.environ[ENV_VAR] = _backend
+    return _backend
+
+
+def limit_threads(num_threads=1):
+    """
+    Cap the threads of the numba kernels in this process (process pool initializer).
+    """
+    if active():
+        import numba
+        numba.set_num_threads(num_threads)
+
+
+def check_backend(n_assets=20, num_portfolios=20000, num_months=60, confidence_level=0.95, seed=0, rtol=1e-9):
+    """
+    Compare the kernels with the NumPy implementation on random data. Returns the
+    largest difference per output, relative to the largest value of that output;
+    raises ValueError above `rtol`.
+    Without numba the kernels run as plain Python, so keep the sizes small.
+    """
+    from portfolio_optimizer.analytics import evaluate_portfolios, random_weights
+    from portfolio_optimizer.risk import portfolio_es, tail_size
+
+    global _backend
+    rng = np.random.default_rng(seed)
+    weights = random_weights(rng, num_portfolios, n_assets)
+    factors = rng.normal(0.0, 0.05, (num_months, n_assets))
+    monthly_matrix = factors + rng.normal(0.0, 0.03, (num_months, 1))
+    mean_returns = monthly_matrix.mean(axis=0) * 12
+    cov_matrix = np.cov(monthly_matrix, rowvar=False) * 12
+
+    previous, _backend = _backend, 'numpy'
+    try:
+        reference = evaluate_portfolios(weights, mean_returns, cov_matrix, 0.02)
+        reference_es = portfolio_es(monthly_matrix, weights, confidence_level)
+    finally:
+        _backend = previous
+    fused = fused_evaluate(weights, mean_returns, cov_matrix, 0.02)
+    es = fused_es(monthly_matrix, weights, min(tail_size(num_months, confidence_level), num_months))
+
+    errors = {}
+    for name, expected, actual in zip(['Return', 'Volatility', 'Sharpe Ratio', 'ES'], [*reference, reference_es],
+                                      [*fused, es]):
+        errors[name] = float(np.max(np.abs(actual - expected)) / np.max(np.abs(expected)))
+    mismatched = {name: error for name, error in errors.items() if error > rtol}
+    if mismatched:
+        raise ValueError(f"Kernels differ from the NumPy implementation: {mismatched}")
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--assets', type=int, default=20)
+    parser.add_argument('--portfolios', type=int, help='default: 1000000 with numba, 2000 without')
+    parser.add_argument('--months', type=int, default=60)
+    parser.add_argument('--confidence-level', type=float, default=0.95)
+    args = parser.parse_args(argv)
+
+    num_portfolios = args.portfolios or (1000000 if HAVE_NUMBA else 2000)
+    print(f"numba installed: {HAVE_NUMBA}, backend in use: {backend()}")
+    started = time.perf_counter()
+    errors = check_backend(args.assets, num_portfolios, args.months, args.confidence_level)
+    print(f"{num_portfolios} portfolios x {args.assets} assets checked in {time.perf_counter() - started:.2f} s"
+          + (" (includes compilation)" if HAVE_NUMBA else ""))
+    for name, error in errors.items():
+        print(f"{name:<13} max relative difference {error:.2e}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
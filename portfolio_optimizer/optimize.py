@@ -0,0 +1,109 @@
+"""
+Exact long-only portfolio optimization (instead of picking the best random draw).
+scipy is imported by the solvers only, so the rest of the package works without it.
+"""
+import numpy as np
+import pandas as pd
+
+from portfolio_optimizer.analytics import evaluate_portfolios
+from portfolio_optimizer.risk import tail_size
+
+
+def _solve_qp(cov_matrix, constraints, x0):
+    # Convex quadratic program min x' C x over x >= 0, solved with SLSQP at tight tolerance
+    from scipy.optimize import minimize
+    cov_matrix = np.asarray(cov_matrix)
+    result = minimize(lambda x: x @ cov_matrix @ x, x0,
+                      jac=lambda x: 2 * cov_matrix @ x,
+                      bounds=[(0, None)] * len(x0),
+                      constraints=constraints,
+                      method='SLSQP', options={'ftol': 1e-15, 'maxiter': 1000})
+    if not result.success:
+        raise RuntimeError(f"Optimization failed: {result.message}")
+    return np.clip(result.x, 0, None)
+
+
+def min_variance_weights(cov_matrix):
+    """
+    Long-only minimum-variance portfolio (quadratic program).
+    """
+    n_assets = len(cov_matrix)
+    constraints = [{'type': 'eq', 'fun': lambda w: w.sum() - 1, 'jac': lambda w: np.ones(n_assets)}]
+    weights = _solve_qp(cov_matrix, constraints, np.full(n_assets, 1 / n_assets))
+    return weights / weights.sum()
+
+
+def max_sharpe_weights(mean_returns, cov_matrix, risk_free_rate=0.0):
+    """
+    Long-only maximum-Sharpe portfolio.
+    Solved as the quadratic program min y' C y s.t. (mu - rf)' y = 1, y >= 0,
+    with w = y / sum(y). This needs at least one asset returning more than the
+    risk-free rate; otherwise the (non-convex) Sharpe ratio is maximized directly.
+    """
+    excess_returns = np.asarray(mean_returns) - risk_free_rate
+    n_assets = len(excess_returns)
+    if excess_returns.max() <= 0:
+        cov_matrix = np.asarray(cov_matrix)
+        from scipy.optimize import minimize
+        result = minimize(lambda w: -(w @ excess_returns) / np.sqrt(w @ cov_matrix @ w),
+                          np.full(n_assets, 1 / n_assets), bounds=[(0, 1)] * n_assets,
+                          constraints=[{'type': 'eq', 'fun': lambda w: w.sum() - 1}], method='SLSQP')
+        weights = np.clip(result.x, 0, None)
+        return weights / weights.sum()
+
+    constraints = [{'type': 'eq', 'fun': lambda y: y @ excess_returns - 1, 'jac': lambda y: excess_returns}]
+    y0 = np.where(excess_returns > 0, 1.0, 0.0)
+    y0 /= y0 @ excess_returns
+    y = _solve_qp(cov_matrix, constraints, y0)
+    return y / y.sum()
+
+
+def max_return_es_weights(mean_returns, monthly_returns, confidence_level, max_loss_fraction, tolerance=1e-9):
+    """
+    Long-only maximum-return portfolio whose monthly ES loss is at most `max_loss_fraction`
+    of the portfolio (max_drawdown_dollars / portfolio_size).
+
+    Linear program in the Rockafellar-Uryasev form. With k = number of tail months used
+    by compute_es, alpha + sum(u) / k is the average of the k worst monthly losses at the
+    optimum, so the constraint is exactly compute_es(...) >= -max_loss_fraction. The LP
+    is solved with the limit tightened by `tolerance`, so that the solver's rounding never
+    leaves the optimum just past the limit. Returns None when no portfolio satisfies the
+    constraint.
+    """
+    from scipy.optimize import linprog
+    monthly_matrix = np.asarray(monthly_returns, dtype=float)
+    num_months, n_assets = monthly_matrix.shape
+    k = min(tail_size(num_months, confidence_level), num_months)
+
+    # Variables: [weights (n_assets), alpha (VaR), u (one excess loss per month)]
+    cost = np.concatenate([-np.asarray(mean_returns), [0.0], np.zeros(num_months)])
+
+    # u_m >= -r_m' w - alpha  <=>  -r_m' w - alpha - u_m <= 0
+    tail_rows = np.hstack([-monthly_matrix, -np.ones((num_months, 1)), -np.eye(num_months)])
+    # alpha + sum(u) / k <= max_loss_fraction
+    es_row = np.concatenate([np.zeros(n_assets), [1.0], np.full(num_months, 1 / k)])
+    A_ub = np.vstack([tail_rows, es_row])
+    b_ub = np.concatenate([np.zeros(num_months), [max_loss_fraction - tolerance]])
+
+    A_eq = np.concatenate([np.ones(n_assets), [0.0], np.zeros(num_months)])[None, :]
+    bounds = [(0, None)] * n_assets + [(None, None)] + [(0, None)] * num_months
+
+    result = linprog(cost, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=[1.0], bounds=bounds, method='highs')
+    if result.status == 2:  # infeasible
+        return None
+    if not result.success:
+        raise RuntimeError(f"Optimization failed: {result.message}")
+    weights = np.clip(result.x[:n_assets], 0, None)
+    return weights / weights.sum()
+
+
+def portfolio_row(weights, mean_returns, cov_matrix, risk_free_rate, stocks):
+    """
+    Metrics of one portfolio in the same layout as a row of portfolio_metrics.
+    """
+    returns, volatilities, sharpe_ratios = evaluate_portfolios(
+        np.asarray(weights)[None, :], mean_returns, cov_matrix, risk_free_rate)
+    row = {'Return': returns[0], 'Volatility': volatilities[0], 'Sharpe Ratio': sharpe_ratios[0]}
+    for stock, weight in zip(stocks, weights):
+        row[stock + ' Weight'] = weight
+    return pd.Series(row)
@@ -0,0 +1,326 @@
+"""
+Multi-core portfolio simulation, ES, risk measure and bootstrap evaluation.
+
+The work is cut into fixed blocks of `chunk_size` portfolios. Block i always
+draws its weights from block_rng(seed, i), so a given seed produces the same
+portfolios (and the same optimal portfolios) whatever the number of workers.
+Input matrices and result arrays live in shared memory, so nothing large is
+pickled between processes, and results are merged in block order.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from portfolio_optimizer import instrument, kernels
+from portfolio_optimizer.analytics import block_rng, evaluate_portfolios, random_weights
+from portfolio_optimizer.bootstrap import (METRICS, bootstrap_quantiles, interval_name, month_starts,
+                                           resample_statistics, stationary_bootstrap_indices)
+from portfolio_optimizer.covariance import FactorCovariance
+from portfolio_optimizer.frontier import FrontierReducer
+from portfolio_optimizer.plotting import FrontierRaster
+from portfolio_optimizer.risk import portfolio_es, risk_measures
+
+
+class SharedArrays:
+    """
+    Named numpy arrays in shared memory. Use as a context manager in the parent;
+    workers get `spec` and call attach_arrays(spec). Arrays are float64 unless
+    `dtypes` gives another dtype for an `empty` array.
+    """
+    def __init__(self, arrays=None, empty=None, dtypes=None):
+        self.blocks = []
+        self.arrays = {}
+        self.spec = {}
+        for name, values in (arrays or {}).items():
+            values = np.ascontiguousarray(values, dtype=np.float64)
+            self._allocate(name, values.shape)[...] = values
+        for name, shape in (empty or {}).items():
+            self._allocate(name, shape, (dtypes or {}).get(name, np.float64))
+
+    def _allocate(self, name, shape, dtype=np.float64):
+        dtype = np.dtype(dtype)
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        block = shared_memory.SharedMemory(create=True, size=size)
+        self.blocks.append(block)
+        self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        self.spec[name] = (block.name, shape, dtype.str)
+        return self.arrays[name]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.arrays = {}
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+
+def attach_arrays(spec):
+    """
+    Map the shared arrays described by `spec`. Returns (arrays, handles); keep the
+    handles alive while using the arrays and close them afterwards.
+    """
+    handles, arrays = [], {}
+    for name, (block_name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        handles.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return arrays, handles
+
+
+def _block_bounds(block, chunk_size, num_portfolios):
+    start = block * chunk_size
+    return start, min(start + chunk_size, num_portfolios)
+
+
+def _simulate_blocks(spec, blocks, seed, num_portfolios, chunk_size, risk_free_rate,
+                     confidence_level, streaming, sampler, raster=None):
+    arrays, handles = attach_arrays(spec)
+    sampler = sampler or random_weights
+    try:
+        mean_returns = arrays['mean_returns']
+        if 'factor_loadings' in arrays:
+            cov_matrix = FactorCovariance(arrays['factor_loadings'], arrays['factor_variances'],
+                                          arrays['residual_variances'])
+        else:
+            cov_matrix = arrays['cov_matrix']
+        monthly_returns = arrays.get('monthly_returns')
+        # Blocks are folded in order into one reducer, so memory does not grow with the number of blocks
+        reducer = FrontierReducer() if streaming else None
+        if raster is not None:
+            raster = FrontierRaster(raster.volatility_range, raster.return_range, raster.bins)
+        for block in blocks:
+            start, stop = _block_bounds(block, chunk_size, num_portfolios)
+            started = time.perf_counter()
+            weights = sampler(block_rng(seed, block), stop - start, len(mean_returns))
+            returns, volatilities, sharpe_ratios = evaluate_portfolios(
+                weights, mean_returns, cov_matrix, risk_free_rate)
+            instrument.chunk('simulation', stop - start, time.perf_counter() - started)
+            es = None
+            if monthly_returns is not None:
+                es = portfolio_es(monthly_returns, weights, confidence_level=confidence_level)
+            if raster is not None:
+                raster.add(volatilities, returns, sharpe_ratios)
+            if streaming:
+                reducer.update(weights, returns, volatilities, sharpe_ratios, es)
+            else:
+                arrays['weights'][start:stop] = weights
+                arrays['returns'][start:stop] = returns
+                arrays['volatilities'][start:stop] = volatilities
+                arrays['sharpe_ratios'][start:stop] = sharpe_ratios
+                if es is not None:
+                    arrays['es'][start:stop] = es
+        return reducer, raster
+    finally:
+        del arrays
+        for handle in handles:
+            handle.close()
+
+
+def _es_range(spec, start, stop, confidence_level, chunk_size):
+    arrays, handles = attach_arrays(spec)
+    try:
+        arrays['es'][start:stop] = portfolio_es(arrays['monthly_returns'], arrays['weights'][start:stop],
+                                                confidence_level=confidence_level, chunk_size=chunk_size)
+    finally:
+        del arrays
+        for handle in handles:
+            handle.close()
+
+
+def _risk_range(spec, start, stop, index, options):
+    arrays, handles = attach_arrays(spec)
+    try:
+        daily_returns = pd.DataFrame(arrays['daily_returns'], index=index, copy=False)
+        for name, values in risk_measures(daily_returns, arrays['weights'][start:stop], **options).items():
+            arrays[name][start:stop] = values
+    finally:
+        del arrays
+        for handle in handles:
+            handle.close()
+
+
+def _resample_blocks(spec, blocks, seed, num_resamples, chunk_size, mean_block_length, starts):
+    arrays, handles = attach_arrays(spec)
+    try:
+        daily_matrix = arrays['daily_returns']
+        for block in blocks:
+            start, stop = _block_bounds(block, chunk_size, num_resamples)
+            indices = stationary_bootstrap_indices(block_rng(seed, block), len(daily_matrix), stop - start,
+                                                   mean_block_length)
+            means, counts, monthly = resample_statistics(daily_matrix, starts, indices)
+            arrays['means'][start:stop] = means
+            arrays['counts'][start:stop] = counts
+            arrays['monthly'][start:stop] = monthly
+    finally:
+        del arrays
+        for handle in handles:
+            handle.close()
+
+
+def _bootstrap_range(spec, start, stop, quantiles, risk_free_rate, confidence_level, memory_budget):
+    arrays, handles = attach_arrays(spec)
+    try:
+        intervals = bootstrap_quantiles(arrays['means'], arrays['counts'], arrays['monthly'],
+                                        arrays['daily_returns'], arrays['weights'][start:stop], quantiles,
+                                        risk_free_rate, confidence_level, memory_budget)
+        for name, values in intervals.items():
+            arrays[name][start:stop] = values
+    finally:
+        del arrays
+        for handle in handles:
+            handle.close()
+
+
+def _run(workers, function, tasks):
+    # workers == 1 runs in-process, which gives exactly the same result as the pool
+    if workers == 1:
+        return [function(*task) for task in tasks]
+    # One numba thread per worker: the pool already uses the cores
+    if not instrument.enabled():
+        with ProcessPoolExecutor(max_workers=workers, initializer=kernels.limit_threads) as pool:
+            return list(pool.map(function, *zip(*tasks)))
+    # Chunk measurements made in the workers are sent back with the results
+    with ProcessPoolExecutor(max_workers=workers, initializer=kernels.limit_threads) as pool:
+        results = list(pool.map(instrument.collected, [function] * len(tasks), *zip(*tasks)))
+    return [instrument.merge_collected(result) for result in results]
+
+
+def parallel_simulate(mean_returns, cov_matrix, num_portfolios, risk_free_rate=0.0, seed=None,
+                      workers=None, chunk_size=100000, monthly_returns=None, confidence_level=0.95,
+                      streaming=False, sampler=None, raster=None, weights_dtype=np.float64):
+    """
+    Simulate `num_portfolios` portfolios on `workers` processes (all cores by default).
+
+    Returns (weights, returns, volatilities, sharpe_ratios, es) arrays, with es None
+    unless `monthly_returns` is given, or a FrontierReducer when `streaming` is True.
+    With seed=None a fresh seed is drawn; pass an integer to make the run reproducible.
+    `sampler` draws the weights (see portfolio_optimizer.samplers); it must be picklable.
+    If a FrontierRaster is passed as `raster`, every simulated portfolio is also binned into
+    it, which keeps a picture of the whole cloud when only the frontier is streamed back.
+    The weights are returned (and held in shared memory) as `weights_dtype`, so a float32
+    run never holds a float64 copy of the weight matrix.
+    """
+    workers = workers or os.cpu_count() or 1
+    seed = np.random.SeedSequence(seed)
+    num_blocks = -(-num_portfolios // chunk_size)
+    n_assets = len(mean_returns)
+
+    inputs = {'mean_returns': mean_returns}
+    if isinstance(cov_matrix, FactorCovariance):
+        inputs.update(cov_matrix.arrays())
+    else:
+        inputs['cov_matrix'] = cov_matrix
+    if monthly_returns is not None:
+        inputs['monthly_returns'] = np.asarray(monthly_returns, dtype=float)
+    outputs = {}
+    if not streaming:
+        outputs = {'weights': (num_portfolios, n_assets), 'returns': (num_portfolios,),
+                   'volatilities': (num_portfolios,), 'sharpe_ratios': (num_portfolios,)}
+        if monthly_returns is not None:
+            outputs['es'] = (num_portfolios,)
+
+    with instrument.stage('simulation', portfolios=num_portfolios), \
+            SharedArrays(inputs, outputs, {'weights': weights_dtype}) as shared:
+        # Shard contiguous runs of blocks over the workers
+        shards = [list(blocks) for blocks in np.array_split(np.arange(num_blocks), min(workers, num_blocks))]
+        tasks = [(shared.spec, shard, seed, num_portfolios, chunk_size, risk_free_rate, confidence_level, streaming,
+                  sampler, raster) for shard in shards]
+        results = _run(min(workers, len(shards)), _simulate_blocks, tasks)
+        if raster is not None:
+            for _, shard_raster in results:
+                raster.merge(shard_raster)
+
+        if streaming:
+            # Shards are contiguous runs of blocks: merging them in shard order keeps the block order,
+            # so ties resolve the same way for any worker count
+            reducer = FrontierReducer()
+            for shard_reducer, _ in results:
+                reducer.merge(shard_reducer)
+            return reducer
+
+        return tuple(shared.arrays[name].copy() if name in shared.arrays else None
+                     for name in ('weights', 'returns', 'volatilities', 'sharpe_ratios', 'es'))
+
+
+def parallel_es(monthly_returns, weights, confidence_level=0.95, workers=None, chunk_size=10000):
+    """
+    portfolio_es on `workers` processes, each evaluating a contiguous slice of the weights.
+    """
+    workers = workers or os.cpu_count() or 1
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+    if workers == 1:
+        with instrument.stage('es', portfolios=len(weights)):
+            return portfolio_es(monthly_returns, weights, confidence_level=confidence_level, chunk_size=chunk_size)
+    inputs = {'monthly_returns': np.asarray(monthly_returns, dtype=float), 'weights': weights}
+    with instrument.stage('es', portfolios=len(weights)), SharedArrays(inputs, {'es': (len(weights),)}) as shared:
+        bounds = np.linspace(0, len(weights), workers + 1).astype(int)
+        tasks = [(shared.spec, start, stop, confidence_level, chunk_size)
+                 for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        _run(workers, _es_range, tasks)
+        return shared.arrays['es'].copy()
+
+
+def parallel_risk_measures(daily_returns, weights, workers=None, **options):
+    """
+    risk_measures on `workers` processes, each evaluating a contiguous slice of the weights.
+    `options` are passed on (horizons, confidence_levels, max_drawdown, memory_budget per worker).
+    """
+    workers = workers or os.cpu_count() or 1
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+    if workers == 1:
+        with instrument.stage('risk', portfolios=len(weights)):
+            return risk_measures(daily_returns, weights, **options)
+    # The names of the measures come from a run on a single portfolio
+    names = list(risk_measures(daily_returns, weights[:1], **options))
+    inputs = {'daily_returns': np.asarray(daily_returns, dtype=float), 'weights': weights}
+    with instrument.stage('risk', portfolios=len(weights)), \
+            SharedArrays(inputs, {name: (len(weights),) for name in names}) as shared:
+        bounds = np.linspace(0, len(weights), workers + 1).astype(int)
+        tasks = [(shared.spec, start, stop, daily_returns.index, options)
+                 for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        _run(workers, _risk_range, tasks)
+        return {name: shared.arrays[name].copy() for name in names}
+
+
+def parallel_bootstrap_intervals(daily_returns, weights, num_resamples=1000, mean_block_length=20,
+                                 quantiles=(0.05, 0.5, 0.95), risk_free_rate=0.0, confidence_level=0.95, seed=None,
+                                 workers=None, chunk_size=100, memory_budget=256 * 2 ** 20):
+    """
+    Stationary block-bootstrap quantiles of the return, volatility, Sharpe ratio and
+    monthly ES of every row of a weight matrix (see portfolio_optimizer.bootstrap).
+
+    `num_resamples` resamples of the daily returns, with blocks of `mean_block_length`
+    days on average, are drawn in blocks of `chunk_size` resamples (block i from
+    block_rng(seed, i), so the result does not depend on `workers`), then the portfolios
+    are evaluated against all of them on `workers` processes. Returns
+    {'<metric> q<quantile>': array}, e.g. 'ES q0.05'.
+    """
+    workers = workers or os.cpu_count() or 1
+    seed = np.random.SeedSequence(seed)
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+    starts = month_starts(daily_returns.index)
+    n_assets, num_months = daily_returns.shape[1], len(starts)
+    names = [interval_name(metric, q) for metric in METRICS for q in quantiles]
+
+    inputs = {'daily_returns': np.asarray(daily_returns, dtype=float), 'weights': weights}
+    # Day counts instead of covariance matrices: (resamples x days) whatever the number of assets
+    outputs = {'means': (num_resamples, n_assets), 'counts': (num_resamples, len(daily_returns)),
+               'monthly': (num_resamples, num_months, n_assets), **{name: (len(weights),) for name in names}}
+    with instrument.stage('bootstrap', resamples=num_resamples, portfolios=len(weights)), \
+            SharedArrays(inputs, outputs) as shared:
+        num_blocks = -(-num_resamples // chunk_size)
+        shards = [list(blocks) for blocks in np.array_split(np.arange(num_blocks), min(workers, num_blocks))]
+        _run(min(workers, len(shards)), _resample_blocks,
+             [(shared.spec, shard, seed, num_resamples, chunk_size, mean_block_length, starts) for shard in shards])
+
+        bounds = np.linspace(0, len(weights), workers + 1).astype(int)
+        tasks = [(shared.spec, start, stop, quantiles, risk_free_rate, confidence_level, memory_budget)
+                 for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        _run(workers, _bootstrap_range, tasks)
+        return {name: shared.arrays[name].copy() for name in names}
@@ -0,0 +1,382 @@
+"""
+Incremental pipeline runner: scripts 02-04 as a graph of stages that only
+re-runs what is stale.
+
+Each stage declares the artifacts it reads (inputs), the artifacts it writes
+(outputs) and the parameters it depends on. Every artifact is fingerprinted by
+a hash of its content, and a stage's fingerprint is the hash of its code
+version, its parameter values and the fingerprints of its inputs. A stage runs
+again only when its fingerprint differs from the one recorded in the state file
+(or an output is missing); otherwise its outputs are taken from disk. Because
+inputs are compared by content, a stage that re-runs and produces the same
+output does not invalidate the stages after it.
+
+With the default stages a new confidence level re-runs ES and selection only,
+a new maximum drawdown re-runs selection only, and a new ticker re-runs
+everything after the price store.
+
+    python -m portfolio_optimizer.pipeline --tickers AAPL MSFT VB --portfolio-size 100000 \
+        --confidence-level 0.95 --max-drawdown 8000
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from portfolio_optimizer import instrument
+from portfolio_optimizer.files import _atomic_write_json
+from portfolio_optimizer.results import PortfolioResults
+
+STATE_FILE = 'state.json'
+
+
+@dataclass
+class Stage:
+    name: str
+    function: object
+    inputs: tuple = ()
+    outputs: tuple = ()
+    # Parameters that determine the outputs; they are part of the fingerprint
+    params: tuple = ()
+    # Parameters that do not change the outputs (number of workers, ...); not fingerprinted
+    options: tuple = ()
+    # Source stages (reading the price store) always run; their outputs are still compared by content
+    always: bool = False
+    # Bump to invalidate the stored outputs after changing the stage's code
+    version: int = 1
+
+
+def _hash_update(digest, value):
+    if isinstance(value, PortfolioResults):
+        digest.update(json.dumps(value.stocks).encode())
+        _hash_update(digest, np.asarray(value.weights))
+        for name in sorted(value.metrics):
+            digest.update(name.encode())
+            _hash_update(digest, np.asarray(value.metrics[name]))
+    elif isinstance(value, np.ndarray):
+        digest.update(f"{value.dtype.str}{value.shape}".encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (pd.DataFrame, pd.Series)):
+        names = value.columns if isinstance(value, pd.DataFrame) else [value.name]
+        digest.update(json.dumps([str(name) for name in names]).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    else:
+        digest.update(pickle.dumps(value))
+
+
+def content_hash(value):
+    """
+    sha256 hex digest of an artifact's content (arrays, frames, PortfolioResults or picklable values).
+    """
+    digest = hashlib.sha256()
+    _hash_update(digest, value)
+    return digest.hexdigest()
+
+
+class Pipeline:
+    """
+    Stages in execution order, with their artifacts and state kept in `root`.
+    """
+    def __init__(self, stages, root='pipeline_state'):
+        self.stages = list(stages)
+        self.root = root
+        self.producers = {}
+        for stage in self.stages:
+            missing = [name for name in stage.inputs if name not in self.producers]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' reads {', '.join(missing)} before any stage writes it.")
+            for name in stage.outputs:
+                if name in self.producers:
+                    raise ValueError(f"Artifact '{name}' is written by both '{self.producers[name]}' and "
+                                     f"'{stage.name}'.")
+                self.producers[name] = stage.name
+        os.makedirs(os.path.join(root, 'artifacts'), exist_ok=True)
+        self.state = self._read_state()
+        self.loaded = {}
+
+    def _read_state(self):
+        path = os.path.join(self.root, STATE_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding='UTF-8') as f:
+            return json.load(f)
+
+    def _write_state(self):
+        _atomic_write_json(os.path.join(self.root, STATE_FILE), self.state)
+
+    def _find(self, name):
+        # Path of the stored artifact (directory, .npy or .pkl file), or None
+        base = os.path.join(self.root, 'artifacts', name)
+        for path in (base, base + '.npy', base + '.pkl'):
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _save(self, name, value):
+        path = os.path.join(self.root, 'artifacts', name)
+        if not isinstance(value, PortfolioResults):
+            path += '.npy' if isinstance(value, np.ndarray) else '.pkl'
+        # Write then rename, so a crash never leaves a half-written artifact behind
+        tmp_path = path + '.tmp'
+        if isinstance(value, PortfolioResults):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            value.save(tmp_path)
+        else:
+            with open(tmp_path, 'wb') as f:
+                if isinstance(value, np.ndarray):
+                    np.save(f, value)
+                else:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        old_path = self._find(name)
+        if old_path is not None and (old_path != path or os.path.isdir(path)):
+            shutil.rmtree(old_path) if os.path.isdir(old_path) else os.remove(old_path)
+        os.replace(tmp_path, path)
+
+    def load(self, name):
+        """
+        An artifact by name, from memory or from the artifact directory (arrays memory-mapped).
+        """
+        if name not in self.loaded:
+            path = self._find(name)
+            if path is None:
+                raise KeyError(f"Artifact '{name}' has not been computed yet.")
+            if os.path.isdir(path):
+                self.loaded[name] = PortfolioResults.load(path)
+            elif path.endswith('.npy'):
+                self.loaded[name] = np.load(path, mmap_mode='r')
+            else:
+                with open(path, 'rb') as f:
+                    self.loaded[name] = pickle.load(f)
+        return self.loaded[name]
+
+    def _fingerprint(self, stage, params, hashes):
+        digest = hashlib.sha256()
+        digest.update(json.dumps({'stage': stage.name, 'version': stage.version,
+                                  'params': {name: params[name] for name in stage.params},
+                                  'inputs': {name: hashes[name] for name in stage.inputs}},
+                                 sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def _needed(self, targets):
+        # The stages producing `targets` and everything upstream of them
+        if targets is None:
+            return {stage.name for stage in self.stages}
+        by_name = {stage.name: stage for stage in self.stages}
+        needed, pending = set(), [self.producers[name] for name in targets]
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending.extend(self.producers[artifact] for artifact in by_name[name].inputs)
+        return needed
+
+    def stale(self, params, targets=None):
+        """
+        Names of the stages run(params) would execute, without running anything but the
+        source stages (their outputs decide what is stale downstream).
+        """
+        always = {stage.name for stage in self.stages if stage.always}
+        return [name for name in self.run(params, targets=targets, dry_run=True)['executed'] if name not in always]
+
+    def run(self, params, targets=None, dry_run=False):
+        """
+        Run the stale stages for `params` (a dict with every stage parameter and option).
+        Only the stages needed for the `targets` artifacts run when they are given.
+        Returns {'executed': [...], 'skipped': [...]}; read the outputs with load().
+        """
+        needed = self._needed(targets)
+        hashes = {}
+        executed, skipped = [], []
+        for stage in self.stages:
+            if stage.name not in needed:
+                continue
+            unknown = [name for name in stage.inputs if hashes.get(name) is None]
+            fingerprint = None if unknown else self._fingerprint(stage, params, hashes)
+            recorded = self.state.get(stage.name, {})
+            fresh = (not stage.always and fingerprint is not None and recorded.get('fingerprint') == fingerprint
+                     and all(self._find(name) is not None for name in stage.outputs))
+            if fresh:
+                hashes.update(recorded['outputs'])
+                skipped.append(stage.name)
+                continue
+            executed.append(stage.name)
+            if dry_run and not stage.always:
+                # Outputs of a stage that would run are unknown until it runs
+                hashes.update({name: None for name in stage.outputs})
+                continue
+
+            with instrument.stage(f'pipeline_{stage.name}'):
+                arguments = {name: self.load(name) for name in stage.inputs}
+                arguments.update({name: params[name] for name in stage.params + stage.options})
+                values = stage.function(**arguments)
+            if len(stage.outputs) == 1:
+                values = (values,)
+            outputs = {name: content_hash(value) for name, value in zip(stage.outputs, values)}
+            hashes.update(outputs)
+            if dry_run:
+                continue
+            for name, value in zip(stage.outputs, values):
+                if recorded.get('outputs', {}).get(name) != outputs[name] or self._find(name) is None:
+                    self._save(name, value)
+                self.loaded[name] = value
+            self.state[stage.name] = {'fingerprint': self._fingerprint(stage, params, hashes), 'outputs': outputs}
+            self._write_state()
+        return {'executed': executed, 'skipped': skipped}
+
+
+def _prices(store_dir, tickers, start, end):
+    from portfolio_optimizer.store import PriceStore
+    return PriceStore(store_dir).load_prices(tickers, start=start, end=end)
+
+
+def _returns(prices):
+    daily_returns = prices.pct_change(fill_method=None).dropna()
+    return daily_returns, list(daily_returns.columns)
+
+
+def _moments(daily_returns, cov_method, n_factors):
+    from portfolio_optimizer.analytics import annualized_moments
+    return annualized_moments(daily_returns, cov_method=cov_method, n_factors=n_factors)
+
+
+def _monthly_returns(daily_returns):
+    from portfolio_optimizer.risk import monthly_asset_returns
+    return monthly_asset_returns(daily_returns)
+
+
+def _simulation(stocks, mean_returns, cov_matrix, num_portfolios, seed, risk_free_rate, sampler_name, chunk_size, workers):
+    from portfolio_optimizer.parallel import parallel_simulate
+    from portfolio_optimizer.samplers import get_sampler
+    weights, returns, volatilities, sharpe_ratios, _ = parallel_simulate(
+        mean_returns, cov_matrix, num_portfolios, risk_free_rate, seed=seed, workers=workers, chunk_size=chunk_size,
+        sampler=get_sampler(sampler_name))
+    return PortfolioResults(stocks, weights, {'Return': returns, 'Volatility': volatilities,
+                                              'Sharpe Ratio': sharpe_ratios})
+
+
+def _optimal_portfolios(stocks, mean_returns, cov_matrix, portfolios, risk_free_rate, optimizer_mode):
+    from portfolio_optimizer.optimize import max_sharpe_weights, min_variance_weights, portfolio_row
+    if optimizer_mode == 'exact':
+        return (portfolio_row(max_sharpe_weights(mean_returns, cov_matrix, risk_free_rate),
+                              mean_returns, cov_matrix, risk_free_rate, stocks),
+                portfolio_row(min_variance_weights(cov_matrix), mean_returns, cov_matrix, risk_free_rate, stocks))
+    return (portfolios.row(int(np.argmax(portfolios.metrics['Sharpe Ratio']))),
+            portfolios.row(int(np.argmin(portfolios.metrics['Volatility']))))
+
+
+def _es(monthly_returns, portfolios, confidence_level, workers):
+    from portfolio_optimizer.parallel import parallel_es
+    return parallel_es(monthly_returns, portfolios.weights, confidence_level=confidence_level, workers=workers)
+
+
+def _selection(stocks, mean_returns, cov_matrix, monthly_returns, portfolios, es, risk_free_rate, portfolio_size,
+               confidence_level, max_drawdown_dollars, optimizer_mode):
+    es_dollars = np.asarray(es) * portfolio_size
+    feasible = es_dollars >= -max_drawdown_dollars
+    feasible_portfolios = portfolios.subset(feasible)
+    feasible_portfolios.metrics.update({'ES': np.asarray(es)[feasible], 'ES_dollars': es_dollars[feasible]})
+
+    if optimizer_mode == 'exact':
+        from portfolio_optimizer.optimize import max_return_es_weights, portfolio_row
+        from portfolio_optimizer.risk import portfolio_es
+        optimal_weights = max_return_es_weights(mean_returns, monthly_returns, confidence_level,
+                                                max_drawdown_dollars / portfolio_size)
+        if optimal_weights is None:
+            return feasible_portfolios, None
+        optimal_portfolio = portfolio_row(optimal_weights, mean_returns, cov_matrix, risk_free_rate, stocks)
+        optimal_portfolio['ES'] = portfolio_es(monthly_returns, optimal_weights, confidence_level=confidence_level)[0]
+        optimal_portfolio['ES_dollars'] = optimal_portfolio['ES'] * portfolio_size
+        return feasible_portfolios, optimal_portfolio
+    if not len(feasible_portfolios):
+        return feasible_portfolios, None
+    return feasible_portfolios, feasible_portfolios.row(int(np.argmax(feasible_portfolios.metrics['Return'])))
+
+
+def default_stages():
+    """
+    The stages of scripts 02-04: price store -> returns -> moments / monthly returns ->
+    simulation -> optimal portfolios, ES -> selection.
+    """
+    return [
+        Stage('prices', _prices, outputs=('prices',), params=('store_dir', 'tickers', 'start', 'end'), always=True),
+        Stage('returns', _returns, inputs=('prices',), outputs=('daily_returns', 'stocks')),
+        Stage('moments', _moments, inputs=('daily_returns',), outputs=('mean_returns', 'cov_matrix'),
+              params=('cov_method', 'n_factors')),
+        Stage('monthly_returns', _monthly_returns, inputs=('daily_returns',), outputs=('monthly_returns',)),
+        Stage('simulation', _simulation, inputs=('stocks', 'mean_returns', 'cov_matrix'), outputs=('portfolios',),
+              params=('num_portfolios', 'seed', 'risk_free_rate', 'sampler_name', 'chunk_size'),
+              options=('workers',)),
+        Stage('optimal_portfolios', _optimal_portfolios,
+              inputs=('stocks', 'mean_returns', 'cov_matrix', 'portfolios'),
+              outputs=('optimal_sharpe', 'optimal_volatility'), params=('risk_free_rate', 'optimizer_mode')),
+        Stage('es', _es, inputs=('monthly_returns', 'portfolios'), outputs=('es',), params=('confidence_level',),
+              options=('workers',)),
+        Stage('selection', _selection,
+              inputs=('stocks', 'mean_returns', 'cov_matrix', 'monthly_returns', 'portfolios', 'es'),
+              outputs=('feasible_portfolios', 'optimal_portfolio'),
+              params=('risk_free_rate', 'portfolio_size', 'confidence_level', 'max_drawdown_dollars',
+                      'optimizer_mode')),
+    ]
+
+
+DEFAULT_PARAMS = {'store_dir': 'price_store', 'cov_method': 'sample', 'n_factors': 5, 'num_portfolios': 100000,
+                  'seed': 0, 'risk_free_rate': 0.0, 'sampler_name': 'uniform', 'chunk_size': 100000,
+                  'optimizer_mode': 'sampling', 'workers': 1}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', nargs='+', required=True)
+    parser.add_argument('--portfolio-size', type=float, required=True)
+    parser.add_argument('--confidence-level', type=float, required=True)
+    parser.add_argument('--max-drawdown', type=float, required=True, help='maximum monthly ES in dollars')
+    parser.add_argument('--store', default='price_store', help='price store filled by script 02')
+    parser.add_argument('--state', default='pipeline_state', help='directory of the artifacts and the state file')
+    parser.add_argument('--years', type=int, default=5, help='years of history to use')
+    parser.add_argument('--num-portfolios', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--risk-free-rate', type=float, default=0.0)
+    parser.add_argument('--sampler', default='uniform')
+    parser.add_argument('--cov-method', default='sample')
+    parser.add_argument('--optimizer-mode', choices=['exact', 'sampling'], default='sampling',
+                        help="'exact' needs scipy")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--dry-run', action='store_true', help='only list the stages that would run')
+    args = parser.parse_args(argv)
+
+    end_date = pd.Timestamp(datetime.date.today())
+    params = dict(DEFAULT_PARAMS, store_dir=args.store, tickers=sorted(ticker.upper() for ticker in args.tickers),
+                  start=str((end_date - pd.DateOffset(years=args.years)).date()), end=str(end_date.date()),
+                  num_portfolios=args.num_portfolios, seed=args.seed, risk_free_rate=args.risk_free_rate,
+                  sampler_name=args.sampler, cov_method=args.cov_method, optimizer_mode=args.optimizer_mode,
+                  workers=args.workers, portfolio_size=args.portfolio_size, confidence_level=args.confidence_level,
+                  max_drawdown_dollars=args.max_drawdown)
+
+    pipeline = Pipeline(default_stages(), args.state)
+    if args.dry_run:
+        print(f"Stale stages: {', '.join(pipeline.stale(params)) or 'none'}")
+        return 0
+    report = pipeline.run(params)
+    print(f"Executed: {', '.join(report['executed']) or 'none'}")
+    print(f"Up to date: {', '.join(report['skipped']) or 'none'}")
+
+    optimal_portfolio = pipeline.load('optimal_portfolio')
+    print(f"{len(pipeline.load('feasible_portfolios'))} feasible portfolios.")
+    if optimal_portfolio is None:
+        print("No portfolio meets the given ES dollar loss constraints.")
+    else:
+        print("\nOptimal portfolio that meets the ES constraints:")
+        print(optimal_portfolio)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
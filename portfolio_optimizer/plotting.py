@@ -0,0 +1,115 @@
+"""
+Headless, rasterized rendering of large portfolio clouds.
+
+FrontierRaster bins the simulated portfolios into a fixed (volatility x return)
+grid, keeping the count and the best Sharpe ratio per cell. It can be filled
+chunk by chunk (also on worker processes, then merged). Rendering draws that
+image plus only a few vector overlays (frontier, feasible boundary, optimal
+points) and writes a PNG/SVG file without a display, so render time does not
+depend on the number of portfolios. matplotlib is imported only when rendering.
+"""
+import os
+
+import numpy as np
+
+from portfolio_optimizer import instrument
+from portfolio_optimizer.frontier import nondominated
+
+
+class FrontierRaster:
+    def __init__(self, volatility_range, return_range, bins=(400, 300)):
+        self.volatility_range = tuple(volatility_range)
+        self.return_range = tuple(return_range)
+        self.bins = tuple(bins)  # (volatility bins, return bins)
+        self.counts = np.zeros(self.bins[1] * self.bins[0], dtype=np.int64)
+        self.max_sharpe = np.full(self.bins[1] * self.bins[0], -np.inf)
+
+    @classmethod
+    def for_universe(cls, mean_returns, cov_matrix, bins=(400, 300)):
+        """
+        Grid covering every long-only portfolio: volatility lies between 0 and the largest
+        asset volatility, and return between the lowest and highest asset return.
+        """
+        max_volatility = np.sqrt(np.diag(np.asarray(cov_matrix))).max()
+        low, high = float(np.min(mean_returns)), float(np.max(mean_returns))
+        margin = 0.02 * (high - low) or 0.01
+        return cls((0.0, 1.02 * max_volatility), (low - margin, high + margin), bins)
+
+    def _cells(self, volatilities, returns):
+        nx, ny = self.bins
+        (x0, x1), (y0, y1) = self.volatility_range, self.return_range
+        ix = np.clip(((volatilities - x0) / (x1 - x0) * nx).astype(np.int64), 0, nx - 1)
+        iy = np.clip(((returns - y0) / (y1 - y0) * ny).astype(np.int64), 0, ny - 1)
+        return iy * nx + ix
+
+    def add(self, volatilities, returns, sharpe_ratios):
+        cells = self._cells(np.asarray(volatilities), np.asarray(returns))
+        self.counts += np.bincount(cells, minlength=len(self.counts))
+        np.maximum.at(self.max_sharpe, cells, sharpe_ratios)
+        return self
+
+    def merge(self, other):
+        self.counts += other.counts
+        np.maximum(self.max_sharpe, other.max_sharpe, out=self.max_sharpe)
+        return self
+
+    def image(self, color_by='sharpe'):
+        """
+        (return bins x volatility bins) image, NaN where no portfolio fell.
+        """
+        values = self.max_sharpe if color_by == 'sharpe' else np.log10(np.maximum(self.counts, 1))
+        values = np.where(self.counts > 0, values, np.nan)
+        return values.reshape(self.bins[1], self.bins[0])
+
+
+def frontier_line(volatilities, returns):
+    """
+    Upper frontier of a cloud (nondominated in return vs. volatility), sorted by volatility.
+    """
+    volatilities, returns = np.asarray(volatilities), np.asarray(returns)
+    on_front = nondominated(returns, -volatilities)
+    order = np.argsort(volatilities[on_front])
+    return volatilities[on_front][order], returns[on_front][order]
+
+
+def render_frontier(raster, path, frontier=None, feasible_boundary=None, points=None, color_by='sharpe',
+                    title='Efficient Frontier', xlabel='Volatility (Risk)', ylabel='Return'):
+    """
+    Draw the raster with vector overlays and save it to `path` (format from the extension).
+    `frontier` and `feasible_boundary` are (volatilities, returns) lines; `points` maps a
+    label to (volatility, return, color).
+    """
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(10, 6))
+    ax = fig.add_subplot()
+    image = ax.imshow(raster.image(color_by), origin='lower', aspect='auto', cmap='viridis', interpolation='nearest',
+                      extent=(*raster.volatility_range, *raster.return_range))
+    fig.colorbar(image, ax=ax, label='Sharpe Ratio (best in cell)' if color_by == 'sharpe' else 'log10(portfolios)')
+    if frontier is not None:
+        ax.plot(*frontier, color='black', linewidth=1.5, label='Frontier')
+    if feasible_boundary is not None:
+        ax.plot(*feasible_boundary, color='orange', linewidth=2, label='ES-Feasible Frontier')
+    for label, (volatility, portfolio_return, color) in (points or {}).items():
+        ax.scatter(volatility, portfolio_return, color=color, s=120, edgecolors='black', label=label, zorder=3)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.legend()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with instrument.stage('plot_output', cells=int((raster.counts > 0).sum())):
+        fig.savefig(path)
+    return path
+
+
+def render_weights(weights, stocks, path, title="Portfolio Weights"):
+    """
+    Pie chart of one portfolio's weights, saved to `path` without a display.
+    """
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(8, 8))
+    ax = fig.add_subplot()
+    ax.pie(weights, labels=stocks, autopct='%1.1f%%', startangle=140)
+    ax.set_title(title)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fig.savefig(path)
+    return path
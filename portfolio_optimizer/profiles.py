@@ -0,0 +1,205 @@
+"""
+Batch investor profiles: answer many (portfolio size, confidence level, maximum
+drawdown) profiles from one simulation.
+
+The ES vector is computed once per distinct confidence level. Portfolios are then
+sorted by ES, and the best return among every ES-sorted suffix is precomputed,
+so each profile is answered with a single binary search.
+
+    python -m portfolio_optimizer.profiles profiles.csv --tickers AAPL MSFT VB --output profile_results.csv
+
+The profile file is a CSV (or JSON list) with the columns name, portfolio_size,
+confidence_level and max_drawdown_dollars.
+"""
+import argparse
+import datetime
+import json
+import sys
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from portfolio_optimizer.analytics import annualized_moments
+from portfolio_optimizer.parallel import parallel_es, parallel_simulate
+from portfolio_optimizer.results import PortfolioResults
+from portfolio_optimizer.risk import monthly_asset_returns
+
+
+@dataclass
+class InvestorProfile:
+    name: str
+    portfolio_size: float
+    confidence_level: float
+    max_drawdown_dollars: float
+
+    def validate(self):
+        """
+        Same checks as the prompts of script 04. Raises ValueError.
+        """
+        if self.portfolio_size <= 0:
+            raise ValueError(f"{self.name}: Portfolio size must be greater than 0.")
+        if self.confidence_level <= 0 or self.confidence_level >= 1:
+            raise ValueError(f"{self.name}: Confidence level must be between 0 and 1.")
+        if self.max_drawdown_dollars <= 0:
+            raise ValueError(f"{self.name}: Maximum drawdown must be greater than 0.")
+        if self.max_drawdown_dollars >= self.portfolio_size:
+            raise ValueError(f"{self.name}: Maximum drawdown must be smaller than the portfolio size.")
+        return self
+
+    @property
+    def min_es(self):
+        # ES_dollars >= -max_drawdown_dollars  <=>  ES >= -max_drawdown_dollars / portfolio_size
+        return -self.max_drawdown_dollars / self.portfolio_size
+
+
+def load_profiles(path):
+    """
+    Read and validate investor profiles from a CSV or JSON file.
+    """
+    if path.lower().endswith('.json'):
+        with open(path, encoding='UTF-8') as f:
+            records = json.load(f)
+    else:
+        records = pd.read_csv(path).to_dict('records')
+    profiles = []
+    for i, record in enumerate(records):
+        profiles.append(InvestorProfile(name=str(record.get('name', f"profile_{i + 1}")),
+                                        portfolio_size=float(record['portfolio_size']),
+                                        confidence_level=float(record['confidence_level']),
+                                        max_drawdown_dollars=float(record['max_drawdown_dollars'])).validate())
+    return profiles
+
+
+class ESIndex:
+    """
+    Portfolios sorted by ES, with the highest-return portfolio of every ES-sorted suffix.
+    best(min_es) returns (index of the highest-return portfolio with ES >= min_es, number
+    of such portfolios), or (None, 0) if there is none.
+    """
+    def __init__(self, es, returns):
+        self.order = np.argsort(es, kind='stable')
+        self.sorted_es = es[self.order]
+        # Position (in ES order) of the highest return from each position to the end
+        reversed_returns = returns[self.order][::-1]
+        running_max = np.maximum.accumulate(reversed_returns)
+        is_new_max = np.concatenate([[True], reversed_returns[1:] > running_max[:-1]])
+        best_reversed = np.maximum.accumulate(np.where(is_new_max, np.arange(len(es)), 0))
+        self.suffix_best = self.order[::-1][best_reversed][::-1]
+
+    def best(self, min_es):
+        position = np.searchsorted(self.sorted_es, min_es, side='left')
+        if position == len(self.sorted_es):
+            return None, 0
+        return self.suffix_best[position], len(self.sorted_es) - position
+
+
+class ProfileEngine:
+    """
+    Answers investor profiles from one set of simulated portfolios.
+    `portfolio_results` is the PortfolioResults of script 03 (weights plus at least
+    'Return', 'Volatility' and 'Sharpe Ratio'), `monthly_returns` the per-asset monthly
+    returns (risk.monthly_asset_returns).
+    """
+    def __init__(self, portfolio_results, monthly_returns, workers=1):
+        self.portfolio_results = portfolio_results
+        self.stocks = portfolio_results.stocks
+        self.weights = portfolio_results.weights
+        self.returns = portfolio_results.metrics['Return']
+        self.monthly_returns = monthly_returns
+        self.workers = workers
+        self.es_vectors = {}
+        self.indexes = {}
+
+    def es_vector(self, confidence_level):
+        if confidence_level not in self.es_vectors:
+            self.es_vectors[confidence_level] = parallel_es(self.monthly_returns, self.weights,
+                                                            confidence_level=confidence_level, workers=self.workers)
+        return self.es_vectors[confidence_level]
+
+    def index(self, confidence_level):
+        if confidence_level not in self.indexes:
+            self.indexes[confidence_level] = ESIndex(self.es_vector(confidence_level), self.returns)
+        return self.indexes[confidence_level]
+
+    def optimal_portfolio(self, profile):
+        """
+        Highest-return portfolio meeting the profile's ES constraint (a Series with ES and
+        ES_dollars added) and the number of feasible portfolios. None if nothing is feasible.
+        """
+        best, feasible_count = self.index(profile.confidence_level).best(profile.min_es)
+        if best is None:
+            return None, 0
+        optimal_portfolio = self.portfolio_results.row(best)
+        optimal_portfolio['ES'] = self.es_vector(profile.confidence_level)[best]
+        optimal_portfolio['ES_dollars'] = optimal_portfolio['ES'] * profile.portfolio_size
+        return optimal_portfolio, feasible_count
+
+    def feasible_portfolios(self, profile):
+        """
+        All portfolios meeting the profile's ES constraint (same as the filter in script 04),
+        as a PortfolioResults with 'ES' and 'ES_dollars' added.
+        """
+        es = self.es_vector(profile.confidence_level)
+        feasible = es >= profile.min_es
+        feasible_portfolios = self.portfolio_results.subset(feasible)
+        feasible_portfolios.metrics.update({'ES': es[feasible], 'ES_dollars': es[feasible] * profile.portfolio_size})
+        return feasible_portfolios
+
+    def answer(self, profiles):
+        """
+        One row per profile: the profile, the number of feasible portfolios and the optimal portfolio.
+        """
+        rows = []
+        for profile in profiles:
+            optimal_portfolio, feasible_count = self.optimal_portfolio(profile)
+            row = {'Profile': profile.name, 'Portfolio Size': profile.portfolio_size,
+                   'Confidence Level': profile.confidence_level,
+                   'Max Drawdown Dollars': profile.max_drawdown_dollars,
+                   'Feasible Portfolios': feasible_count}
+            if optimal_portfolio is not None:
+                row.update(optimal_portfolio.to_dict())
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('profiles', help='CSV or JSON file of investor profiles')
+    parser.add_argument('--tickers', nargs='+', required=True)
+    parser.add_argument('--store', default='price_store', help='price store filled by script 02')
+    parser.add_argument('--years', type=int, default=5, help='years of history to use')
+    parser.add_argument('--num-portfolios', type=int, default=100000)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--risk-free-rate', type=float, default=0.0)
+    parser.add_argument('--output', default='profile_results.csv')
+    args = parser.parse_args(argv)
+
+    from portfolio_optimizer.store import PriceStore
+
+    profiles = load_profiles(args.profiles)
+    end_date = pd.Timestamp(datetime.date.today())
+    start_date = end_date - pd.DateOffset(years=args.years)
+    financial_data = PriceStore(args.store).load_prices(args.tickers, start=start_date, end=end_date)
+    daily_returns = financial_data.pct_change(fill_method=None).dropna()
+    stocks = list(daily_returns.columns)
+    missing = sorted(set(args.tickers) - set(stocks))
+    if missing:
+        print(f"Warning: no stored prices for {', '.join(missing)}. Run script 02 first.")
+
+    mean_returns, cov_matrix = annualized_moments(daily_returns)
+    weights, returns, volatilities, sharpe_ratios, _ = parallel_simulate(
+        mean_returns, cov_matrix, args.num_portfolios, args.risk_free_rate, seed=args.seed, workers=args.workers)
+    portfolio_results = PortfolioResults(stocks, weights, {'Return': returns, 'Volatility': volatilities,
+                                                          'Sharpe Ratio': sharpe_ratios})
+    engine = ProfileEngine(portfolio_results, monthly_asset_returns(daily_returns), workers=args.workers)
+
+    results = engine.answer(profiles)
+    results.to_csv(args.output, index=False)
+    print(f"{len(profiles)} profiles answered, results saved to '{args.output}'.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Compact, array-backed storage of simulated portfolios.
+
+A result set is one contiguous (num_portfolios x n_assets) weights array,
+one array per metric ('Return', 'Volatility', 'Sharpe Ratio', 'ES', ...) and a
+small header with the tickers. It is saved as plain .npy files that later
+stages load memory-mapped, without any parsing. CSV export is opt-in.
+"""
+import json
+import os
+
+import numpy as np
+
+from portfolio_optimizer import instrument
+from portfolio_optimizer.analytics import portfolio_frame
+
+HEADER_FILE = 'header.json'
+WEIGHTS_FILE = 'weights.npy'
+
+
+class PortfolioResults:
+    def __init__(self, stocks, weights, metrics):
+        self.stocks = list(stocks)
+        self.weights = weights
+        self.metrics = dict(metrics)
+
+    @classmethod
+    def from_frame(cls, portfolio_metrics, stocks, weights_dtype=np.float64):
+        """
+        Convert a portfolio_metrics DataFrame (metric columns plus '<stock> Weight' columns).
+        """
+        weight_columns = [stock + ' Weight' for stock in stocks]
+        weights = portfolio_metrics[weight_columns].to_numpy(dtype=weights_dtype)
+        metrics = {name: portfolio_metrics[name].to_numpy() for name in portfolio_metrics.columns
+                   if name not in weight_columns}
+        return cls(stocks, weights, metrics)
+
+    def __len__(self):
+        return len(self.weights)
+
+    def append(self, weights, metrics):
+        """
+        New result set with the given portfolios added at the end (same metric names).
+        """
+        weights = np.concatenate([self.weights, np.asarray(weights, dtype=self.weights.dtype)])
+        return PortfolioResults(self.stocks, weights,
+                                {name: np.concatenate([values, metrics[name]]) for name, values in self.metrics.items()})
+
+    def subset(self, selection):
+        """
+        Portfolios selected by a boolean mask or an index array.
+        """
+        return PortfolioResults(self.stocks, self.weights[selection],
+                                {name: values[selection] for name, values in self.metrics.items()})
+
+    def row(self, index):
+        """
+        One portfolio as a Series in the layout of a portfolio_metrics row (for printing).
+        """
+        return self.subset([index]).to_frame().iloc[0].rename(index)
+
+    def to_frame(self):
+        """
+        The portfolio_metrics DataFrame layout used by scripts 03 and 04.
+        """
+        portfolio_metrics = portfolio_frame(self.stocks, self.weights, self.metrics['Return'],
+                                            self.metrics['Volatility'], self.metrics['Sharpe Ratio'])
+        for name, values in self.metrics.items():
+            if name not in portfolio_metrics:
+                portfolio_metrics[name] = values
+        return portfolio_metrics
+
+    def to_csv(self, path):
+        with instrument.stage('csv_write', portfolios=len(self)):
+            self.to_frame().to_csv(path, index=False)
+
+    def save(self, directory):
+        """
+        Write weights.npy, one .npy file per metric and header.json into `directory`.
+        """
+        os.makedirs(directory, exist_ok=True)
+        with instrument.stage('results_write', portfolios=len(self)) as stage:
+            np.save(os.path.join(directory, WEIGHTS_FILE), np.ascontiguousarray(self.weights))
+            metric_files = {}
+            for name, values in self.metrics.items():
+                metric_files[name] = name.replace(' ', '_') + '.npy'
+                np.save(os.path.join(directory, metric_files[name]), values)
+            header = {'tickers': self.stocks, 'count': len(self), 'weights_dtype': str(self.weights.dtype),
+                      'metrics': metric_files}
+            with open(os.path.join(directory, HEADER_FILE), 'w', encoding='UTF-8') as f:
+                json.dump(header, f, indent=1)
+            stage.add(bytes=self.weights.nbytes + sum(np.asarray(values).nbytes for values in self.metrics.values()))
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Load a saved result set. With mmap=True the arrays are read-only memory maps.
+        """
+        with open(os.path.join(directory, HEADER_FILE), encoding='UTF-8') as f:
+            header = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        weights = np.load(os.path.join(directory, WEIGHTS_FILE), mmap_mode=mmap_mode)
+        metrics = {name: np.load(os.path.join(directory, file_name), mmap_mode=mmap_mode)
+                   for name, file_name in header['metrics'].items()}
+        return cls(header['tickers'], weights, metrics)
@@ -0,0 +1,140 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from portfolio_optimizer import instrument, kernels
+
+
+def portfolio_monthly_return_series(daily_returns, weights):
+    portfolio_daily_returns = (daily_returns * weights).sum(axis=1)
+    monthly_returns = portfolio_daily_returns.resample('M').sum()
+    return monthly_returns
+
+
+def compute_es(portfolio_returns, confidence_level=0.95):
+    """
+    Compute the Expected Shortfall (ES) at a given confidence level.
+    ES is the average return of the worst (1 - confidence_level)*100% of months.
+    """
+    sorted_returns = np.sort(portfolio_returns)
+    cutoff_index = int((1 - confidence_level) * len(sorted_returns))
+    tail_losses = sorted_returns[:cutoff_index+1]
+    es = tail_losses.mean()
+    return es
+
+
+def monthly_asset_returns(daily_returns):
+    """
+    Per-asset monthly returns (sum of daily returns in each month).
+    Portfolio monthly returns are linear in the weights, so this matrix only
+    has to be built once: monthly_portfolio = monthly_asset_returns @ weights.
+    """
+    return daily_returns.resample('M').sum()
+
+
+def tail_size(num_periods, confidence_level):
+    """
+    Number of worst periods averaged by compute_es for `num_periods` observations.
+    """
+    return int((1 - confidence_level) * num_periods) + 1
+
+
+def portfolio_es(monthly_returns, weights, confidence_level=0.95, chunk_size=10000):
+    """
+    Expected Shortfall for every row of a (num_portfolios x n_assets) weight matrix.
+    `monthly_returns` is the (months x n_assets) matrix from monthly_asset_returns.
+    Same definition as compute_es, but portfolios are evaluated chunk by chunk with
+    one matrix multiply and the tail is found by partial selection instead of a sort.
+    """
+    monthly_matrix = np.asarray(monthly_returns, dtype=float)
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+    num_months = monthly_matrix.shape[0]
+    k = min(tail_size(num_months, confidence_level), num_months)
+
+    es = np.empty(len(weights))
+    for start in range(0, len(weights), chunk_size):
+        stop = start + chunk_size
+        started = time.perf_counter()
+        if kernels.active():
+            # Fused numba kernel: the chunk's portfolio months are never materialized
+            es[start:stop] = kernels.fused_es(monthly_matrix, weights[start:stop], k)
+        else:
+            portfolio_months = weights[start:stop] @ monthly_matrix.T
+            if k < num_months:
+                portfolio_months = np.partition(portfolio_months, k - 1, axis=1)
+            es[start:stop] = portfolio_months[:, :k].mean(axis=1)
+        instrument.chunk('es', len(weights[start:stop]), time.perf_counter() - started)
+    return es
+
+
+HORIZONS = {'weekly': 'W', 'monthly': 'M', 'quarterly': 'Q'}
+
+
+def period_ends(index, freq):
+    """
+    Positions of the last day of each period (week, month, quarter) in a sorted daily index.
+    """
+    periods = pd.DatetimeIndex(index).to_period(freq).asi8
+    return np.append(np.flatnonzero(periods[1:] != periods[:-1]), len(periods) - 1)
+
+
+def risk_chunk_size(num_days, memory_budget=256 * 2 ** 20):
+    """
+    Portfolios per chunk so that the two (portfolios x days) wealth paths fit in `memory_budget` bytes.
+    """
+    return max(1, int(memory_budget // (16 * max(num_days, 1))))
+
+
+def risk_measures(daily_returns, weights, horizons=('weekly', 'monthly', 'quarterly'),
+                  confidence_levels=(0.95, 0.99), max_drawdown=True, memory_budget=256 * 2 ** 20):
+    """
+    Several risk measures for every row of a (num_portfolios x n_assets) weight matrix,
+    in one chunked pass over the daily returns.
+
+    Per horizon the portfolio returns are compounded over each period (not summed) and,
+    per confidence level, 'VaR <horizon> <level>' is the k-th worst period return and
+    'ES <horizon> <level>' the mean of the k worst, with k = tail_size(periods, level) as
+    in compute_es. 'Max Drawdown' is the largest peak-to-trough loss of the compounded
+    wealth path (a negative fraction, like ES). Only one chunk of daily wealth paths is
+    held at a time, sized to `memory_budget` bytes. Returns {measure name: array}.
+    """
+    daily_matrix = np.asarray(daily_returns, dtype=float)
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+    ends = {horizon: period_ends(daily_returns.index, HORIZONS[horizon]) for horizon in horizons}
+
+    results = {}
+    for horizon in horizons:
+        for level in confidence_levels:
+            results[f"VaR {horizon} {level:g}"] = np.empty(len(weights))
+            results[f"ES {horizon} {level:g}"] = np.empty(len(weights))
+    if max_drawdown:
+        results['Max Drawdown'] = np.empty(len(weights))
+
+    chunk_size = risk_chunk_size(len(daily_matrix), memory_budget)
+    for start in range(0, len(weights), chunk_size):
+        stop = start + chunk_size
+        started = time.perf_counter()
+        # Log wealth path of each portfolio, computed in place
+        log_wealth = weights[start:stop] @ daily_matrix.T
+        np.log1p(log_wealth, out=log_wealth)
+        np.cumsum(log_wealth, axis=1, out=log_wealth)
+
+        for horizon, positions in ends.items():
+            period_returns = np.expm1(np.diff(log_wealth[:, positions], axis=1, prepend=0.0))
+            num_periods = period_returns.shape[1]
+            for level in confidence_levels:
+                k = min(tail_size(num_periods, level), num_periods)
+                tail = np.partition(period_returns, k - 1, axis=1)
+                results[f"VaR {horizon} {level:g}"][start:stop] = tail[:, k - 1]
+                results[f"ES {horizon} {level:g}"][start:stop] = tail[:, :k].mean(axis=1)
+
+        if max_drawdown:
+            # Running peak of the log wealth, starting from the initial wealth (log 1 = 0)
+            peak = np.maximum.accumulate(log_wealth, axis=1)
+            np.maximum(peak, 0.0, out=peak)
+            peak -= log_wealth
+            results['Max Drawdown'][start:stop] = np.expm1(-peak.max(axis=1))
+            del peak
+        instrument.chunk('risk', len(log_wealth), time.perf_counter() - started)
+    return results
@@ -0,0 +1,138 @@
+"""
+Rolling-window mean vector and covariance matrix with incremental updates.
+
+When the window moves by one day, the entering day is added and the leaving day
+removed with rank-one (Welford-style) updates, O(N^2) per step instead of the
+O(T * N^2) of recomputing the covariance over the whole window.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from portfolio_optimizer.analytics import TRADING_DAYS
+
+
+class RollingMoments:
+    """
+    Mean and sample covariance (ddof=1, as pandas) of the last `window` observations.
+    """
+    def __init__(self, n_assets, window):
+        if window < 2:
+            raise ValueError("window must be at least 2.")
+        self.window = window
+        self.count = 0
+        self.mean = np.zeros(n_assets)
+        self.comoment = np.zeros((n_assets, n_assets))  # sum of (x - mean)(x - mean)'
+        self.buffer = np.empty((window, n_assets))      # ring buffer of the observations in the window
+        self.position = 0
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.comoment += np.outer(delta, x - self.mean)
+
+    def remove(self, x):
+        if self.count <= 1:
+            self.count = 0
+            self.mean[:] = 0
+            self.comoment[:] = 0
+            return
+        old_mean = self.mean.copy()
+        self.count -= 1
+        self.mean = (old_mean * (self.count + 1) - x) / self.count
+        self.comoment -= np.outer(x - self.mean, x - old_mean)
+
+    def push(self, x):
+        """
+        Add one observation, dropping the oldest one once the window is full.
+        """
+        x = np.asarray(x, dtype=float)
+        if self.count == self.window:
+            self.remove(self.buffer[self.position])
+        self.buffer[self.position] = x
+        self.position = (self.position + 1) % self.window
+        self.add(x)
+
+    def recompute(self, observations=None):
+        """
+        Recompute mean and co-moment exactly from the window, or from the given observations
+        when the window is not kept in the ring buffer (clears accumulated rounding error).
+        """
+        if observations is None:
+            observations = self.buffer[:self.count]
+        self.count = len(observations)
+        self.mean = observations.mean(axis=0)
+        centered = observations - self.mean
+        self.comoment = centered.T @ centered
+
+    @property
+    def cov(self):
+        return self.comoment / (self.count - 1)
+
+
+@dataclass
+class MomentSnapshot:
+    """
+    Daily mean vector and covariance matrix of the window ending on `date`.
+    """
+    date: pd.Timestamp
+    stocks: list
+    mean: np.ndarray
+    cov: np.ndarray
+
+    def annualized_moments(self):
+        """
+        Same as analytics.annualized_moments on the window: input for the simulation and optimizers.
+        """
+        return self.mean * TRADING_DAYS, self.cov * TRADING_DAYS
+
+    def asset_metrics(self, risk_free_rate=0.0):
+        """
+        Same table as analytics.asset_metrics on the window.
+        """
+        daily_volatility = np.sqrt(np.diag(self.cov))
+        annualized_return = self.mean * TRADING_DAYS
+        annualized_volatility = daily_volatility * np.sqrt(TRADING_DAYS)
+        return pd.DataFrame({
+            'Mean Daily Return': self.mean,
+            'Annualized Return': annualized_return,
+            'Daily Volatility': daily_volatility,
+            'Annualized Volatility': annualized_volatility,
+            'Sharpe Ratio': (annualized_return - risk_free_rate) / annualized_volatility
+        }, index=self.stocks)
+
+
+def rolling_snapshots(daily_returns, window, step=1, refresh_every=1000, ranges=None):
+    """
+    Yield a MomentSnapshot every `step` days once `window` days are available.
+    `ranges` replaces the fixed window by explicit (start, stop) day positions, e.g. calendar-month
+    windows of varying length; neither end may move backwards. The days entering and leaving between
+    two snapshots are applied as rank-one updates, and the moments are recomputed exactly every
+    `refresh_every` updates to bound rounding drift.
+    """
+    stocks = list(daily_returns.columns)
+    values = daily_returns.to_numpy(dtype=float)
+    if ranges is None:
+        ranges = [(stop - window, stop) for stop in range(window, len(values) + 1, step)]
+    else:
+        ranges = [(int(start), int(stop)) for start, stop in ranges]
+        window = max(stop - start for start, stop in ranges)
+    moments = RollingMoments(len(stocks), window)
+    start, stop, updates = 0, 0, 0
+    for new_start, new_stop in ranges:
+        if new_start < start or new_stop < stop:
+            raise ValueError("The window ranges must not move backwards.")
+        if new_start >= stop or (refresh_every and updates >= refresh_every):
+            # No overlap with the previous window (or time to clear the drift): start from the data
+            moments.recompute(values[new_start:new_stop])
+            updates = 0
+        else:
+            for day in range(stop, new_stop):
+                moments.add(values[day])
+            for day in range(start, new_start):
+                moments.remove(values[day])
+            updates += (new_stop - stop) + (new_start - start)
+        start, stop = new_start, new_stop
+        yield MomentSnapshot(daily_returns.index[stop - 1], stocks, moments.mean.copy(), moments.cov.copy())
@@ -0,0 +1,116 @@
+"""
+Weight samplers for the portfolio simulation.
+
+Every sampler is called as sampler(rng, size, n_assets) and returns a
+(size x n_assets) matrix of long-only weights summing to 1, so any of them can be
+passed as `sampler=` to the simulation functions.
+
+- 'uniform': the original scheme (uniform draws normalized to 1). It is not
+  uniform on the simplex: points concentrate around equal weights, more so as
+  the number of assets grows.
+- 'dirichlet': uniform on the simplex (flat Dirichlet), reaching the corner
+  portfolios as often as the centre.
+- 'sobol' / 'halton': scrambled low-discrepancy points mapped onto the simplex,
+  which cover it more evenly than independent draws (needs scipy).
+
+refine_portfolios adds an adaptive pass that resamples around the current
+frontier and the ES feasibility boundary.
+"""
+import warnings
+
+import numpy as np
+
+from portfolio_optimizer.analytics import evaluate_portfolios, random_weights
+from portfolio_optimizer.frontier import nondominated
+from portfolio_optimizer.risk import portfolio_es
+
+
+def _to_simplex(uniforms):
+    # Normalized exponential spacings map the uniform cube onto the uniform simplex
+    exponentials = -np.log1p(-np.clip(uniforms, 0, 1 - 1e-16))
+    totals = exponentials.sum(axis=1, keepdims=True)
+    totals[totals == 0] = 1.0
+    return exponentials / totals
+
+
+def dirichlet_weights(rng, size, n_assets):
+    """
+    Portfolios drawn uniformly on the simplex (flat Dirichlet).
+    """
+    return _to_simplex(rng.random((size, n_assets)))
+
+
+class QMCWeights:
+    """
+    Scrambled Sobol or Halton points mapped onto the simplex. The scrambling is seeded
+    from `rng`, so every simulation chunk is an independent randomized QMC set.
+    """
+    def __init__(self, method='sobol'):
+        if method not in ('sobol', 'halton'):
+            raise ValueError("method must be 'sobol' or 'halton'.")
+        self.method = method
+
+    def __call__(self, rng, size, n_assets):
+        from scipy.stats import qmc
+        engine_class = qmc.Sobol if self.method == 'sobol' else qmc.Halton
+        engine = engine_class(d=n_assets, scramble=True, seed=rng)
+        with warnings.catch_warnings():
+            # Sobol prefers powers of two; other chunk sizes are still well spread
+            warnings.simplefilter('ignore', UserWarning)
+            return _to_simplex(engine.random(size))
+
+
+SAMPLERS = {
+    'uniform': random_weights,
+    'dirichlet': dirichlet_weights,
+    'sobol': QMCWeights('sobol'),
+    'halton': QMCWeights('halton'),
+}
+
+
+def get_sampler(name):
+    """
+    Sampler by name: 'uniform', 'dirichlet', 'sobol' or 'halton'.
+    """
+    try:
+        return SAMPLERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown sampler '{name}'. Choose one of: {', '.join(SAMPLERS)}.") from None
+
+
+def weights_around(rng, centers, size, concentration=300.0):
+    """
+    Draw `size` portfolios from Dirichlet distributions centred on randomly chosen rows
+    of `centers`. Higher `concentration` keeps the draws closer to their centre.
+    """
+    centers = np.atleast_2d(centers)
+    chosen = centers[rng.integers(len(centers), size=size)]
+    alphas = concentration * chosen + 1e-3
+    draws = rng.standard_gamma(alphas)
+    return draws / draws.sum(axis=1, keepdims=True)
+
+
+def refine_portfolios(weights, returns, volatilities, mean_returns, cov_matrix, risk_free_rate, num_samples,
+                      rng, es=None, monthly_returns=None, confidence_level=0.95, min_es=None,
+                      concentration=300.0, boundary_points=16):
+    """
+    Adaptive refinement pass: resample `num_samples` portfolios around the current
+    return vs. volatility frontier, the return vs. ES frontier (when `es` is given)
+    and the `boundary_points` portfolios closest to the ES feasibility boundary `min_es`.
+
+    Returns (weights, returns, volatilities, sharpe_ratios, es) of the new portfolios;
+    es is None unless `monthly_returns` is given.
+    """
+    centers = nondominated(returns, -volatilities)
+    if es is not None:
+        centers |= nondominated(returns, es)
+        if min_es is not None:
+            centers[np.argsort(np.abs(es - min_es))[:boundary_points]] = True
+
+    new_weights = weights_around(rng, weights[centers], num_samples, concentration)
+    new_returns, new_volatilities, new_sharpe_ratios = evaluate_portfolios(
+        new_weights, mean_returns, cov_matrix, risk_free_rate)
+    new_es = None
+    if monthly_returns is not None:
+        new_es = portfolio_es(monthly_returns, new_weights, confidence_level=confidence_level)
+    return new_weights, new_returns, new_volatilities, new_sharpe_ratios, new_es
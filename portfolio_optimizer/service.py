@@ -0,0 +1,293 @@
+"""
+Local asynchronous HTTP service answering from warm in-memory state.
+
+For each ticker universe (tickers and risk-free rate) the service loads the
+returns from the price store once, then keeps the moments, the simulated
+portfolios, the exact optimal portfolios and, per confidence level, the ES
+vector and its ES index in memory. Warm requests are answered without touching
+the disk or re-simulating. Building a universe or an ES vector runs in a thread
+pool, off the event loop, and concurrent identical requests share one
+computation.
+
+A universe is keyed by the stored version of each of its tickers, so after a
+refresh of the price store (script 02) the next request rebuilds it from the new
+prices. At most `max_universes` universes are kept, least recently used first
+out.
+
+    python -m portfolio_optimizer.service --store price_store --port 8765
+
+Endpoints (GET with query parameters, or POST with a JSON body; tickers as 'AAPL,MSFT'):
+    /metrics    tickers, risk_free_rate                 per-stock metrics and the equal-weight portfolio (02)
+    /frontier   tickers, risk_free_rate, points         max Sharpe, min volatility and the frontier (03)
+    /select     tickers, risk_free_rate, portfolio_size, confidence_level, max_drawdown_dollars, mode
+                                                        ES-feasible highest-return portfolio (04)
+    /health
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from portfolio_optimizer.analytics import annualized_moments, asset_metrics
+from portfolio_optimizer.optimize import max_return_es_weights, max_sharpe_weights, min_variance_weights, portfolio_row
+from portfolio_optimizer.parallel import parallel_simulate
+from portfolio_optimizer.plotting import frontier_line
+from portfolio_optimizer.profiles import InvestorProfile, ProfileEngine
+from portfolio_optimizer.results import PortfolioResults
+from portfolio_optimizer.risk import monthly_asset_returns, portfolio_es
+from portfolio_optimizer.store import PriceStore
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class Universe:
+    """
+    Warm state of one ticker universe: returns, moments, simulated portfolios and
+    the ES vectors computed so far (held by the ProfileEngine).
+    """
+    def __init__(self, stocks, daily_returns, risk_free_rate, num_portfolios, seed, workers):
+        self.stocks = list(stocks)
+        self.daily_returns = daily_returns
+        self.risk_free_rate = risk_free_rate
+        self.mean_returns, self.cov_matrix = annualized_moments(daily_returns)
+        self.monthly_returns = monthly_asset_returns(daily_returns)
+        weights, returns, volatilities, sharpe_ratios, _ = parallel_simulate(
+            self.mean_returns, self.cov_matrix, num_portfolios, risk_free_rate, seed=seed, workers=workers)
+        self.returns, self.volatilities = returns, volatilities
+        portfolio_results = PortfolioResults(self.stocks, weights, {'Return': returns, 'Volatility': volatilities,
+                                                                    'Sharpe Ratio': sharpe_ratios})
+        self.engine = ProfileEngine(portfolio_results, self.monthly_returns, workers=workers)
+        self.frontier = frontier_line(volatilities, returns)
+        self.max_sharpe = portfolio_row(max_sharpe_weights(self.mean_returns, self.cov_matrix, risk_free_rate),
+                                        self.mean_returns, self.cov_matrix, risk_free_rate, self.stocks)
+        self.min_volatility = portfolio_row(min_variance_weights(self.cov_matrix),
+                                            self.mean_returns, self.cov_matrix, risk_free_rate, self.stocks)
+        self.exact_selections = {}
+
+
+def _portfolio(row, stocks):
+    # JSON view of a portfolio Series (metrics plus a weights mapping)
+    weight_columns = [stock + ' Weight' for stock in stocks]
+    payload = {name: float(value) for name, value in row.items() if name not in weight_columns}
+    payload['Weights'] = {stock: float(row[stock + ' Weight']) for stock in stocks}
+    return payload
+
+
+class OptimizerService:
+    def __init__(self, store='price_store', years=5, num_portfolios=100000, seed=0, workers=1, threads=4,
+                 max_universes=8):
+        self.store = PriceStore(store) if isinstance(store, str) else store
+        self.years = years
+        self.num_portfolios = num_portfolios
+        self.seed = seed
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.max_universes = max_universes
+        self.universes = OrderedDict()
+        self.inflight = {}
+        self.routes = {'/metrics': self.metrics, '/frontier': self.frontier, '/select': self.select,
+                       '/health': self.health}
+
+    async def _once(self, key, function, *args):
+        """
+        Run function(*args) in the thread pool; concurrent calls with the same key share the result.
+        """
+        future = self.inflight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+            self.inflight[key] = future
+            future.add_done_callback(lambda _: self.inflight.pop(key, None))
+        # Shielded, so a client going away does not cancel the computation for the others
+        return await asyncio.shield(future)
+
+    def _load_universe(self, tickers, risk_free_rate):
+        end_date = pd.Timestamp(datetime.date.today())
+        start_date = end_date - pd.DateOffset(years=self.years)
+        financial_data = self.store.load_prices(tickers, start=start_date, end=end_date)
+        missing = [ticker for ticker in tickers if ticker not in financial_data.columns]
+        if missing:
+            raise ValueError(f"No stored prices for {', '.join(missing)}. Run script 02 first.")
+        daily_returns = financial_data.pct_change(fill_method=None).dropna()
+        return Universe(tickers, daily_returns, risk_free_rate, self.num_portfolios, self.seed, self.workers)
+
+    async def universe(self, params):
+        tickers = sorted(dict.fromkeys(ticker.strip().upper() for ticker in params['tickers'].split(',')
+                                       if ticker.strip()))
+        if len(tickers) < 2:
+            raise ValueError("At least two tickers are needed.")
+        self.store.reload()
+        key = (tuple(tickers), float(params.get('risk_free_rate', 0.0)),
+               tuple(self.store.version(ticker) for ticker in tickers))
+        if key in self.universes:
+            self.universes.move_to_end(key)
+            return key, self.universes[key]
+        universe = await self._once(('universe', key), self._load_universe, list(key[0]), key[1])
+        # Versions built from older prices are not served any more
+        for stale in [other for other in self.universes if other[:2] == key[:2]]:
+            del self.universes[stale]
+        self.universes[key] = universe
+        while len(self.universes) > self.max_universes:
+            self.universes.popitem(last=False)
+        return key, universe
+
+    async def health(self, params):
+        return {'status': 'ok', 'universes': len(self.universes), 'max_universes': self.max_universes}
+
+    async def metrics(self, params):
+        _, universe = await self.universe(params)
+        daily_returns = universe.daily_returns
+        metrics = asset_metrics(daily_returns, universe.risk_free_rate)
+        # Equal-weight portfolio, as in script 02 (Sharpe ratio without the risk-free rate)
+        portfolio_daily_return = daily_returns.mean(axis=1)
+        annualized_return = portfolio_daily_return.mean() * 252
+        volatility = portfolio_daily_return.std() * np.sqrt(252)
+        return {'stocks': {stock: {name: float(value) for name, value in row.items()}
+                           for stock, row in metrics.iterrows()},
+                'portfolio': {'Annualized Return': float(annualized_return), 'Volatility': float(volatility),
+                              'Sharpe Ratio': float(annualized_return / volatility)}}
+
+    async def frontier(self, params):
+        _, universe = await self.universe(params)
+        volatilities, returns = universe.frontier
+        points = int(params.get('points', 100))
+        if points < 1:
+            raise ValueError("points must be at least 1.")
+        keep = np.unique(np.linspace(0, len(volatilities) - 1, min(points, len(volatilities))).astype(int))
+        return {'max_sharpe': _portfolio(universe.max_sharpe, universe.stocks),
+                'min_volatility': _portfolio(universe.min_volatility, universe.stocks),
+                'frontier': {'Volatility': volatilities[keep].tolist(), 'Return': returns[keep].tolist()}}
+
+    def _exact_selection(self, universe, profile):
+        weights = max_return_es_weights(universe.mean_returns, universe.monthly_returns, profile.confidence_level,
+                                        profile.max_drawdown_dollars / profile.portfolio_size)
+        if weights is None:
+            return None
+        row = portfolio_row(weights, universe.mean_returns, universe.cov_matrix, universe.risk_free_rate,
+                            universe.stocks)
+        row['ES'] = portfolio_es(universe.monthly_returns, weights, confidence_level=profile.confidence_level)[0]
+        return row
+
+    async def select(self, params):
+        profile = InvestorProfile(name='request', portfolio_size=float(params['portfolio_size']),
+                                  confidence_level=float(params['confidence_level']),
+                                  max_drawdown_dollars=float(params['max_drawdown_dollars'])).validate()
+        key, universe = await self.universe(params)
+        if params.get('mode', 'sampling') == 'exact':
+            selection_key = (profile.confidence_level, profile.min_es)
+            if selection_key not in universe.exact_selections:
+                universe.exact_selections[selection_key] = await self._once(
+                    ('exact', key, selection_key), self._exact_selection, universe, profile)
+            optimal_portfolio = universe.exact_selections[selection_key]
+            feasible_count = None
+            if optimal_portfolio is not None:
+                optimal_portfolio = optimal_portfolio.copy()
+                optimal_portfolio['ES_dollars'] = optimal_portfolio['ES'] * profile.portfolio_size
+        else:
+            if profile.confidence_level not in universe.engine.indexes:
+                # ES vector and ES index for a new confidence level, built once
+                await self._once(('es', key, profile.confidence_level), universe.engine.index,
+                                 profile.confidence_level)
+            optimal_portfolio, feasible_count = universe.engine.optimal_portfolio(profile)
+        return {'feasible_portfolios': None if feasible_count is None else int(feasible_count),
+                'optimal_portfolio': None if optimal_portfolio is None else _portfolio(optimal_portfolio,
+                                                                                       universe.stocks)}
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        handler = self.routes.get(url.path)
+        if handler is None:
+            return 404, {'error': f"Unknown path {url.path}"}
+        if method not in ('GET', 'POST'):
+            return 405, {'error': f"Method {method} not allowed"}
+        params = dict(parse_qsl(url.query))
+        try:
+            if body:
+                payload = json.loads(body)
+                if not isinstance(payload, dict):
+                    return 400, {'error': "The JSON body must be an object"}
+                params.update(payload)
+            return 200, await handler(params)
+        except KeyError as e:
+            return 400, {'error': f"Missing parameter {e}"}
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            return 500, {'error': f"{type(e).__name__}: {e}"}
+
+    async def handle(self, reader, writer):
+        # Minimal HTTP/1.1 with keep-alive, enough for a local JSON client
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                started = time.perf_counter()
+                status, payload = await self.dispatch(method, target, body)
+                data = json.dumps(payload).encode()
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                writer.write((f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                              f"Content-Type: application/json\r\n"
+                              f"Content-Length: {len(data)}\r\n"
+                              f"X-Elapsed-Ms: {1000 * (time.perf_counter() - started):.2f}\r\n"
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765, preload=()):
+        for tickers in preload:
+            await self.universe({'tickers': tickers})
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--store', default='price_store', help='price store filled by script 02')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--years', type=int, default=5, help='years of history to use')
+    parser.add_argument('--num-portfolios', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1, help='processes per simulation / ES computation')
+    parser.add_argument('--threads', type=int, default=4, help='universes or ES vectors computed at the same time')
+    parser.add_argument('--max-universes', type=int, default=8, help='universes kept in memory (least recently used '
+                                                                     'are dropped)')
+    parser.add_argument('--preload', nargs='*', default=[], help="universes to warm up at start, e.g. AAPL,MSFT,VB")
+    args = parser.parse_args(argv)
+
+    service = OptimizerService(args.store, args.years, args.num_portfolios, args.seed, args.workers, args.threads,
+                               args.max_universes)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.preload))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,199 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from portfolio_optimizer import instrument
+from portfolio_optimizer.data import fetch_prices
+from portfolio_optimizer.files import _atomic_write_json
+
+DATES_FILE = 'dates.i8'
+PRICES_FILE = 'close.f8'
+INDEX_FILE = 'index.json'
+
+
+class PriceStore:
+    """
+    Persistent local store of adjusted close prices.
+
+    Each ticker is one partition: a directory holding two raw, memory-mappable
+    columns (dates as int64 nanoseconds and prices as float64). index.json keeps
+    the number of rows and the last stored date per ticker, so a refresh only
+    fetches the last few stored bars again plus the newer ones. Adjusted closes
+    are revised backwards after every dividend and split: when the re-fetched
+    overlap no longer matches the stored bars, the ticker's partition is
+    rewritten from a fresh download instead of appended to.
+    """
+    def __init__(self, root='price_store'):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.index_mtime = None
+        self.index = self._read_index()
+
+    def _read_index(self):
+        path = os.path.join(self.root, INDEX_FILE)
+        if not os.path.exists(path):
+            return {}
+        self.index_mtime = os.stat(path).st_mtime_ns
+        with open(path, encoding='UTF-8') as f:
+            return json.load(f)
+
+    def reload(self):
+        """
+        Re-read index.json if another process (e.g. a refresh by script 02) changed it.
+        """
+        path = os.path.join(self.root, INDEX_FILE)
+        if os.path.exists(path) and os.stat(path).st_mtime_ns != self.index_mtime:
+            self.index = self._read_index()
+
+    def _write_index(self):
+        path = os.path.join(self.root, INDEX_FILE)
+        _atomic_write_json(path, self.index)
+        self.index_mtime = os.stat(path).st_mtime_ns
+
+    def _partition(self, ticker):
+        return os.path.join(self.root, ticker)
+
+    def tickers(self):
+        return sorted(self.index)
+
+    def last_date(self, ticker):
+        """
+        Last stored date for `ticker`, or None if the ticker is not in the store.
+        """
+        entry = self.index.get(ticker)
+        return pd.Timestamp(entry['last_date']) if entry else None
+
+    def version(self, ticker):
+        """
+        Stored range and revision of `ticker` (None if not stored). It changes whenever
+        the ticker's prices do: on an append and on a rewrite of revised history.
+        """
+        entry = self.index.get(ticker)
+        return (entry['first_date'], entry['last_date'], entry['rows'], entry.get('revision', 0)) if entry else None
+
+    def append(self, ticker, prices):
+        """
+        Append the prices dated after the last stored date. Returns the number of new rows.
+        """
+        prices = prices.dropna()
+        if prices.index.tz is not None:
+            prices.index = prices.index.tz_localize(None)
+        last = self.last_date(ticker)
+        if last is not None:
+            prices = prices[prices.index > last]
+        prices = prices.sort_index()
+        if prices.empty:
+            return 0
+
+        partition = self._partition(ticker)
+        os.makedirs(partition, exist_ok=True)
+        rows = self.index.get(ticker, {}).get('rows', 0)
+        new_columns = {DATES_FILE: prices.index.values.astype('datetime64[ns]').astype(np.int64),
+                       PRICES_FILE: prices.to_numpy(dtype=np.float64)}
+        for name, values in new_columns.items():
+            with open(os.path.join(partition, name), 'ab') as f:
+                # Drop anything written after the last indexed row (e.g. an interrupted append)
+                f.truncate(rows * values.itemsize)
+                f.write(values.tobytes())
+
+        entry = self.index.setdefault(ticker, {'first_date': str(prices.index[0].date())})
+        entry['rows'] = rows + len(prices)
+        entry['last_date'] = str(prices.index[-1].date())
+        self._write_index()
+        return len(prices)
+
+    def read(self, ticker):
+        """
+        Zero-copy, read-only memory maps of a partition: (dates as int64 ns, prices).
+        """
+        rows = self.index[ticker]['rows']
+        partition = self._partition(ticker)
+        dates = np.memmap(os.path.join(partition, DATES_FILE), dtype=np.int64, mode='r', shape=(rows,))
+        prices = np.memmap(os.path.join(partition, PRICES_FILE), dtype=np.float64, mode='r', shape=(rows,))
+        return dates, prices
+
+    def load_series(self, ticker, start=None, end=None):
+        """
+        Prices of one ticker in [start, end) as a Series backed by the memory map.
+        """
+        dates, prices = self.read(ticker)
+        lo = 0 if start is None else np.searchsorted(dates, pd.Timestamp(start).value)
+        hi = len(dates) if end is None else np.searchsorted(dates, pd.Timestamp(end).value)
+        index = pd.DatetimeIndex(dates[lo:hi].view('datetime64[ns]'))
+        return pd.Series(prices[lo:hi], index=index, name=ticker, copy=False)
+
+    def load_prices(self, tickers, start=None, end=None):
+        """
+        Prices of several tickers in [start, end), aligned on their dates (one column per ticker).
+        Tickers that are not in the store are left out. Aligning the tickers copies their
+        prices out of the memory maps; load_series and read give the memory-mapped data.
+        """
+        with instrument.stage('store_read') as stage:
+            columns = {ticker: self.load_series(ticker, start, end) for ticker in tickers if ticker in self.index}
+            stage.add(tickers=len(columns), bytes=sum(16 * len(series) for series in columns.values()))
+            return pd.DataFrame(columns)
+
+    def rewrite(self, ticker, prices):
+        """
+        Replace the partition of `ticker` with `prices`. Returns the number of rows stored.
+        """
+        previous = self.index.pop(ticker, None)
+        if previous is not None:
+            self._write_index()
+        shutil.rmtree(self._partition(ticker), ignore_errors=True)
+        rows = self.append(ticker, prices)
+        if previous is not None and ticker in self.index:
+            # Counted, so readers can tell a rewritten history from the old one with the same dates
+            self.index[ticker]['revision'] = previous.get('revision', 0) + 1
+            self._write_index()
+        return rows
+
+    def matches(self, ticker, prices, rtol=1e-6):
+        """
+        True if the stored prices agree with `prices` (within `rtol`) on their common dates.
+        """
+        prices = prices.dropna()
+        if prices.index.tz is not None:
+            prices = prices.tz_localize(None)
+        stored = self.load_series(ticker, start=prices.index.min()) if len(prices) else prices
+        common = stored.index.intersection(prices.index)
+        return bool(np.allclose(stored[common].to_numpy(), prices[common].to_numpy(dtype=np.float64),
+                                rtol=rtol, atol=0.0))
+
+    def refresh(self, tickers, start, end, source=None, cached=None, overlap_days=7, rtol=1e-6, **fetch_kwargs):
+        """
+        Bring the store up to date for `tickers` over [start, end).
+        New tickers are fetched from `start`; stored tickers from `overlap_days` before
+        their last stored date. If the overlapping bars differ from the stored ones by more
+        than `rtol` (the adjusted history was revised by a dividend or a split), the whole
+        history of the ticker is downloaded again and its partition rewritten.
+        Returns the number of rows appended (or rewritten) per ticker.
+        """
+        groups = {}
+        for ticker in tickers:
+            last = self.last_date(ticker)
+            fetch_start = pd.Timestamp(start) if last is None else last - pd.Timedelta(days=overlap_days)
+            if fetch_start < pd.Timestamp(end):
+                groups.setdefault(fetch_start, []).append(ticker)
+
+        appended = {ticker: 0 for ticker in tickers}
+        revised = []
+        for fetch_start, group in groups.items():
+            data = fetch_prices(group, fetch_start, end, source=source, cached=cached, **fetch_kwargs)
+            for ticker in data.columns:
+                if ticker in self.index and not self.matches(ticker, data[ticker], rtol):
+                    revised.append(ticker)
+                else:
+                    appended[ticker] = self.append(ticker, data[ticker])
+
+        if revised:
+            # Keep the stored history that starts before `start`
+            history_start = min([pd.Timestamp(start)] + [pd.Timestamp(self.index[ticker]['first_date'])
+                                                         for ticker in revised])
+            data = fetch_prices(revised, history_start, end, source=source, **fetch_kwargs)
+            for ticker in data.columns:
+                appended[ticker] = self.rewrite(ticker, data[ticker])
+        return appended
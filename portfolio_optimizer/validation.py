@@ -0,0 +1,168 @@
+"""
+Bulk, cached ticker validation.
+
+A ticker is valid when Yahoo Finance knows it (it has a short name) and it has
+at least `min_years` of price history in the requested window. Metadata
+(validity, short name, first trade date) is looked up concurrently and kept in
+a JSON cache with a time-to-live, so validating a standing ticker list again
+needs no request at all. The history check is answered from the first trade
+date when it is known; only the remaining tickers are downloaded, all in one
+batched request, and their prices are handed back for the price store.
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from portfolio_optimizer import instrument
+from portfolio_optimizer.data import SYNTHETIC_ORIGIN, fetch_prices
+from portfolio_optimizer.files import _atomic_write_json
+
+DAYS_PER_YEAR = 365.25
+
+
+class YahooMetadataSource:
+    """
+    Ticker metadata from Yahoo Finance (one request per ticker).
+    """
+    def lookup(self, ticker):
+        import yfinance as yf
+        info = yf.Ticker(ticker).info or {}
+        first_trade = info.get('firstTradeDateEpochUtc')
+        return {'valid': bool(info.get('shortName')), 'short_name': info.get('shortName'),
+                'first_trade_date': pd.Timestamp(first_trade, unit='s').strftime('%Y-%m-%d') if first_trade else None}
+
+
+class StubMetadataSource:
+    """
+    Offline stand-in for YahooMetadataSource. Tickers in `invalid` are unknown,
+    the others were first traded on `first_trade_dates[ticker]` (SYNTHETIC_ORIGIN
+    by default, which matches StubPriceSource).
+    """
+    def __init__(self, first_trade_dates=None, invalid=(), latency=0.0):
+        self.first_trade_dates = dict(first_trade_dates or {})
+        self.invalid = set(invalid)
+        self.latency = latency
+        self.requests = 0
+
+    def lookup(self, ticker):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if ticker in self.invalid:
+            return {'valid': False, 'short_name': None, 'first_trade_date': None}
+        return {'valid': True, 'short_name': ticker,
+                'first_trade_date': self.first_trade_dates.get(ticker, SYNTHETIC_ORIGIN)}
+
+
+class MetadataCache:
+    """
+    Ticker metadata persisted in a JSON file. Entries older than `ttl` seconds
+    are treated as missing. A first trade date with 'first_trade_exact' False is
+    only an upper bound (the first date seen in a downloaded window).
+    """
+    def __init__(self, path='ticker_cache.json', ttl=7 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path, encoding='UTF-8') as f:
+                self.entries = json.load(f)
+
+    def get(self, ticker):
+        entry = self.entries.get(ticker)
+        if entry is None or time.time() - entry['checked'] > self.ttl:
+            return None
+        return entry
+
+    def put(self, ticker, entry):
+        self.entries[ticker] = dict(entry, checked=time.time())
+
+    def save(self):
+        if not self.path:
+            return
+        _atomic_write_json(self.path, self.entries)
+
+
+def _years_between(first, last):
+    return (pd.Timestamp(last) - pd.Timestamp(first)).days / DAYS_PER_YEAR
+
+
+def validate_tickers(tickers, start, end, min_years=3, metadata_source=None, price_source=None, cache=None,
+                     max_workers=8, price_cache=None):
+    """
+    Validate a list of tickers. Returns (valid tickers in input order, {rejected ticker: reason}).
+
+    Metadata missing from `cache` is looked up on at most `max_workers` threads.
+    Price frames downloaded for the history check are stored in `price_cache`
+    (ticker -> Series) so they can be reused by fetch_prices / PriceStore.refresh.
+    """
+    metadata_source = metadata_source or YahooMetadataSource()
+    cache = cache if cache is not None else MetadataCache(path=None)
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    tickers = list(dict.fromkeys(ticker.upper().strip() for ticker in tickers))
+    rejected = {}
+
+    with instrument.stage('validation', tickers=len(tickers)) as stage:
+        metadata = {ticker: cache.get(ticker) for ticker in tickers}
+        missing = [ticker for ticker, entry in metadata.items() if entry is None]
+        if missing:
+            def lookup(ticker):
+                try:
+                    return dict(metadata_source.lookup(ticker), first_trade_exact=True)
+                except Exception as e:
+                    return e
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(missing)))) as pool:
+                for ticker, entry in zip(missing, pool.map(lookup, missing)):
+                    if isinstance(entry, Exception):
+                        # Lookup errors are not cached, the ticker is tried again next time
+                        rejected[ticker] = f"could not be looked up ({entry})"
+                        continue
+                    metadata[ticker] = entry
+                    cache.put(ticker, entry)
+            stage.add(metadata_requests=len(missing))
+
+        # History check from the first trade date when it settles the question
+        to_download = []
+        for ticker in tickers:
+            entry = metadata[ticker]
+            if ticker in rejected:
+                continue
+            if not entry['valid']:
+                rejected[ticker] = "is not a valid ticker"
+                continue
+            first_trade = entry.get('first_trade_date')
+            if first_trade is None:
+                to_download.append(ticker)
+                continue
+            years = _years_between(max(pd.Timestamp(first_trade), start), end)
+            if years < min_years:
+                if entry.get('first_trade_exact'):
+                    rejected[ticker] = f"does not have at least {min_years} years of history (only {years:.2f} years)"
+                else:
+                    to_download.append(ticker)
+
+        # The remaining tickers are checked on their prices, downloaded in one batched request
+        if to_download:
+            data = fetch_prices(to_download, start, end, source=price_source)
+            for ticker in to_download:
+                prices = data[ticker].dropna() if ticker in data.columns else pd.Series(dtype=float)
+                if prices.empty:
+                    rejected[ticker] = "returned no data"
+                    continue
+                # The first date seen is exact only if the history starts inside the window
+                first_seen = prices.index[0]
+                entry = dict(metadata[ticker], first_trade_date=first_seen.strftime('%Y-%m-%d'),
+                             first_trade_exact=bool(first_seen > start + pd.Timedelta(days=7)))
+                cache.put(ticker, entry)
+                years = _years_between(first_seen, prices.index[-1])
+                if years < min_years:
+                    rejected[ticker] = f"does not have at least {min_years} years of history (only {years:.2f} years)"
+                elif price_cache is not None:
+                    price_cache[ticker] = prices
+            stage.add(price_downloads=len(to_download))
+
+    cache.save()
+    return [ticker for ticker in tickers if ticker not in rejected], rejected